@@ -2,7 +2,7 @@ import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
 from gurobipy import *
-import pickle
+from ev2gym.models.replay import load_replay
 
 
 class V2GProfitMaxOracleGB():
@@ -18,7 +18,7 @@ class V2GProfitMaxOracleGB():
                  verbose=True,
                  **kwargs):
 
-        replay = pickle.load(open(replay_path, 'rb'))
+        replay = load_replay(replay_path)
 
         self.sim_length = replay.sim_length
         self.n_cs = replay.n_cs
@@ -109,7 +109,12 @@ class MPC(ABC):
 
             if index == 0:
                 # Assume all EVs have the same charging and discharging efficiency !!!                
-                if isinstance(EV.charge_efficiency, dict):
+                if isinstance(EV.charge_efficiency, np.ndarray):
+                    # get the highest value of the efficiency curve
+                    key = np.argmax(EV.charge_efficiency)
+                    self.ch_eff = EV.charge_efficiency[key]
+                    self.disch_eff = EV.discharge_efficiency[key]
+                elif isinstance(EV.charge_efficiency, dict):
                     # get the highest value of the dictionary
                     key = max(EV.charge_efficiency, key=EV.charge_efficiency.get)                    
                     self.ch_eff = EV.charge_efficiency[key]
@@ -233,25 +238,22 @@ class MPC(ABC):
         This function updates the transformer power limits, loads and PV generation for the next control horizon based on forecasts.
         '''
 
-        for i, tr in enumerate(self.env.transformers):
-            self.tr_power_limit[i, :] = tr.get_power_limits(
-                step=t, horizon=self.control_horizon)
-
-            self.tr_pv[i, :] = np.zeros(self.control_horizon)
-            self.tr_pv[i, 0] = tr.solar_power[tr.current_step+1]
-            l = len(tr.pv_generation_forecast[tr.current_step + 2:
-                                              tr.current_step+self.control_horizon+1])
-
-            if l >= self.control_horizon - 1:
-                l = self.control_horizon - 1
-            else:
-                l = l + 1
-            self.tr_pv[i, 1:l] = tr.pv_generation_forecast[tr.current_step + 2:
-                                                           tr.current_step+self.control_horizon]
-            self.tr_loads[i, :] = np.zeros(self.control_horizon)
-            self.tr_loads[i, 0] = tr.inflexible_load[tr.current_step+1]
-            self.tr_loads[i, 1:l] = tr.inflexible_load_forecast[tr.current_step + 2:
-                                                                tr.current_step+self.control_horizon]
+        forecasts = self.env.transformer_forecasts
+        self.tr_power_limit[:, :] = forecasts.get_power_limits(
+            step=t, horizon=self.control_horizon)
+
+        # the realised PV and loads of the next step, followed by the forecasts
+        # of the rest of the horizon (zero after the end of the simulation)
+        step = self.env.transformers[0].current_step
+        pv = forecasts.pv_forecast[:, step+2:step+self.control_horizon]
+        loads = forecasts.load_forecast[:, step+2:step+self.control_horizon]
+
+        self.tr_pv[:, :] = 0
+        self.tr_pv[:, 0] = forecasts.solar_power[:, step+1]
+        self.tr_pv[:, 1:1+pv.shape[1]] = pv
+        self.tr_loads[:, :] = 0
+        self.tr_loads[:, 0] = forecasts.inflexible_load[:, step+1]
+        self.tr_loads[:, 1:1+loads.shape[1]] = loads
 
     def update_tr_power_oracle(self, t):
         '''
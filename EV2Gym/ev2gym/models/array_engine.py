@@ -0,0 +1,633 @@
+'''
+This file contains the ArrayEngine class, an optional struct-of-arrays core that steps
+all the ports of the charging network at once.
+'''
+
+import numpy as np
+
+from ev2gym.models.ev import charge_batch, discharge_batch, lookup_efficiency, ceil_capacity
+
+# Efficiency curves are stored per port with one value per rounded current level (0-100 A).
+# The last column is used for current levels that are not part of the curve.
+EFFICIENCY_CURVE_LENGTH = 102
+
+
+class ArrayEngine():
+    '''
+    Array-backed simulation core of the EV2Gym environment.
+
+    The state of every port (occupancy, battery status, limits and transformer assignment)
+    is kept in NumPy arrays indexed by the global port offset (charging stations in id order,
+    ports in order inside every charging station). The charger action normalization,
+    the two-stage battery model and the transformer aggregation are then computed as
+    whole-array operations.
+
+    The EV and EV_Charger objects remain the public interface of the environment:
+    after every step their status variables are written back from the arrays, so that
+    agents, state and reward functions keep working unchanged.
+
+    Static variables:
+        - port_cs: the charging station of every port
+        - port_number: the index of every port inside its charging station
+        - cs_port_offset: the global offset of the first port of every charging station
+        - cs_transformer: the transformer of every charging station
+        - port_voltage, port_phases, port_max_charge_current, ...: charger limits per port
+
+    Status variables:
+        - occupied: whether an EV is connected to the port
+        - current_capacity, battery_capacity, ...: the status of the connected EVs
+        - cs_power, cs_current, cs_profits: the outputs of the charging stations in the last step
+
+    Methods:
+        - reset: disconnects all EVs
+        - connect_ev: loads an EV in the arrays of a port
+        - step: steps all the charging stations and EVs at once
+        - get_state/set_state: copy the status arrays (see EV2Gym.snapshot)
+    '''
+
+    # Per-port EV variables, they are loaded from the EV objects when they arrive
+    _EV_FLOAT_VARIABLES = ('current_capacity',
+                           'prev_capacity',
+                           'battery_capacity',
+                           'min_battery_capacity',
+                           'min_emergency_battery_capacity',
+                           'max_ac_charge_power',
+                           'min_ac_charge_power',
+                           'max_discharge_power',
+                           'min_discharge_power',
+                           'transition_soc',
+                           'transition_soc_multiplier',
+                           'current_energy',
+                           'actual_current',
+                           'previous_power',
+                           'required_energy',
+                           'total_energy_exchanged',
+                           'abs_total_energy_exchanged',
+                           'soc_sum',
+                           'active_soc_mean',
+                           'active_soc_abs_deviation',
+                           )
+    _EV_INT_VARIABLES = ('ev_phases',
+                         'time_of_arrival',
+                         'time_of_departure',
+                         'charging_cycles',
+                         'min_emergency_battery_capacity_metric',
+                         'soc_steps',
+                         'active_soc_steps',
+                         )
+    # Variables written back to the EV objects after every step
+    _EV_SYNC_VARIABLES = ('current_capacity',
+                          'prev_capacity',
+                          'current_energy',
+                          'actual_current',
+                          'previous_power',
+                          'required_energy',
+                          'total_energy_exchanged',
+                          'abs_total_energy_exchanged',
+                          'charging_cycles',
+                          'min_emergency_battery_capacity_metric',
+                          'soc_sum',
+                          'soc_steps',
+                          'active_soc_steps',
+                          'active_soc_mean',
+                          'active_soc_abs_deviation',
+                          )
+    # All the per-port and per-charging station status arrays
+    _PORT_VARIABLES = _EV_FLOAT_VARIABLES + _EV_INT_VARIABLES + \
+        ('occupied', 'current_signal',
+         'charge_efficiency', 'discharge_efficiency')
+    _CS_VARIABLES = ('cs_power',
+                     'cs_current',
+                     'cs_profits',
+                     'cs_energy_charged',
+                     'cs_energy_discharged',
+                     )
+
+    def __init__(self, env):
+
+        self.timescale = env.timescale
+        self.charging_stations = env.charging_stations
+        self.n_cs = len(env.charging_stations)
+        self.n_transformers = len(env.transformers)
+
+        n_ports = np.array([cs.n_ports for cs in self.charging_stations])
+        self.n_ports = int(n_ports.sum())
+
+        self.cs_port_offset = np.concatenate(([0], np.cumsum(n_ports)[:-1]))
+        self.port_cs = np.repeat(np.arange(self.n_cs), n_ports)
+        self.port_number = np.arange(self.n_ports) - \
+            self.cs_port_offset[self.port_cs]
+
+        self.cs_transformer = np.array([cs.connected_transformer
+                                        for cs in self.charging_stations],
+                                       dtype=int)
+        cs_max_charge_current = np.array([cs.max_charge_current
+                                          for cs in self.charging_stations], dtype=float)
+        cs_min_charge_current = np.array([cs.min_charge_current
+                                          for cs in self.charging_stations], dtype=float)
+        cs_max_discharge_current = np.array([cs.max_discharge_current
+                                             for cs in self.charging_stations], dtype=float)
+        cs_min_discharge_current = np.array([cs.min_discharge_current
+                                             for cs in self.charging_stations], dtype=float)
+        cs_voltage = np.array([cs.voltage for cs in self.charging_stations],
+                              dtype=float)
+        cs_phases = np.array([cs.phases for cs in self.charging_stations],
+                             dtype=int)
+
+        self.cs_max_charge_current = cs_max_charge_current
+        self.port_max_charge_current = cs_max_charge_current[self.port_cs]
+        self.port_min_charge_current = cs_min_charge_current[self.port_cs]
+        self.port_max_discharge_current = cs_max_discharge_current[self.port_cs]
+        self.port_min_discharge_current = cs_min_discharge_current[self.port_cs]
+        self.port_voltage = cs_voltage[self.port_cs]
+        self.port_phases = cs_phases[self.port_cs]
+
+        self._allocate()
+        self.reset()
+
+    def _allocate(self) -> None:
+        '''Allocates the status arrays of all ports and charging stations'''
+
+        for name in self._EV_FLOAT_VARIABLES + ('current_signal',):
+            setattr(self, name, np.zeros(self.n_ports))
+        for name in self._EV_INT_VARIABLES:
+            setattr(self, name, np.zeros(self.n_ports, dtype=int))
+        self.occupied = np.zeros(self.n_ports, dtype=bool)
+
+        self.charge_efficiency = np.ones((self.n_ports,
+                                          EFFICIENCY_CURVE_LENGTH))
+        self.discharge_efficiency = np.ones((self.n_ports,
+                                             EFFICIENCY_CURVE_LENGTH))
+
+        for name in self._CS_VARIABLES:
+            setattr(self, name, np.zeros(self.n_cs))
+
+    def reset(self) -> None:
+        '''Disconnects all EVs and clears the status arrays in place'''
+
+        self.evs = [None] * self.n_ports
+
+        for name in self._PORT_VARIABLES + self._CS_VARIABLES:
+            getattr(self, name)[:] = 0
+        # battery_capacity is used as a divisor, keep it non-zero in empty ports
+        self.battery_capacity[:] = 1
+        self.charge_efficiency[:] = 1
+        self.discharge_efficiency[:] = 1
+
+    def connect_ev(self, ev, cs_id, index) -> None:
+        '''Loads the status of an EV that was just connected to port index of charging station cs_id'''
+
+        port = self.cs_port_offset[cs_id] + index
+        assert not self.occupied[port], f'Port {index} of CS {cs_id} is occupied'
+
+        self.occupied[port] = True
+        self.evs[port] = ev
+
+        for name in self._EV_FLOAT_VARIABLES + self._EV_INT_VARIABLES:
+            getattr(self, name)[port] = getattr(ev, name)
+
+        self.charge_efficiency[port] = efficiency_curve(ev.charge_efficiency)
+        # the discharge efficiency curve is only used if the charge efficiency is a curve as well
+        if isinstance(ev.charge_efficiency, (dict, np.ndarray)):
+            self.discharge_efficiency[port] = efficiency_curve(
+                ev.discharge_efficiency)
+        else:
+            self.discharge_efficiency[port] = ev.discharge_efficiency
+
+    def get_state(self) -> dict:
+        '''Returns a copy of the status arrays, without the efficiency curves'''
+        state = {name: getattr(self, name).copy()
+                 for name in self._PORT_VARIABLES + self._CS_VARIABLES
+                 if name not in ('charge_efficiency', 'discharge_efficiency')}
+        state['evs'] = list(self.evs)
+        return state
+
+    def set_state(self, state) -> None:
+        '''Restores the status arrays of get_state in place'''
+        for port, ev in enumerate(state['evs']):
+            # the efficiency curves only change when another EV is connected
+            if ev is not None and ev is not self.evs[port]:
+                self.charge_efficiency[port] = efficiency_curve(ev.charge_efficiency)
+                if isinstance(ev.charge_efficiency, (dict, np.ndarray)):
+                    self.discharge_efficiency[port] = efficiency_curve(
+                        ev.discharge_efficiency)
+                else:
+                    self.discharge_efficiency[port] = ev.discharge_efficiency
+
+        self.evs = list(state['evs'])
+        for name, values in state.items():
+            if name != 'evs':
+                getattr(self, name)[:] = values
+
+    def step(self, actions, charge_prices, discharge_prices, current_step):
+        '''
+        Steps all charging stations and connected EVs at once
+        Inputs:
+            - actions: a vector of size "Sum of all ports of all charging stations" taking values in [-1,1]
+            - charge_prices: the charge price of every charging station in the current timestep
+            - discharge_prices: the discharge price of every charging station in the current timestep
+            - current_step: the current simulation timestep
+        Outputs:
+            - total_costs: the total profit + costs of charging and discharging in the current timestep
+            - user_satisfaction_list: the user satisfaction of the departing EVs
+            - invalid_action_punishment: the number of actions given to empty ports
+            - departing_evs: the list of departing EVs
+        '''
+
+        stepped, historic_soc = self.begin_step()
+
+        self._step_ports(np.asarray(actions, dtype=float),
+                         np.asarray(charge_prices, dtype=float),
+                         np.asarray(discharge_prices, dtype=float))
+
+        return self.end_step(stepped, historic_soc,
+                             charge_prices, discharge_prices, current_step)
+
+    def begin_step(self):
+        '''Returns the ports that are stepped and their SoC before the step'''
+        return self.occupied.copy(), self.current_capacity / self.battery_capacity
+
+    def end_step(self, stepped, historic_soc, charge_prices, discharge_prices, current_step):
+        '''
+        Writes the results of the step back to the EV and EV_Charger objects and disconnects the departing EVs.
+        The outputs are the same as in step.
+        '''
+        self._sync(stepped, historic_soc, charge_prices, discharge_prices)
+
+        user_satisfaction_list = []
+        departing_evs = []
+        departing = np.flatnonzero(self.occupied &
+                                   (self.time_of_departure <= current_step))
+        for port in departing:
+            cs = self.charging_stations[self.port_cs[port]]
+            departing_evs.append(self.evs[port])
+            user_satisfaction_list.append(
+                cs.depart_ev(self.port_number[port]))
+
+            self.occupied[port] = False
+            self.evs[port] = None
+
+        invalid_action_punishment = self.n_ports - int(stepped.sum())
+
+        return self.cs_profits.sum(), user_satisfaction_list, \
+            invalid_action_punishment, departing_evs
+
+    def get_transformer_loads(self):
+        '''Returns the current and power of every transformer caused by the charging stations in the last step'''
+
+        amps = np.bincount(self.cs_transformer,
+                           weights=self.cs_current,
+                           minlength=self.n_transformers)
+        power = np.bincount(self.cs_transformer,
+                            weights=self.cs_power,
+                            minlength=self.n_transformers)
+        return amps, power
+
+    def _step_ports(self, actions, charge_prices, discharge_prices) -> None:
+        '''
+        Applies the charger action normalization and the battery model to all ports.
+        This is the array version of EV_Charger.step and EV.step.
+        '''
+        port_cs = self.port_cs
+        occupied = self.occupied
+
+        # if no EV is connected, set action to 0
+        actions = np.where(occupied, actions, 0.0)
+
+        # normalize actions to sum to 1 for charging surplass or -1 for discharging surplass
+        action_sum = np.bincount(port_cs, weights=actions,
+                                 minlength=self.n_cs)
+        divisor = np.where(action_sum > 1, action_sum,
+                           np.where(action_sum < -1, -action_sum, 1))
+        actions = np.round(actions / divisor[port_cs], 5)
+
+        charging = actions > 0
+        discharging = actions < 0
+
+        amps = np.zeros(self.n_ports)
+        amps[charging] = actions[charging] * \
+            self.port_max_charge_current[charging]
+        amps[charging & (amps < self.port_min_charge_current - 0.01)] = 0
+
+        amps[discharging] = actions[discharging] * \
+            np.abs(self.port_max_discharge_current[discharging])
+        too_low = discharging & (amps > self.port_min_discharge_current - 0.01)
+        amps[too_low] = self.port_min_discharge_current[too_low]
+
+        self.current_signal[:] = amps
+
+        # EV side: ignore currents below the minimum power of the EV
+        ev_amps = amps.copy()
+        sqrt_phases = np.sqrt(self.port_phases)
+        ev_amps[(ev_amps > 0) &
+                (ev_amps < self.min_ac_charge_power*1000/(self.port_voltage*sqrt_phases))] = 0
+        ev_amps[(ev_amps < 0) &
+                (ev_amps > self.min_discharge_power*1000/(self.port_voltage*sqrt_phases))] = 0
+
+        self.current_energy[occupied] = 0
+        self.actual_current[occupied] = 0
+
+        active = occupied & (ev_amps != 0)
+
+        # If the action is different than the previous action, then increase the charging cycles
+        new_cycle = active & ((self.previous_power == 0) |
+                              (self.previous_power * ev_amps < 0))
+        self.charging_cycles[new_cycle] += 1
+
+        phases = np.minimum(self.port_phases, self.ev_phases)
+
+        charge_ports = np.flatnonzero(active & (ev_amps > 0))
+        if len(charge_ports) > 0:
+            self._charge(charge_ports, ev_amps[charge_ports],
+                         phases[charge_ports])
+
+        discharge_ports = np.flatnonzero(active & (ev_amps < 0))
+        if len(discharge_ports) > 0:
+            self._discharge(discharge_ports, ev_amps[discharge_ports],
+                            phases[discharge_ports])
+
+        energy = self.current_energy[active]
+        self.previous_power[active] = energy
+        self.total_energy_exchanged[active] += energy
+        self.abs_total_energy_exchanged[active] += np.abs(energy)
+
+        # round up to the nearest 0.01 the current capacity
+        self.current_capacity[active] = ceil_capacity(
+            self.current_capacity[active])
+
+        # Charging station outputs
+        charged = occupied & charging
+        discharged = occupied & discharging
+        exchanged = charged | discharged
+        abs_energy = np.abs(self.current_energy)
+
+        self.cs_profits[:] = np.bincount(port_cs,
+                                      weights=np.where(charged,
+                                                       abs_energy *
+                                                       charge_prices[port_cs],
+                                                       0) +
+                                      np.where(discharged,
+                                               abs_energy *
+                                               discharge_prices[port_cs],
+                                               0),
+                                      minlength=self.n_cs)
+        self.cs_energy_charged[:] = np.bincount(port_cs,
+                                             weights=np.where(
+                                                 charged, abs_energy, 0),
+                                             minlength=self.n_cs)
+        self.cs_energy_discharged[:] = np.bincount(port_cs,
+                                                weights=np.where(
+                                                    discharged, abs_energy, 0),
+                                                minlength=self.n_cs)
+        self.cs_power[:] = np.bincount(port_cs,
+                                    weights=np.where(exchanged,
+                                                     self.current_energy * 60/self.timescale,
+                                                     0),
+                                    minlength=self.n_cs)
+        self.cs_current[:] = np.bincount(port_cs,
+                                      weights=np.where(exchanged,
+                                                       self.actual_current,
+                                                       0),
+                                      minlength=self.n_cs)
+
+        overloaded = np.flatnonzero(self.cs_current - 0.0001 >
+                                    self.cs_max_charge_current)
+        if len(overloaded) > 0:
+            i = overloaded[0]
+            raise Exception(
+                f'sum of amps {self.cs_current[i]} is higher than max charge current {self.cs_max_charge_current[i]}')
+
+    def _charge(self, ports, amps, phases) -> None:
+        '''
+        Charges the EVs of ports with the batch two-stage battery model (ev.charge_batch)
+        '''
+        current_capacity = self.current_capacity[ports]
+        new_capacity, energy, actual_current = charge_batch(
+            amps,
+            self.port_voltage[ports],
+            phases,
+            current_capacity,
+            self.battery_capacity[ports],
+            self.max_ac_charge_power[ports],
+            self.transition_soc[ports],
+            self.transition_soc_multiplier[ports],
+            lookup_efficiency(self.charge_efficiency, amps, rows=ports),
+            self.timescale)
+
+        self.prev_capacity[ports] = current_capacity
+        self.current_capacity[ports] = new_capacity
+        self.current_energy[ports] = energy
+        self.required_energy[ports] -= energy
+        self.actual_current[ports] = actual_current
+
+    def _discharge(self, ports, amps, phases) -> None:
+        '''
+        Discharges the EVs of ports with the batch battery model (ev.discharge_batch)
+        '''
+        current_capacity = self.current_capacity[ports]
+        new_capacity, energy, actual_current = discharge_batch(
+            amps,
+            self.port_voltage[ports],
+            phases,
+            current_capacity,
+            self.min_battery_capacity[ports],
+            self.max_discharge_power[ports],
+            lookup_efficiency(self.discharge_efficiency, amps, rows=ports),
+            self.timescale)
+
+        self.prev_capacity[ports] = current_capacity
+        self.current_capacity[ports] = new_capacity
+        self.current_energy[ports] = energy
+        self.required_energy[ports] += energy
+
+        min_emergency = self.min_emergency_battery_capacity[ports]
+        self.min_emergency_battery_capacity_metric[ports] += \
+            (current_capacity > min_emergency) & (new_capacity < min_emergency)
+
+        self.actual_current[ports] = actual_current
+
+    def _sync(self, stepped, historic_soc, charge_prices, discharge_prices) -> None:
+        '''Writes the status of the arrays back to the EV and EV_Charger objects'''
+
+        signal = self.current_signal.tolist()
+        power = self.cs_power.tolist()
+        current = self.cs_current.tolist()
+        profits = self.cs_profits.tolist()
+        charged = self.cs_energy_charged.tolist()
+        discharged = self.cs_energy_discharged.tolist()
+        offsets = self.cs_port_offset.tolist()
+
+        for i, cs in enumerate(self.charging_stations):
+            cs.current_power_output = power[i]
+            cs.current_total_amps = current[i]
+            cs.current_charge_price = charge_prices[i]
+            cs.current_discharge_price = discharge_prices[i]
+            cs.current_signal = signal[offsets[i]:offsets[i] + cs.n_ports]
+            cs.total_profits += profits[i]
+            cs.total_energy_charged += charged[i]
+            cs.total_energy_discharged += discharged[i]
+            cs.current_step += 1
+
+        ports = np.flatnonzero(stepped)
+        if len(ports) == 0:
+            return
+
+        # online SoC statistics of the battery degradation model (array version of EV.record_soc)
+        soc = historic_soc[ports]
+        self.soc_sum[ports] += soc
+        self.soc_steps[ports] += 1
+
+        active = self.actual_current[ports] != 0
+        active_ports = ports[active]
+        soc = soc[active]
+        self.active_soc_steps[active_ports] += 1
+        self.active_soc_mean[active_ports] += (soc - self.active_soc_mean[active_ports]) / \
+            self.active_soc_steps[active_ports]
+        self.active_soc_abs_deviation[active_ports] += np.abs(
+            soc - self.active_soc_mean[active_ports])
+
+        values = [getattr(self, name)[ports].tolist()
+                  for name in self._EV_SYNC_VARIABLES]
+
+        for j, port in enumerate(ports.tolist()):
+            ev = self.evs[port]
+            for name, value in zip(self._EV_SYNC_VARIABLES, values):
+                setattr(ev, name, value[j])
+
+
+class BatchedArrayEngine(ArrayEngine):
+    '''
+    Array engine that steps the charging networks of several environments at once.
+
+    The status arrays of the engines of the environments are concatenated in one set of
+    arrays, and every engine is rebound to a view of its own slice. The single environment
+    engines can still be used (connect_ev, reset, end_step, ...) and always see the
+    batched state.
+
+    Status variables:
+        - engines: the engines of the batched environments
+        - port_slices, cs_slices: the slice of every engine in the batched port and charging station arrays
+
+    Methods:
+        - locate_cs: maps a batched charging station to its environment and its id in that environment
+        - reset/connect_ev: delegate to the engine of the environment
+        - step: steps the charging networks of all the environments at once
+    '''
+
+    _PORT_STATIC_VARIABLES = ('port_max_charge_current',
+                              'port_min_charge_current',
+                              'port_max_discharge_current',
+                              'port_min_discharge_current',
+                              'port_voltage',
+                              'port_phases',
+                              'port_number',
+                              )
+
+    def __init__(self, engines):
+
+        self.engines = engines
+        self.timescale = engines[0].timescale
+        assert all(engine.timescale == self.timescale for engine in engines), \
+            'All the batched environments must have the same timescale'
+
+        self.charging_stations = [cs for engine in engines
+                                  for cs in engine.charging_stations]
+        self.n_cs = sum(engine.n_cs for engine in engines)
+        self.n_ports = sum(engine.n_ports for engine in engines)
+        self.n_transformers = sum(engine.n_transformers for engine in engines)
+
+        port_offsets = np.cumsum([0] + [e.n_ports for e in engines])
+        cs_offsets = np.cumsum([0] + [e.n_cs for e in engines])
+        tr_offsets = np.cumsum([0] + [e.n_transformers for e in engines])
+
+        self.port_slices = [slice(port_offsets[i], port_offsets[i+1])
+                            for i in range(len(engines))]
+        self.cs_slices = [slice(cs_offsets[i], cs_offsets[i+1])
+                          for i in range(len(engines))]
+
+        self.port_cs = np.concatenate([engine.port_cs + cs_offsets[i]
+                                       for i, engine in enumerate(engines)])
+        self.cs_port_offset = np.concatenate([engine.cs_port_offset + port_offsets[i]
+                                              for i, engine in enumerate(engines)])
+        self.cs_transformer = np.concatenate([engine.cs_transformer + tr_offsets[i]
+                                              for i, engine in enumerate(engines)])
+        self.cs_max_charge_current = np.concatenate([engine.cs_max_charge_current
+                                                     for engine in engines])
+        for name in self._PORT_STATIC_VARIABLES:
+            setattr(self, name, np.concatenate([getattr(engine, name)
+                                                for engine in engines]))
+
+        self._allocate()
+
+        # Move the current state of the engines in the batched arrays and rebind them as views
+        for engine, port_slice, cs_slice in zip(engines, self.port_slices, self.cs_slices):
+            for name in self._PORT_VARIABLES:
+                getattr(self, name)[port_slice] = getattr(engine, name)
+                setattr(engine, name, getattr(self, name)[port_slice])
+            for name in self._CS_VARIABLES:
+                getattr(self, name)[cs_slice] = getattr(engine, name)
+                setattr(engine, name, getattr(self, name)[cs_slice])
+
+    def locate_cs(self, cs_id):
+        '''Returns the batched environment of the batched charging station cs_id and its id in that environment'''
+        assert 0 <= cs_id < self.n_cs, f'CS {cs_id} is not batched'
+        env_index = int(np.searchsorted([cs_slice.stop for cs_slice in self.cs_slices],
+                                        cs_id, side='right'))
+        return env_index, int(cs_id - self.cs_slices[env_index].start)
+
+    def reset(self) -> None:
+        '''Disconnects all EVs of all the batched environments'''
+        for engine in self.engines:
+            engine.reset()
+
+    def connect_ev(self, ev, cs_id, index) -> None:
+        '''Loads an EV that was just connected to port index of the batched charging station cs_id'''
+        env_index, env_cs_id = self.locate_cs(cs_id)
+        self.engines[env_index].connect_ev(ev, env_cs_id, index)
+
+    def step(self, actions, charge_prices, discharge_prices, current_steps, stepped_envs=None):
+        '''
+        Steps the charging networks of all the batched environments at once
+        Inputs:
+            - actions: a list with the action vector of every environment
+            - charge_prices: a list with the charge price of every charging station of every environment
+            - discharge_prices: a list with the discharge price of every charging station of every environment
+            - current_steps: the current simulation timestep of every environment
+            - stepped_envs: whether every environment is stepped, the outputs of the other environments are ignored
+        Outputs:
+            - a list with the outputs of ArrayEngine.step for every environment (None if the environment is not stepped)
+        '''
+        if stepped_envs is None:
+            stepped_envs = [True] * len(self.engines)
+
+        begin = [engine.begin_step() for engine in self.engines]
+
+        self._step_ports(np.concatenate(actions).astype(float),
+                         np.concatenate(charge_prices).astype(float),
+                         np.concatenate(discharge_prices).astype(float))
+
+        return [engine.end_step(*begin[i],
+                                charge_prices[i],
+                                discharge_prices[i],
+                                current_steps[i])
+                if stepped_envs[i] else None
+                for i, engine in enumerate(self.engines)]
+
+
+def efficiency_curve(efficiency) -> np.ndarray:
+    '''
+    Returns the dense efficiency curve (as a fraction) indexed by the rounded current level.
+    Inputs:
+        - efficiency: a scalar efficiency, or an array (indexed by current level) or a dict with the efficiency in % for every current level
+    '''
+    if isinstance(efficiency, np.ndarray):
+        curve = np.full(EFFICIENCY_CURVE_LENGTH, 1 / 100)
+        length = min(len(efficiency), EFFICIENCY_CURVE_LENGTH)
+        curve[:length] = efficiency[:length] / 100
+        return curve
+
+    if not isinstance(efficiency, dict):
+        return np.full(EFFICIENCY_CURVE_LENGTH, efficiency, dtype=float)
+
+    return np.array([efficiency.get(i, 1) / 100
+                     for i in range(EFFICIENCY_CURVE_LENGTH)])
@@ -0,0 +1,408 @@
+'''
+This file contains the AsyncVectorEV2Gym class, a gymnasium vector environment that runs
+EV2Gym environments in worker processes and exchanges actions and observations through shared memory.
+'''
+
+import os
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+from gymnasium.vector import VectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.rl_agent.graph_observation import GraphObservationSpace
+
+
+class AsyncVectorEV2Gym(VectorEnv):
+    '''
+    Multi-process vector environment of EV2Gym with zero-copy observations.
+
+    Every worker process owns a batch of EV2Gym environments. The actions, observations, rewards,
+    termination flags and action masks are exchanged through multiprocessing.shared_memory buffers,
+    so only short commands (and the info dicts) are sent through the pipes. This is useful for state
+    functions that cannot be batched (e.g. V2G_profit_max_loads or PublicPST with many ports), where
+    VectorEV2Gym cannot share the work of computing the observations.
+
+    Episodes that finish are reset automatically at the next step (gymnasium NEXT_STEP autoreset mode).
+
+    Attributes:
+        - num_envs: the number of sub-environments
+        - config_file: the config file of all the sub-environments
+        - seed: the seed of the first sub-environment, the i-th sub-environment uses seed + i
+        - envs_per_worker: the number of sub-environments stepped by every worker process
+        - cpu_affinity: None, True to pin worker i to the i-th available cpu, or a list with the cpu of every worker
+        - copy: whether to return copies of the shared observation buffers or views of them
+        - context: the multiprocessing start method (e.g. "fork", "spawn" or "forkserver")
+
+    Status variables:
+        - action_masks: the shared buffer with the action mask of every sub-environment
+
+    Methods:
+        - reset_async, reset_wait: resets all sub-environments asynchronously
+        - step_async, step_wait: steps all sub-environments asynchronously
+        - reset, step: the synchronous versions of the methods above
+    '''
+
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(self,
+                 num_envs=1,
+                 config_file=None,
+                 seed=None,
+                 envs_per_worker=1,
+                 cpu_affinity=None,
+                 copy=True,
+                 context=None,
+                 **kwargs,  # extra arguments of the EV2Gym sub-environments
+                 ):
+
+        assert num_envs > 0, "Please provide a positive number of environments"
+        assert envs_per_worker > 0, "Please provide a positive number of environments per worker"
+
+        self.num_envs = num_envs
+        self.copy = copy
+        self.render_mode = None
+        self.closed = False
+        self._state = 'default'
+        self._shared_memory = []
+
+        self.worker_env_ids = [list(range(i, min(i + envs_per_worker, num_envs)))
+                               for i in range(0, num_envs, envs_per_worker)]
+        n_workers = len(self.worker_env_ids)
+
+        if cpu_affinity is True:
+            cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+                else list(range(os.cpu_count()))
+            cpu_affinity = [cpus[i % len(cpus)] for i in range(n_workers)]
+        elif cpu_affinity is None:
+            cpu_affinity = [None] * n_workers
+        assert len(cpu_affinity) == n_workers, \
+            f"Expected the cpu of {n_workers} workers, got {len(cpu_affinity)}"
+
+        ctx = mp.get_context(context)
+        # The workers must share the resource tracker of the main process, otherwise
+        # they unlink the shared memory buffers when they exit
+        resource_tracker.ensure_running()
+        env_kwargs = dict(kwargs, config_file=config_file)
+
+        self.parent_pipes, self.processes = [], []
+        for worker_id, env_ids in enumerate(self.worker_env_ids):
+            parent_pipe, child_pipe = ctx.Pipe()
+            seeds = [None if seed is None else seed + i for i in env_ids]
+            process = ctx.Process(target=_async_worker,
+                                  name=f'AsyncVectorEV2Gym-{worker_id}',
+                                  args=(env_kwargs,
+                                        seeds,
+                                        child_pipe,
+                                        parent_pipe,
+                                        cpu_affinity[worker_id]),
+                                  daemon=True)
+            self.parent_pipes.append(parent_pipe)
+            self.processes.append(process)
+            process.start()
+            child_pipe.close()
+
+        # The workers report the spaces of their environments before the shared buffers are created
+        spaces = self._receive_all()
+        self.single_observation_space, self.single_action_space = spaces[0]
+        if isinstance(self.single_observation_space, GraphObservationSpace):
+            # the workers wait for the shared buffers
+            self.close_extras(terminate=True)
+            self.closed = True
+            raise ValueError('Graph observations (e.g. PublicPST_GNN) do not fit the shared ' +
+                             'observation buffers of AsyncVectorEV2Gym, use VectorEV2Gym instead')
+        assert all(obs_space.shape == self.single_observation_space.shape
+                   for obs_space, _ in spaces), "All the sub-environments must have the same observation space"
+
+        self.observation_space = batch_space(self.single_observation_space,
+                                             num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        n_actions = self.single_action_space.shape[0]
+        layout = {
+            'actions': ((num_envs, n_actions), np.float64),
+            'observations': ((num_envs,) + self.single_observation_space.shape,
+                             self.single_observation_space.dtype),
+            'rewards': ((num_envs,), np.float64),
+            'terminations': ((num_envs,), np.bool_),
+            'truncations': ((num_envs,), np.bool_),
+            'action_masks': ((num_envs, n_actions), np.float64),
+        }
+
+        shared_layout = {}
+        for name, (shape, dtype) in layout.items():
+            dtype = np.dtype(dtype)
+            shm = shared_memory.SharedMemory(
+                create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+            self._shared_memory.append(shm)
+            setattr(self, f'_{name}', np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+            getattr(self, f'_{name}')[:] = 0
+            shared_layout[name] = (shm.name, shape, dtype.str)
+
+        self.action_masks = self._action_masks
+
+        for pipe, env_ids in zip(self.parent_pipes, self.worker_env_ids):
+            pipe.send(('attach', (shared_layout, env_ids)))
+        self._receive_all()
+
+    def reset_async(self, seed=None, options=None):
+        '''
+        Sends the reset command to all the workers
+        Inputs:
+            - seed: None, an integer (the i-th sub-environment uses seed + i) or a list of seeds
+        '''
+        self._assert_state('default')
+
+        if seed is None or isinstance(seed, (int, np.integer)):
+            seeds = [None if seed is None else seed + i
+                     for i in range(self.num_envs)]
+        else:
+            assert len(seed) == self.num_envs, \
+                f"Expected {self.num_envs} seeds, got {len(seed)}"
+            seeds = seed
+
+        for pipe, env_ids in zip(self.parent_pipes, self.worker_env_ids):
+            pipe.send(('reset', ([seeds[i] for i in env_ids], options)))
+        self._state = 'waiting_reset'
+
+    def reset_wait(self):
+        '''Waits for all the workers to reset and returns the stacked observations and the vector info dict'''
+        self._assert_state('waiting_reset')
+        self._state = 'default'
+
+        infos = self._collect_infos(self._receive_all())
+        return self._observation_output(), infos
+
+    def reset(self, seed=None, options=None):
+        '''Resets all sub-environments'''
+        self.reset_async(seed=seed, options=options)
+        return self.reset_wait()
+
+    def step_async(self, actions):
+        '''
+        Writes the actions in the shared buffer and sends the step command to all the workers
+        Inputs:
+            - actions: an array of shape (num_envs, number_of_ports) taking values in [-1,1]
+        '''
+        self._assert_state('default')
+
+        self._actions[:] = np.asarray(actions, dtype=float).reshape(
+            self._actions.shape)
+
+        for pipe in self.parent_pipes:
+            pipe.send(('step', None))
+        self._state = 'waiting_step'
+
+    def step_wait(self):
+        '''
+        Waits for all the workers to step
+        Returns:
+            - the stacked observations, rewards, terminations, truncations and the vector info dict
+        '''
+        self._assert_state('waiting_step')
+        self._state = 'default'
+
+        infos = self._collect_infos(self._receive_all())
+
+        if self.copy:
+            return self._observation_output(), self._rewards.copy(), \
+                self._terminations.copy(), self._truncations.copy(), infos
+        return self._observations, self._rewards, \
+            self._terminations, self._truncations, infos
+
+    def step(self, actions):
+        '''Steps all sub-environments'''
+        self.step_async(actions)
+        return self.step_wait()
+
+    def call(self, name, *args, **kwargs):
+        '''Calls a method (or gets an attribute) of every sub-environment and returns the results as a tuple'''
+        self._assert_state('default')
+        for pipe in self.parent_pipes:
+            pipe.send(('call', (name, args, kwargs)))
+        return tuple(result for results in self._receive_all()
+                     for result in results)
+
+    def get_attr(self, name):
+        '''Returns an attribute of every sub-environment as a tuple'''
+        return self.call(name)
+
+    def set_attr(self, name, values):
+        '''Sets an attribute of every sub-environment, values is a single value or a list with a value per sub-environment'''
+        self._assert_state('default')
+        if not isinstance(values, (list, tuple)):
+            values = [values] * self.num_envs
+        assert len(values) == self.num_envs, \
+            f"Expected {self.num_envs} values, got {len(values)}"
+
+        for pipe, env_ids in zip(self.parent_pipes, self.worker_env_ids):
+            pipe.send(('set_attr', (name, [values[i] for i in env_ids])))
+        self._receive_all()
+
+    def close_extras(self, timeout=None, terminate=False):
+        '''Stops the worker processes and releases the shared memory buffers'''
+
+        if self._state != 'default' and not terminate:
+            self._receive_all()
+
+        for pipe, process in zip(self.parent_pipes, self.processes):
+            if terminate:
+                if process.is_alive():
+                    process.terminate()
+            elif not pipe.closed:
+                try:
+                    pipe.send(('close', None))
+                    pipe.recv()
+                except (BrokenPipeError, EOFError):
+                    pass
+
+        for pipe, process in zip(self.parent_pipes, self.processes):
+            pipe.close()
+            process.join(timeout)
+
+        for shm in self._shared_memory:
+            shm.close()
+            shm.unlink()
+        self._shared_memory = []
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close(terminate=True)
+
+    def _observation_output(self):
+        return self._observations.copy() if self.copy else self._observations
+
+    def _collect_infos(self, worker_infos):
+        '''Builds the vector info dict from the info dicts of the workers'''
+        infos = {}
+        for env_ids, env_infos in zip(self.worker_env_ids, worker_infos):
+            for i, (info, stepped) in zip(env_ids, env_infos):
+                if stepped:
+                    info['action_mask'] = self._action_masks[i].copy()
+                infos = self._add_info(infos, info, i)
+        return infos
+
+    def _receive_all(self):
+        '''Receives the response of every worker and raises the errors of the workers'''
+        results, errors = [], []
+        for worker_id, pipe in enumerate(self.parent_pipes):
+            status, data = pipe.recv()
+            if status == 'error':
+                errors.append(f'Worker {worker_id}:\n{data}')
+            results.append(data)
+
+        if errors:
+            self._state = 'default'
+            raise RuntimeError('\n'.join(errors))
+        return results
+
+    def _assert_state(self, state):
+        assert not self.closed, "The environment is closed"
+        assert self._state == state, \
+            f"Expected state {state}, but the environment is {self._state}"
+
+
+def _async_worker(env_kwargs, seeds, pipe, parent_pipe, cpu):
+    '''
+    Worker process of AsyncVectorEV2Gym, owns a batch of EV2Gym environments
+    and writes their outputs in the shared memory buffers.
+    '''
+    parent_pipe.close()
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+
+    shms = []
+    try:
+        envs = [EV2Gym(seed=seed, **env_kwargs) for seed in seeds]
+        pipe.send(('ok', (envs[0].observation_space, envs[0].action_space)))
+
+        command, (shared_layout, env_ids) = pipe.recv()
+        assert command == 'attach'
+        buffers = {}
+        for name, (shm_name, shape, dtype) in shared_layout.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            shms.append(shm)
+            buffers[name] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                       buffer=shm.buf)
+        pipe.send(('ok', None))
+
+        autoreset = [False] * len(envs)
+
+        def write_reset(k, obs):
+            i = env_ids[k]
+            buffers['observations'][i] = obs
+            buffers['rewards'][i] = 0
+            buffers['terminations'][i] = False
+            buffers['truncations'][i] = False
+            buffers['action_masks'][i] = 0
+            autoreset[k] = False
+
+        while True:
+            command, data = pipe.recv()
+
+            if command == 'reset':
+                seeds, options = data
+                infos = []
+                for k, env in enumerate(envs):
+                    obs, info = env.reset(seed=seeds[k], options=options)
+                    write_reset(k, obs)
+                    infos.append((info, False))
+                pipe.send(('ok', infos))
+
+            elif command == 'step':
+                infos = []
+                for k, env in enumerate(envs):
+                    if autoreset[k]:
+                        obs, info = env.reset()
+                        write_reset(k, obs)
+                        infos.append((info, False))
+                        continue
+
+                    i = env_ids[k]
+                    # the environment may modify the actions, step it with a copy of the shared buffer
+                    obs, reward, terminated, truncated, info = env.step(
+                        buffers['actions'][i].copy())
+
+                    buffers['observations'][i] = obs
+                    buffers['rewards'][i] = reward
+                    buffers['terminations'][i] = terminated
+                    buffers['truncations'][i] = truncated
+                    buffers['action_masks'][i] = info['action_mask']
+                    autoreset[k] = terminated or truncated
+
+                    # the action mask is read from the shared buffer
+                    infos.append(({key: value for key, value in info.items()
+                                   if key != 'action_mask'}, True))
+                pipe.send(('ok', infos))
+
+            elif command == 'call':
+                name, args, kwargs = data
+                results = []
+                for env in envs:
+                    function = getattr(env, name)
+                    results.append(function(*args, **kwargs)
+                                   if callable(function) else function)
+                pipe.send(('ok', results))
+
+            elif command == 'set_attr':
+                name, values = data
+                for env, value in zip(envs, values):
+                    setattr(env, name, value)
+                pipe.send(('ok', None))
+
+            elif command == 'close':
+                pipe.send(('ok', None))
+                break
+
+            else:
+                raise RuntimeError(f'Unknown command {command}')
+
+    except (KeyboardInterrupt, Exception):
+        pipe.send(('error', traceback.format_exc()))
+    finally:
+        for shm in shms:
+            shm.close()
+        pipe.close()
@@ -5,7 +5,104 @@ This file contains the EV class.
 import numpy as np
 import warnings
 import math
-from typing import Tuple, Union
+from typing import NamedTuple, Tuple, Union
+
+
+class EVSession(NamedTuple):
+    '''
+    Immutable record of a charging session, i.e. the arguments of the EV class.
+    The EV profiles of a simulation are session records and every EV is created from its record
+    when it arrives, so the profiles are never copied or modified by the simulation.
+    '''
+    id: int
+    location: int
+    battery_capacity_at_arrival: float
+    time_of_arrival: int
+    time_of_departure: int
+    desired_capacity: float = None  # kWh
+    battery_capacity: float = 50  # kWh
+    min_battery_capacity: float = 10  # kWh
+    min_emergency_battery_capacity: float = 25  # kWh
+    max_ac_charge_power: float = 22  # kW
+    min_ac_charge_power: float = 0  # kW
+    max_dc_charge_power: float = 50  # kW
+    max_discharge_power: float = -22  # kW
+    min_discharge_power: float = 0  # kW
+    ev_phases: int = 3
+    transition_soc: float = 0.8
+    transition_soc_multiplier: float = 1
+    charge_efficiency: object = 1
+    discharge_efficiency: object = 1
+    timescale: int = 5
+    ev_model: int = None
+
+
+# EVSession fields stored as float columns by sessions_to_columns, the other fields are stored as int columns
+SESSION_FLOAT_FIELDS = ('battery_capacity_at_arrival',
+                        'desired_capacity',
+                        'battery_capacity',
+                        'min_battery_capacity',
+                        'min_emergency_battery_capacity',
+                        'max_ac_charge_power',
+                        'min_ac_charge_power',
+                        'max_dc_charge_power',
+                        'max_discharge_power',
+                        'min_discharge_power',
+                        'transition_soc',
+                        'transition_soc_multiplier',
+                        )
+# EVSession fields that can be a scalar or an efficiency curve (array)
+SESSION_CURVE_FIELDS = ('charge_efficiency', 'discharge_efficiency')
+
+
+def sessions_to_columns(sessions) -> dict:
+    '''
+    Returns the EVSession records as a dict of columns (arrays with one row per session).
+    None is stored as nan in the float columns and as -1 in the int columns, the efficiency
+    curves are stored as nan-padded matrices with a <field>_is_curve column that tells
+    scalars and curves apart.
+    '''
+    n = len(sessions)
+    columns = {}
+    for name in EVSession._fields:
+        values = [getattr(session, name) for session in sessions]
+
+        if name in SESSION_CURVE_FIELDS:
+            curves = [np.atleast_1d(np.asarray(v, dtype=float)) for v in values]
+            width = max([len(v) for v in curves], default=1)
+            columns[name] = np.full((n, width), np.nan)
+            for i, v in enumerate(curves):
+                columns[name][i, :len(v)] = v
+            columns[f'{name}_is_curve'] = np.array([np.ndim(v) > 0 for v in values],
+                                                   dtype=bool).reshape(n)
+
+        elif name in SESSION_FLOAT_FIELDS:
+            columns[name] = np.array([np.nan if v is None else v for v in values],
+                                     dtype=float).reshape(n)
+        else:
+            columns[name] = np.array([-1 if v is None else v for v in values],
+                                     dtype=np.int64).reshape(n)
+
+    return columns
+
+
+def sessions_from_columns(columns) -> list:
+    '''
+    Returns the list of EVSession records stored in columns (see sessions_to_columns)
+    '''
+    fields = []
+    for name in EVSession._fields:
+        values = np.asarray(columns[name])
+        if name in SESSION_CURVE_FIELDS:
+            values = [curve[~np.isnan(curve)] if is_curve else curve[0]
+                      for curve, is_curve in zip(values, columns[f'{name}_is_curve'])]
+        elif name in SESSION_FLOAT_FIELDS:
+            values = [None if np.isnan(v) else v for v in values]
+        else:
+            values = [None if v == -1 else v for v in values]
+        fields.append(values)
+
+    return [EVSession(*session) for session in zip(*fields)]
 
 
 class EV():
@@ -27,6 +124,7 @@ class EV():
         - max_desired_capacity: the maximum desired capacity of the EV in kWh to maximize battery life
         - charge_efficiency: the efficiency of the EV when charging
         - discharge_efficiency: the efficiency of the EV when discharging        
+        - ev_model: the index of the EV model in the EV spec catalog (heterogeneous EV specs only)
         - timescale: the timescale of the simulation (useful for determining the charging speed)
 
     Status variables:
@@ -34,14 +132,36 @@ class EV():
         - current_energy: the current power input of the EV in kW (positive for charging, negative for discharging)
         - charging_cycles: the number of charging/discharging cycles of the EV (useful for determining battery life parameters)
         - previous_power: the power input of the EV in the previous timestep in kW (positive for charging, negative for discharging)
+        - soc_sum, soc_steps: the sum and number of the SoC values at the start of every step
+        - active_soc_steps, active_soc_mean: the number and running mean of the SoC values of the steps with a non-zero current
+        - active_soc_abs_deviation: the sum of the absolute deviations of the active SoC values from their running mean
 
     Methods:
         - step: updates the EV status according to the actions taken by the EV charger
         - _charge: charges the EV
         - _discharge: discharges the EV        
+        - from_session/to_session: convert between EVs and EVSession records
 
     '''
 
+    __slots__ = ('id', 'location', 'timescale', 'simulation_length',
+                 'time_of_arrival', 'time_of_departure', 'desired_capacity',
+                 'battery_capacity_at_arrival', 'battery_capacity',
+                 'min_battery_capacity', 'min_emergency_battery_capacity',
+                 'max_ac_charge_power', 'min_ac_charge_power',
+                 'max_discharge_power', 'min_discharge_power',
+                 'max_dc_charge_power', 'transition_soc',
+                 'transition_soc_multiplier', 'ev_phases',
+                 'charge_efficiency', 'discharge_efficiency', 'ev_model',
+                 'current_capacity', 'prev_capacity', 'current_energy',
+                 'actual_current', 'charging_cycles', 'previous_power',
+                 'required_energy', 'total_energy_exchanged', 'c_lost',
+                 'max_energy_AFAP', 'min_emergency_battery_capacity_metric',
+                 'abs_total_energy_exchanged', 'soc_sum', 'soc_steps',
+                 'active_soc_steps', 'active_soc_mean',
+                 'active_soc_abs_deviation', 'calendar_loss', 'cyclic_loss',
+                 )
+
     def __init__(self,
                  id,
                  location,
@@ -63,6 +183,7 @@ class EV():
                  charge_efficiency=1, # can be a list of charge efficiencies for different current levels
                  discharge_efficiency=1, # can be a list of discharge efficiencies for different current levels
                  timescale=5,
+                 ev_model=None,  # index of the EV model in the EV spec catalog
                  ):
 
         self.id = id
@@ -90,6 +211,7 @@ class EV():
 
         self.charge_efficiency = charge_efficiency
         self.discharge_efficiency = discharge_efficiency
+        self.ev_model = ev_model
 
         # EV status
         self.current_capacity = battery_capacity_at_arrival  # kWh
@@ -100,18 +222,47 @@ class EV():
         self.previous_power = 0
         self.required_energy = self.battery_capacity - self.battery_capacity_at_arrival
         self.total_energy_exchanged = 0
+        self.c_lost = 0
         self.max_energy_AFAP = 0
         # timesteps that the EV is discharged below the minimum emergency battery capacity
         self.min_emergency_battery_capacity_metric = 0
 
         # Baterry degradation
         self.abs_total_energy_exchanged = 0
-        self.historic_soc = []
-        self.active_steps = []
+        # online SoC statistics of the battery degradation model
+        self.soc_sum = 0
+        self.soc_steps = 0
+        self.active_soc_steps = 0
+        self.active_soc_mean = 0
+        self.active_soc_abs_deviation = 0
 
         self.calendar_loss = 0
         self.cyclic_loss = 0
 
+    @classmethod
+    def from_session(cls, session):
+        '''
+        Creates a new EV, in its arrival state, from an EVSession record
+        '''
+        return cls(*session)
+
+    def to_session(self) -> EVSession:
+        '''
+        Returns the EVSession record of the EV
+        '''
+        return EVSession(*(getattr(self, field) for field in EVSession._fields))
+
+    def __setstate__(self, state):
+        # EVs pickled before EV had __slots__ (e.g. in older replay files) store their state as a dict
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        else:
+            # and may lack the session fields added later
+            state = {**EVSession._field_defaults, **state}
+        for name, value in state.items():
+            if name in EV.__slots__:
+                setattr(self, name, value)
+
     def reset(self):
         '''
         The reset method is used to reset the EV's status to the initial state.
@@ -129,8 +280,12 @@ class EV():
         self.min_emergency_battery_capacity_metric = 0
 
         self.abs_total_energy_exchanged = 0
-        self.historic_soc = []
-        self.active_steps = []
+        # online SoC statistics of the battery degradation model
+        self.soc_sum = 0
+        self.soc_steps = 0
+        self.active_soc_steps = 0
+        self.active_soc_mean = 0
+        self.active_soc_abs_deviation = 0
 
         self.calendar_loss = 0
         self.cyclic_loss = 0
@@ -153,13 +308,13 @@ class EV():
         elif amps < 0 and amps > self.min_discharge_power*1000/(voltage*math.sqrt(phases)):
             amps = 0
 
-        self.historic_soc.append(self.get_soc())
+        soc = self.get_soc()
 
         if amps == 0:
             self.current_energy = 0
             self.actual_current = 0
 
-            self.active_steps.append(0)
+            self.record_soc(soc, False)
             return 0, 0
 
         # If the action is different than the previous action, then increase the charging cycles
@@ -182,11 +337,27 @@ class EV():
         # round up to the nearest 0.01 the current capacity
         self.current_capacity = self.my_ceil(self.current_capacity, 2)
 
-        self.active_steps.append(1 if self.actual_current != 0 else 0)
+        self.record_soc(soc, self.actual_current != 0)
         return self.current_energy, self.actual_current
 
+    def record_soc(self, soc, active) -> None:
+        '''
+        Adds the SoC at the start of a step to the online SoC statistics of the battery degradation model
+        Inputs:
+            - soc: the SoC at the start of the step
+            - active: whether the EV exchanged energy in the step
+        '''
+        self.soc_sum += soc
+        self.soc_steps += 1
+
+        if active:
+            self.active_soc_steps += 1
+            self.active_soc_mean += (soc - self.active_soc_mean) / \
+                self.active_soc_steps
+            self.active_soc_abs_deviation += abs(soc - self.active_soc_mean)
+
     def my_ceil(self, a, precision=2):
-        return np.true_divide(np.ceil(a * 10**precision), 10**precision)
+        return ceil_capacity(a, precision)
 
     def is_departing(self, timestep) -> Union[float, None]:
         '''
@@ -282,9 +453,11 @@ class EV():
         # convert pilot signal and max power into pilot and max rate of
         # change of SoC.
         
-        # if charge efficeincy is dict, then get the charge efficiency based on the current
+        # if charge efficeincy is a curve (array or dict), then get the charge efficiency based on the current
         # current level
-        if isinstance(self.charge_efficiency, dict):
+        if isinstance(self.charge_efficiency, np.ndarray):
+            charge_efficiency = efficiency_at(self.charge_efficiency, amps)/100
+        elif isinstance(self.charge_efficiency, dict):
             charge_efficiency = self.charge_efficiency.get(np.round(amps), 1)/100
         else:
             charge_efficiency = self.charge_efficiency
@@ -370,9 +543,12 @@ class EV():
         if abs(given_power) > abs(self.max_discharge_power):
             given_power = self.max_discharge_power
             
-        # if discharge efficeincy is dict, then get the discharge efficiency based on the current
+        # if discharge efficeincy is a curve (array or dict), then get the discharge efficiency based on the current
         # current level
-        if isinstance(self.charge_efficiency, dict):
+        if isinstance(self.charge_efficiency, np.ndarray):
+            discharge_efficiency = efficiency_at(self.discharge_efficiency, amps)/100
+            assert discharge_efficiency > 0
+        elif isinstance(self.charge_efficiency, dict):
             discharge_efficiency = self.discharge_efficiency.get(np.abs(np.round(amps)), 1)/100            
             assert discharge_efficiency > 0
         else:
@@ -419,8 +595,11 @@ class EV():
 
         self.max_energy_AFAP = self.battery_capacity_at_arrival
         
-        # if charge efficeincy is dict, then get the charge efficiency based on the current
-        if isinstance(self.charge_efficiency, dict):
+        # if charge efficeincy is a curve, then get the maximum charge efficiency of the curve
+        if isinstance(self.charge_efficiency, np.ndarray):
+            charge_efficiency = self.charge_efficiency.max()/100
+
+        elif isinstance(self.charge_efficiency, dict):
             # iterate over all values of charge efficiency and get the maximum
             # charge efficiency
             max_charge_efficiency = 0
@@ -453,69 +632,301 @@ class EV():
             - Capacity loss: the capacity loss
         '''
 
-        # Degradation modelling parameters
-        e0 = 7.543e6
-        e1 = 23.75e6
-        e2 = 6976
+        d_cal, d_cyc = battery_degradation_batch(time_of_arrival=self.time_of_arrival,
+                                                 time_of_departure=self.time_of_departure,
+                                                 timescale=self.timescale,
+                                                 final_soc=self.get_soc(),
+                                                 soc_sum=self.soc_sum,
+                                                 soc_steps=self.soc_steps,
+                                                 active_soc_steps=self.active_soc_steps,
+                                                 active_soc_mean=self.active_soc_mean,
+                                                 active_soc_abs_deviation=self.active_soc_abs_deviation,
+                                                 abs_total_energy_exchanged=self.abs_total_energy_exchanged)
+
+        self.calendar_loss = d_cal
+        self.cyclic_loss = d_cyc
+
+        return d_cal, d_cyc
+
+
+def efficiency_at(efficiency_curve, amps) -> float:
+    '''
+    Returns the efficiency (in %) of a dense efficiency curve (indexed by current level in A)
+    at the rounded current amps, 1 for current levels outside of the curve
+    '''
+    level = int(np.abs(np.round(amps)))
+    if level < len(efficiency_curve):
+        return efficiency_curve[level]
+    return 1
+
 
-        z0 = 7.348e-3
-        z1 = 3.667
-        z2 = 7.6e-4
-        z3 = 4.081e-3
+def lookup_efficiency(efficiency, amps, rows=None) -> np.ndarray:
+    '''
+    Returns the efficiency (as a fraction) of a batch of EVs at the rounded currents amps
+    Inputs:
+        - efficiency: the efficiency of every EV (1D array) or the dense efficiency curves of the EVs as fractions
+          indexed by current level (2D array, the last level is used for higher currents)
+        - amps: the current of every EV in A
+        - rows: the rows of the efficiency curves of the EVs (default: one row per EV)
+    '''
+    efficiency = np.asarray(efficiency, dtype=float)
+    if efficiency.ndim == 1:
+        return efficiency if rows is None else efficiency[rows]
+
+    rows = np.arange(len(amps)) if rows is None else rows
+    levels = np.minimum(np.abs(np.round(amps)),
+                        efficiency.shape[1] - 1).astype(int)
+    return efficiency[rows, levels]
+
+
+def charge_batch(amps,
+                 voltage,
+                 phases,
+                 current_capacity,
+                 battery_capacity,
+                 max_ac_charge_power,
+                 transition_soc,
+                 transition_soc_multiplier,
+                 charge_efficiency,
+                 timescale,
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Batch version of the two-stage battery model of EV._charge, for EVs charging with amps > 0
+    Inputs:
+        - amps, voltage, phases: the pilot current (A), voltage (V) and phases of every EV
+        - current_capacity, battery_capacity: the current and total battery capacity of every EV (kWh)
+        - max_ac_charge_power: the maximum AC charging power of every EV (kW)
+        - transition_soc, transition_soc_multiplier: the two-stage battery model parameters of every EV
+        - charge_efficiency: the efficiency of every EV or the efficiency curves of the EVs (see lookup_efficiency)
+        - timescale: the timescale of the simulation in minutes
+    Returns:
+        - the new capacities (kWh), the energies (kWh) and the actual currents (A) of the EVs
+    '''
+    period = timescale
+    voltage = voltage * np.sqrt(phases)
+    charge_efficiency = lookup_efficiency(charge_efficiency, amps)
+
+    pilot_dsoc = charge_efficiency * amps * voltage / 1000 / \
+        battery_capacity / (60 / period)
+    max_dsoc = charge_efficiency * max_ac_charge_power / \
+        battery_capacity / (60 / period)
+    pilot_dsoc = np.minimum(pilot_dsoc, max_dsoc)
+
+    soc = current_capacity / battery_capacity
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        pilot_transition_soc = transition_soc + (
+            pilot_dsoc - max_dsoc
+        ) / max_dsoc * (transition_soc - 1)
+
+        pre_rampdown = np.where(
+            1 <= (pilot_transition_soc - soc) / pilot_dsoc,
+            pilot_dsoc + soc,
+            1 + np.exp(transition_soc_multiplier *
+                       (pilot_dsoc + soc - pilot_transition_soc)
+                       / (pilot_transition_soc - 1)
+                       ) * (pilot_transition_soc - 1))
+        rampdown = 1 + np.exp(transition_soc_multiplier*pilot_dsoc / (pilot_transition_soc - 1)) * (
+            soc - 1)
+        new_soc = np.where(soc < pilot_transition_soc,
+                           pre_rampdown,
+                           rampdown)
+
+    dsoc_limit = np.minimum(max_dsoc, pilot_dsoc)
+    curr_soc = np.where(new_soc - soc > dsoc_limit,
+                        dsoc_limit + soc,
+                        new_soc)
+    curr_soc = np.where(transition_soc == 1,
+                        np.minimum(pilot_dsoc + soc, 1),
+                        curr_soc)
+
+    dsoc = curr_soc - soc
+    new_capacity = curr_soc * battery_capacity
+    energy = dsoc * battery_capacity
+
+    return new_capacity, energy, energy / (period / 60) * 1000 / voltage
+
+
+def discharge_batch(amps,
+                    voltage,
+                    phases,
+                    current_capacity,
+                    min_battery_capacity,
+                    max_discharge_power,
+                    discharge_efficiency,
+                    timescale,
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Batch version of EV._discharge, for EVs discharging with amps < 0
+    Inputs:
+        - amps, voltage, phases: the pilot current (A), voltage (V) and phases of every EV
+        - current_capacity, min_battery_capacity: the current and minimum battery capacity of every EV (kWh)
+        - max_discharge_power: the maximum discharging power of every EV (kW, negative)
+        - discharge_efficiency: the efficiency of every EV or the efficiency curves of the EVs (see lookup_efficiency)
+        - timescale: the timescale of the simulation in minutes
+    Returns:
+        - the new capacities (kWh), the energies (kWh, negative) and the actual currents (A) of the EVs
+    '''
+    voltage = voltage * np.sqrt(phases)
+
+    given_power = amps * voltage / 1000
+    given_power = np.where(np.abs(given_power) > np.abs(max_discharge_power),
+                           max_discharge_power,
+                           given_power)
+
+    discharge_efficiency = lookup_efficiency(discharge_efficiency, amps)
+
+    given_energy = given_power * discharge_efficiency * timescale / 60
+
+    below_min = current_capacity + given_energy < min_battery_capacity
+    given_energy = np.where(below_min,
+                            np.where(current_capacity > min_battery_capacity,
+                                     -(current_capacity -
+                                       min_battery_capacity),
+                                     0),
+                            given_energy)
+    new_capacity = np.where(below_min,
+                            min_battery_capacity,
+                            current_capacity + given_energy)
+
+    return new_capacity, given_energy, given_energy * 60 / timescale * 1000 / voltage
+
+
+def step_batch(amps,
+               voltage,
+               phases,
+               current_capacity,
+               battery_capacity,
+               min_battery_capacity,
+               max_ac_charge_power,
+               max_discharge_power,
+               transition_soc,
+               transition_soc_multiplier,
+               charge_efficiency,
+               discharge_efficiency,
+               timescale,
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Charges (amps > 0) and discharges (amps < 0) a batch of EVs in a single call, see charge_batch and discharge_batch.
+    The EVs with amps == 0 keep their capacity. The capacities are rounded up to the nearest 0.01 kWh as in EV.step.
+    Returns:
+        - the new capacities (kWh), the energies (kWh) and the actual currents (A) of the EVs
+    '''
+    amps = np.asarray(amps, dtype=float)
+    new_capacity = np.array(current_capacity, dtype=float)
+    energy = np.zeros(len(amps))
+    actual_current = np.zeros(len(amps))
+
+    def select(values, mask):
+        values = np.asarray(values)
+        # efficiency curves and per EV parameters are selected by row, scalars are broadcast
+        return values[mask] if values.ndim > 0 else values
+
+    charging = amps > 0
+    if charging.any():
+        (new_capacity[charging],
+         energy[charging],
+         actual_current[charging]) = charge_batch(*(select(values, charging)
+                                                    for values in (amps, voltage, phases,
+                                                                   current_capacity, battery_capacity,
+                                                                   max_ac_charge_power, transition_soc,
+                                                                   transition_soc_multiplier,
+                                                                   charge_efficiency)),
+                                                  timescale=timescale)
+
+    discharging = amps < 0
+    if discharging.any():
+        (new_capacity[discharging],
+         energy[discharging],
+         actual_current[discharging]) = discharge_batch(*(select(values, discharging)
+                                                          for values in (amps, voltage, phases,
+                                                                         current_capacity, min_battery_capacity,
+                                                                         max_discharge_power, discharge_efficiency)),
+                                                        timescale=timescale)
+
+    active = charging | discharging
+    new_capacity[active] = ceil_capacity(new_capacity[active])
+
+    return new_capacity, energy, actual_current
+
+
+def ceil_capacity(capacity, precision=2):
+    '''Rounds up capacities (scalar or array) to the given number of decimals, as EV.my_ceil'''
+    return np.true_divide(np.ceil(capacity * 10**precision), 10**precision)
+
+
+def battery_degradation_batch(time_of_arrival,
+                              time_of_departure,
+                              timescale,
+                              final_soc,
+                              soc_sum,
+                              soc_steps,
+                              active_soc_steps,
+                              active_soc_mean,
+                              active_soc_abs_deviation,
+                              abs_total_energy_exchanged,
+                              ):
+    '''
+    Returns the calendar and cycling capacity losses of a batch of EVs (arrays or scalars), see EV.get_battery_degradation.
+    The inputs are the EV variables of the same name and the SoC of the EVs at departure (final_soc).
+    '''
 
-        b_cap_ah = 2.05  # ah
-        b_cap_kwh = 78  # kwh
+    # Degradation modelling parameters
+    e0 = 7.543e6
+    e1 = 23.75e6
+    e2 = 6976
 
-        d_dist = 15000  # km
-        b_age = 2*365  # days
-        G = 0.186  # kwh/km
+    z0 = 7.348e-3
+    z1 = 3.667
+    z2 = 7.6e-4
+    z3 = 4.081e-3
 
-        # Age of the battery in days
-        T_acc = b_age
+    b_cap_ah = 2.05  # ah
+    b_cap_kwh = 78  # kwh
 
-        # Simulation time in days
-        T_sim = (self.time_of_departure - self.time_of_arrival + 1) * \
-            self.timescale / (60*24)  # days
+    d_dist = 15000  # km
+    b_age = 2*365  # days
+    G = 0.186  # kwh/km
 
-        theta = 298.15  # Kelvin
-        k = 0.8263  # Volts
+    # Age of the battery in days
+    T_acc = b_age
 
-        v_min = 3.3324  # Volts
-        # Add the final soc to the historic soc
-        self.historic_soc.append(self.get_soc())
-        avg_soc = np.mean(self.historic_soc)
-        v_avg = v_min + k * avg_soc
+    # Simulation time in days
+    T_sim = (time_of_departure - time_of_arrival + 1) * \
+        timescale / (60*24)  # days
 
-        # alpha(v_avg)
-        alpha = (e0 * v_avg - e1) * math.exp(-e2 / theta)
-        d_cal = alpha * 0.75 * T_sim / (T_acc)**0.25
+    theta = 298.15  # Kelvin
+    k = 0.8263  # Volts
 
-        # beta(v_avg, soc_avg)
-        # print(f'avg_soc: {avg_soc}')
-        self.active_steps.append(1)
+    v_min = 3.3324  # Volts
+    # Add the final soc to the soc statistics
+    avg_soc = (soc_sum + final_soc) / (soc_steps + 1)
+    v_avg = v_min + k * avg_soc
 
-        # get historic soc that self.active_steps == 1
-        filtered_historic_soc = [soc for i, soc in enumerate(
-            self.historic_soc) if self.active_steps[i] == 1]
-        # print(f'filtered soc {filtered_historic_soc}')
-        avg_filtered_soc = np.mean(filtered_historic_soc)
+    # alpha(v_avg)
+    alpha = (e0 * v_avg - e1) * math.exp(-e2 / theta)
+    d_cal = alpha * 0.75 * T_sim / (T_acc)**0.25
 
-        delta_DoD = 2 * \
-            abs(avg_filtered_soc.repeat(len(filtered_historic_soc)) -
-                filtered_historic_soc).mean()
-        # print(f'delta_DoD: {delta_DoD}')
-        v_half_soc = v_min + k * 0.5
-        beta = z0 * (v_half_soc - z1)**2 + z2 + z3 * delta_DoD
+    # beta(v_avg, soc_avg)
+    # print(f'avg_soc: {avg_soc}')
+    # the final soc is counted as an active step
+    active_soc_steps = active_soc_steps + 1
+    active_soc_mean = active_soc_mean + \
+        (final_soc - active_soc_mean) / active_soc_steps
 
-        Q_sim = (self.abs_total_energy_exchanged / b_cap_kwh) * b_cap_ah
+    # mean absolute deviation of the active soc, estimated online against the running mean
+    delta_DoD = 2 * (active_soc_abs_deviation +
+                     np.abs(final_soc - active_soc_mean)) / active_soc_steps
+    # print(f'delta_DoD: {delta_DoD}')
+    v_half_soc = v_min + k * 0.5
+    beta = z0 * (v_half_soc - z1)**2 + z2 + z3 * delta_DoD
 
-        # accumulated throughput
-        Q_acc = 2 * (b_age * (d_dist / 365) * G * b_cap_ah) / b_cap_kwh
-        # print(f'Q_acc: {Q_acc}')
+    Q_sim = (abs_total_energy_exchanged / b_cap_kwh) * b_cap_ah
 
-        d_cyc = beta * 0.5 * Q_sim / (Q_acc)**0.5
+    # accumulated throughput
+    Q_acc = 2 * (b_age * (d_dist / 365) * G * b_cap_ah) / b_cap_kwh
+    # print(f'Q_acc: {Q_acc}')
 
-        self.calendar_loss = d_cal
-        self.cyclic_loss = d_cyc
+    d_cyc = beta * 0.5 * Q_sim / (Q_acc)**0.5
 
-        return d_cal, d_cyc
\ No newline at end of file
+    return d_cal, d_cyc
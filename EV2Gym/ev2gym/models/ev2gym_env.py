@@ -11,20 +11,33 @@ import datetime
 import pickle
 import os
 import random
-from copy import deepcopy
 import yaml
 import json
 
 # from .grid import Grid
-from ev2gym.models.replay import EvCityReplay
+from ev2gym.models.replay import EvCityReplay, load_replay
+from ev2gym.models.array_engine import ArrayEngine
+from ev2gym.models.ev import EV
 from ev2gym.visuals.plots import ev_city_plot, visualize_step
-from ev2gym.utilities.utils import get_statistics, print_statistics, calculate_charge_power_potential
+from ev2gym.utilities.utils import get_statistics, print_statistics
 from ev2gym.utilities.loaders import load_ev_spawn_scenarios, load_power_setpoints, load_transformers, load_ev_charger_profiles, load_ev_profiles, load_electricity_prices
+from ev2gym.utilities.profiler import EV2GymProfiler
+from ev2gym.utilities.kpis import EpisodeKPIs
+from ev2gym.utilities.charge_power_potential import ChargePowerPotential
+from ev2gym.utilities.transformer_forecasts import TransformerForecasts
+from ev2gym.utilities.scenario_bank import ScenarioBank, open_scenario_bank
+from ev2gym.utilities.telemetry_recorder import TelemetryRecorder
+from ev2gym.utilities.snapshot import EnvSnapshot, take_snapshot, restore_snapshot
+from ev2gym.utilities.timeline import EpisodeTimeline
 from ev2gym.visuals.render import Renderer
 
 from ev2gym.rl_agent.reward import SquaredTrackingErrorReward
+from ev2gym.rl_agent.graph_observation import GraphObservationBuilder
 from ev2gym.rl_agent.state import PublicPST
 
+# Per-port telemetry arrays, shape (number_of_ports, simulation_length)
+PORT_TELEMETRY = ('port_current', 'port_current_signal', 'port_energy_level')
+
 
 class EV2Gym(gym.Env):
 
@@ -35,17 +48,31 @@ class EV2Gym(gym.Env):
                  generate_rnd_game=True,  # generate a random game without terminating conditions
                  seed=None,
                  save_replay=False,
+                 # format of the saved replay files: "columnar", "columnar_compressed" or "pickle"
+                 replay_format="columnar",
                  save_plots=False,
                  state_function=PublicPST,
                  reward_function=SquaredTrackingErrorReward,
                  cost_function=None,  # cost function to use in the simulation
                  eval_mode="Normal",  # eval mode can be "Normal", "Unstirred" or "Optimal" in order to save the correct statistics in the replay file
                  lightweight_plots=False,
+                 # dtypes of the per-port telemetry arrays, e.g. {"port_energy_level": np.float32} (default: float16)
+                 port_telemetry_dtypes=None,
+                 # directory to stream the telemetry of every episode to, in chunks of telemetry_chunk_size steps
+                 # (the telemetry arrays then only hold the current chunk until the episode is done)
+                 telemetry_path=None,
+                 telemetry_chunk_size=1024,
                  # whether to empty the ports at the end of the simulation or not
                  empty_ports_at_end_of_simulation=True,
                  extra_sim_name=None,
                  verbose=False,
                  render_mode=None,
+                 # whether to step the charging network with the array-backed engine
+                 use_array_engine=False,
+                 # whether to record the wall time of the phases of step and reset (env.profile)
+                 profile=False,
+                 # path of an offline scenario bank (or a ScenarioBank) to sample the episodes from at reset
+                 scenario_bank=None,
                  ):
 
         super(EV2Gym, self).__init__()
@@ -61,10 +88,23 @@ class EV2Gym(gym.Env):
         self.load_from_replay_path = load_from_replay_path
         self.empty_ports_at_end_of_simulation = empty_ports_at_end_of_simulation
         self.save_replay = save_replay
+        self.replay_format = replay_format
         self.save_plots = save_plots
         self.lightweight_plots = lightweight_plots
+        self.port_telemetry_dtypes = {name: np.float16 for name in PORT_TELEMETRY}
+        if port_telemetry_dtypes is not None:
+            for name in port_telemetry_dtypes:
+                assert name in PORT_TELEMETRY, f'Unknown port telemetry array {name}'
+            self.port_telemetry_dtypes.update(port_telemetry_dtypes)
+        self.telemetry_path = telemetry_path
+        self.telemetry_chunk_size = telemetry_chunk_size
+        # Recorder of the telemetry of the current episode, None if the telemetry is kept in memory
+        self.telemetry = None
+        self.telemetry_episodes = 0
         self.eval_mode = eval_mode
         self.verbose = verbose  # Whether to print the simulation progress or not
+        # Wall time counters of the phases of step and reset (None if profiling is disabled)
+        self.profile = EV2GymProfiler() if profile else None
         # Whether to render the simulation in real-time or not
         self.render_mode = render_mode
 
@@ -93,13 +133,12 @@ class EV2Gym(gym.Env):
         self.tr_rng = np.random.default_rng(seed=self.tr_seed)
 
         if load_from_replay_path is not None:
-            with open(load_from_replay_path, 'rb') as file:
-                self.replay = pickle.load(file)
+            self.replay = load_replay(load_from_replay_path)
 
             sim_name = self.replay.replay_path.split(
                 'replay_')[-1].split('.')[0]
             self.sim_name = sim_name + '_replay'
-            self.sim_date = self.replay.sim_date
+            self.sim_starting_date = self.replay.sim_date
             self.timescale = self.replay.timescale
             self.cs = self.replay.n_cs
             self.number_of_transformers = self.replay.n_transformers
@@ -124,33 +163,33 @@ class EV2Gym(gym.Env):
                     if self.config["random_hour"]:
                         self.config['hour'] = random.randint(5, 15)
 
-                self.sim_date = datetime.datetime(2022,
-                                                  1,
-                                                  1,
-                                                  self.config['hour'],
-                                                  self.config['minute'],
-                                                  ) + datetime.timedelta(days=random.randint(0, int(1.5*365)))
+                self.sim_starting_date = datetime.datetime(2022,
+                                                           1,
+                                                           1,
+                                                           self.config['hour'],
+                                                           self.config['minute'],
+                                                           ) + datetime.timedelta(days=random.randint(0, int(1.5*365)))
 
                 if self.scenario == 'workplace':
                     # dont simulate weekends
-                    while self.sim_date.weekday() > 4:
-                        self.sim_date += datetime.timedelta(days=1)
+                    while self.sim_starting_date.weekday() > 4:
+                        self.sim_starting_date += datetime.timedelta(days=1)
 
                 if self.config['simulation_days'] == "weekdays":
                     # dont simulate weekends
-                    while self.sim_date.weekday() > 4:
-                        self.sim_date += datetime.timedelta(days=1)
+                    while self.sim_starting_date.weekday() > 4:
+                        self.sim_starting_date += datetime.timedelta(days=1)
                 elif self.config['simulation_days'] == "weekends" and self.scenario != 'workplace':
                     # simulate only weekends
-                    while self.sim_date.weekday() < 5:
-                        self.sim_date += datetime.timedelta(days=1)
+                    while self.sim_starting_date.weekday() < 5:
+                        self.sim_starting_date += datetime.timedelta(days=1)
             else:
 
-                self.sim_date = datetime.datetime(self.config['year'],
-                                                  self.config['month'],
-                                                  self.config['day'],
-                                                  self.config['hour'],
-                                                  self.config['minute'])
+                self.sim_starting_date = datetime.datetime(self.config['year'],
+                                                           self.config['month'],
+                                                           self.config['day'],
+                                                           self.config['hour'],
+                                                           self.config['minute'])
             self.replay = None
             self.sim_name = f'sim_' + \
                 f'{datetime.datetime.now().strftime("%Y_%m_%d_%f")}'
@@ -163,7 +202,11 @@ class EV2Gym(gym.Env):
         self.stats = None
         # if self.cs > 100:
         # self.lightweight_plots = True
-        self.sim_starting_date = self.sim_date
+        # calendar of the steps of the episode, sim_date is derived from it
+        self.timeline = EpisodeTimeline(self.sim_starting_date,
+                                        self.timescale,
+                                        self.simulation_length)
+        self.current_step = 0
 
         # Read the config.charging_network_topology json file and read the topology
         try:
@@ -208,6 +251,26 @@ class EV2Gym(gym.Env):
         self.number_of_ports = np.array(
             [cs.n_ports for cs in self.charging_stations]).sum()
 
+        # Global port offsets (charging stations in list order) used by the per-port telemetry,
+        # port_cs and port_number map a global port back to its (charging station, port)
+        n_ports = np.array([cs.n_ports for cs in self.charging_stations], dtype=int)
+        self.cs_port_offset = np.concatenate(([0], np.cumsum(n_ports)[:-1]))
+        self.port_cs = np.repeat(np.arange(self.cs), n_ports)
+        self.port_number = np.arange(self.number_of_ports) - \
+            self.cs_port_offset[self.port_cs]
+
+        # Array-backed simulation core, None if the object-based loop is used
+        self.engine = ArrayEngine(self) if use_array_engine else None
+
+        # Offline scenario bank, None if the episodes are generated at reset
+        if scenario_bank is not None and not isinstance(scenario_bank, ScenarioBank):
+            scenario_bank = open_scenario_bank(scenario_bank)
+        self.scenario_bank = scenario_bank
+        if self.scenario_bank is not None:
+            self.scenario_bank.check_env(self)
+        # the index of the scenario of the current episode in the scenario bank
+        self.scenario_index = None
+
         # Load EV spawn scenarios
         if self.load_from_replay_path is None:
             load_ev_spawn_scenarios(self)
@@ -253,11 +316,22 @@ class EV2Gym(gym.Env):
         self.action_space = spaces.Box(low=lows, high=high, dtype=np.float64)
 
         # Observation space: is a matrix of size ("Sum of all ports of all charging stations",n_features)
-        obs_dim = len(self._get_observation())
-
-        high = np.inf*np.ones([obs_dim])
-        self.observation_space = spaces.Box(
-            low=-high, high=high, dtype=np.float64)
+        # the observation builders compiled by the state functions (see ev2gym/rl_agent/observation.py)
+        self.observation_builders = {}
+        observation = self._get_observation()
+        if isinstance(observation, np.ndarray):
+            obs_dim = len(observation)
+
+            high = np.inf*np.ones([obs_dim])
+            self.observation_space = spaces.Box(
+                low=-high, high=high, dtype=np.float64)
+        else:
+            # graph observations (e.g. PublicPST_GNN) have a variable number of nodes,
+            # their space is the one of the graph observation builder
+            self.observation_space = next((builder.observation_space
+                                           for builder in self.observation_builders.values()
+                                          if isinstance(builder, GraphObservationBuilder)),
+                                         None)
 
         # Observation mask: is a vector of size ("Sum of all ports of all charging stations") showing in which ports an EV is connected
         self.observation_mask = np.zeros(self.number_of_ports)
@@ -265,6 +339,10 @@ class EV2Gym(gym.Env):
     def reset(self, seed=None, options=None, **kwargs):
         '''Resets the environment to its initial state'''
 
+        if self.profile is not None:
+            self.profile.start_episode()
+            self.profile.start()
+
         if seed is None:
             self.seed = np.random.randint(0, 1000000)
         else:
@@ -284,11 +362,21 @@ class EV2Gym(gym.Env):
         for cs in self.charging_stations:
             cs.reset()
 
-        for tr in self.transformers:
-            tr.reset(step=self.current_step)
+        if self.engine is not None:
+            self.engine.reset()
+
+        if self.scenario_bank is not None:
+            # sample the episode from the scenario bank, nothing is generated
+            if options is not None and 'scenario' in options:
+                index = options['scenario']
+            else:
+                index = np.random.default_rng(self.seed).integers(
+                    len(self.scenario_bank))
+            self.scenario_bank.apply(self, index)
 
-        if self.load_from_replay_path is not None or not self.config['random_day']:
-            self.sim_date = self.sim_starting_date
+        elif self.load_from_replay_path is not None or not self.config['random_day']:
+            # the episodes start at the same date
+            pass
         else:
             # select random date in range
 
@@ -296,30 +384,40 @@ class EV2Gym(gym.Env):
                 if self.config["random_hour"]:
                     self.config['hour'] = random.randint(5, 15)
 
-            self.sim_date = datetime.datetime(2022,
-                                              1,
-                                              1,
-                                              self.config['hour'],
-                                              self.config['minute'],
-                                              ) + datetime.timedelta(days=random.randint(0, int(1.5*365)))
+            self.sim_starting_date = datetime.datetime(2022,
+                                                       1,
+                                                       1,
+                                                       self.config['hour'],
+                                                       self.config['minute'],
+                                                       ) + datetime.timedelta(days=random.randint(0, int(1.5*365)))
 
             if self.scenario == 'workplace':
                 # dont simulate weekends
-                while self.sim_date.weekday() > 4:
-                    self.sim_date += datetime.timedelta(days=1)
+                while self.sim_starting_date.weekday() > 4:
+                    self.sim_starting_date += datetime.timedelta(days=1)
 
             if self.config['simulation_days'] == "weekdays":
                 # dont simulate weekends
-                while self.sim_date.weekday() > 4:
-                    self.sim_date += datetime.timedelta(days=1)
+                while self.sim_starting_date.weekday() > 4:
+                    self.sim_starting_date += datetime.timedelta(days=1)
             elif self.config['simulation_days'] == "weekends" and self.scenario != 'workplace':
                 # simulate only weekends
-                while self.sim_date.weekday() < 5:
-                    self.sim_date += datetime.timedelta(days=1)
+                while self.sim_starting_date.weekday() < 5:
+                    self.sim_starting_date += datetime.timedelta(days=1)
 
-        self.sim_starting_date = self.sim_date
-        self.EVs_profiles = load_ev_profiles(self)
-        self.power_setpoints = load_power_setpoints(self)
+        self.timeline = EpisodeTimeline(self.sim_starting_date,
+                                        self.timescale,
+                                        self.simulation_length)
+
+        for tr in self.transformers:
+            tr.reset(step=self.current_step)
+
+        self._lap('reset')
+        if self.scenario_bank is None:
+            self.EVs_profiles = load_ev_profiles(self)
+            self._lap('reset_ev_spawning')
+            self.power_setpoints = load_power_setpoints(self)
+            self._lap('reset_power_setpoints')
         self.EVs = []
 
         # print(f'Simulation starting date: {self.sim_date}')
@@ -328,8 +426,12 @@ class EV2Gym(gym.Env):
         # f'{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")}'
 
         self.init_statistic_variables()
+        self._lap('reset_statistics')
+
+        observation = self._get_observation()
+        self._lap('reset_state')
 
-        return self._get_observation(), {}
+        return observation, {}
 
     def init_statistic_variables(self):
         '''
@@ -346,48 +448,61 @@ class EV2Gym(gym.Env):
         self.previous_power_usage = self.current_power_usage
         self.current_power_usage = np.zeros(self.simulation_length)
 
+        # energy charged and discharged in the current step (kWh)
+        self.current_energy_charged = 0
+        self.current_energy_discharged = 0
+        # running KPIs of the episode (see the kpis property)
+        self.episode_kpis = EpisodeKPIs(self.cs, self.timescale)
+        # incremental charge power potential of the parked EVs
+        self.power_potential = ChargePowerPotential(self.charging_stations)
+        # power limit, load and PV forecast matrices of the transformers
+        self.transformer_forecasts = TransformerForecasts(self.transformers,
+                                                          self.simulation_length)
+
         # self.transformer_amps = np.zeros([self.number_of_transformers,
         #                                   self.simulation_length])
 
-        self.cs_power = np.zeros([self.cs, self.simulation_length])
-        self.cs_current = np.zeros([self.cs, self.simulation_length])
-
-        self.tr_overload = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
-
-        self.tr_inflexible_loads = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
-
-        self.tr_solar_power = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
+        # telemetry arrays, shape (rows, simulation_length)
+        telemetry = {'cs_power': (self.cs, float),
+                     'cs_current': (self.cs, float),
+                     'tr_power': (self.number_of_transformers, float),
+                     'tr_overload': (self.number_of_transformers, float),
+                     'tr_inflexible_loads': (self.number_of_transformers, float),
+                     'tr_solar_power': (self.number_of_transformers, float),
+                     }
 
         # self.port_power = np.zeros([self.number_of_ports,
         #                             self.cs,
         #                             self.simulation_length],
         #                            dtype=np.float16)
         if not self.lightweight_plots:
-            self.port_current = np.zeros([self.number_of_ports,
-                                          self.cs,
-                                          self.simulation_length],
-                                         dtype=np.float16,
-                                         )
-            self.port_current_signal = np.zeros([self.number_of_ports,
-                                                 self.cs,
-                                                 self.simulation_length],
-                                                dtype=np.float16,
-                                                )
-
-            self.port_energy_level = np.zeros([self.number_of_ports,
-                                               self.cs,
-                                               self.simulation_length],
-                                              dtype=np.float16)
-            # self.port_charging_cycles = np.zeros([self.number_of_ports,
-            #                                       self.cs,
-            #                                       self.simulation_length],
-            #                                      dtype=np.float16)
-            self.port_arrival = dict({f'{j}.{i}': []
-                                      for i in range(self.number_of_ports)
-                                      for j in range(self.cs)})
+            # per-port telemetry, shape (number_of_ports, simulation_length) indexed by global port offset
+            for name in PORT_TELEMETRY:
+                telemetry[name] = (self.number_of_ports,
+                                   self.port_telemetry_dtypes[name])
+
+            self.port_arrival = dict({f'{cs.id}.{i}': []
+                                      for cs in self.charging_stations
+                                      for i in range(cs.n_ports)})
+
+        self.telemetry_arrays = telemetry
+        if self.telemetry_path is None:
+            for name, (rows, dtype) in telemetry.items():
+                setattr(self, name, np.zeros([rows, self.simulation_length],
+                                             dtype=dtype))
+        else:
+            if self.telemetry is not None:
+                # the previous episode may not be done
+                self.telemetry.close()
+                if self.telemetry.steps > 0:
+                    self.telemetry_episodes += 1
+            self.telemetry = TelemetryRecorder(os.path.join(self.telemetry_path,
+                                                            self.sim_name,
+                                                            f'episode_{self.telemetry_episodes:05d}'),
+                                               telemetry,
+                                               self.simulation_length,
+                                               chunk_size=self.telemetry_chunk_size)
+            self.telemetry.attach(self)
 
         self.done = False
 
@@ -403,32 +518,64 @@ class EV2Gym(gym.Env):
         '''
         assert not self.done, "Episode is done, please reset the environment"
 
+        self._begin_step()
+
+        if self.engine is not None:
+            # Step all charging stations at once
+            step_results = self.engine.step(actions,
+                                            self.charge_prices[:, self.current_step],
+                                            self.discharge_prices[:, self.current_step],
+                                            self.current_step)
+        else:
+            step_results = self._step_charging_stations(actions)
+
+        return self._end_step(*step_results, visualize=visualize)
+
+    def _begin_step(self):
+        '''Resets the per-step variables before the charging network is stepped'''
+
+        if self.profile is not None:
+            self.profile.start()
+
         if self.verbose:
             print("-"*80)
 
-        total_costs = 0
-        total_invalid_action_punishment = 0
-        user_satisfaction_list = []
-        self.departing_evs = []
-
         self.current_ev_departed = 0
         self.current_ev_arrived = 0
 
-        port_counter = 0
-
         # Reset current power of all transformers
         for tr in self.transformers:
             tr.reset(step=self.current_step)
 
-        # Call step for each charging station and spawn EVs where necessary
+    def _step_charging_stations(self, actions):
+        '''
+        Steps every charging station and updates the transformer loads
+        Outputs:
+            - total_costs, user_satisfaction_list, total_invalid_action_punishment, departing_evs
+        '''
+        total_costs = 0
+        total_invalid_action_punishment = 0
+        user_satisfaction_list = []
+        departing_evs = []
+        self.current_energy_charged = 0
+        self.current_energy_discharged = 0
+
+        port_counter = 0
+
+        # Call step for each charging station
         for i, cs in enumerate(self.charging_stations):
             n_ports = cs.n_ports
+            energy_charged = cs.total_energy_charged
+            energy_discharged = cs.total_energy_discharged
             costs, user_satisfaction, invalid_action_punishment, ev = cs.step(
                 actions[port_counter:port_counter + n_ports],
                 self.charge_prices[cs.id, self.current_step],
                 self.discharge_prices[cs.id, self.current_step])
 
-            self.departing_evs += ev
+            self.current_energy_charged += cs.total_energy_charged - energy_charged
+            self.current_energy_discharged += cs.total_energy_discharged - energy_discharged
+
+            departing_evs += ev
 
             for u in user_satisfaction:
                 user_satisfaction_list.append(u)
@@ -441,18 +588,46 @@ class EV2Gym(gym.Env):
 
             total_costs += costs
             total_invalid_action_punishment += invalid_action_punishment
-            self.current_ev_departed += len(user_satisfaction)
 
             port_counter += n_ports
 
+        return total_costs, user_satisfaction_list, total_invalid_action_punishment, departing_evs
+
+    def _end_step(self, total_costs, user_satisfaction_list, total_invalid_action_punishment,
+                  departing_evs, visualize=False):
+        '''
+        Spawns the arriving EVs, updates the statistics and calculates the reward after the charging network was stepped
+        Returns:
+            - the outputs of step
+        '''
+        self.departing_evs = departing_evs
+        self.current_ev_departed += len(user_satisfaction_list)
+
+        if self.engine is not None:
+            self.current_power_usage[self.current_step] += self.engine.cs_power.sum()
+            self.current_energy_charged = self.engine.cs_energy_charged.sum()
+            self.current_energy_discharged = self.engine.cs_energy_discharged.sum()
+
+            # Update transformer variables for this timestep
+            tr_amps, tr_power = self.engine.get_transformer_loads()
+            for tr in self.transformers:
+                tr.step(tr_amps[tr.id], tr_power[tr.id])
+
+        self._lap('charging_stations')
+
+        for ev in self.departing_evs:
+            self.power_potential.disconnect(ev.location, ev.id)
+
         # Spawn EVs
         counter = self.total_evs_spawned
-        for i, ev in enumerate(self.EVs_profiles[counter:]):
-            if ev.time_of_arrival == self.current_step + 1:
-                ev = deepcopy(ev)
-                ev.reset()
+        for i, session in enumerate(self.EVs_profiles[counter:]):
+            if session.time_of_arrival == self.current_step + 1:
+                ev = EV.from_session(session)
                 ev.simulation_length = self.simulation_length
                 index = self.charging_stations[ev.location].spawn_ev(ev)
+                if self.engine is not None:
+                    self.engine.connect_ev(ev, ev.location, index)
+                self.power_potential.connect(ev.location, index, ev)
 
                 if not self.lightweight_plots:
                     self.port_arrival[f'{ev.location}.{index}'].append(
@@ -462,17 +637,28 @@ class EV2Gym(gym.Env):
                 self.current_ev_arrived += 1
                 self.EVs.append(ev)
 
-            elif ev.time_of_arrival > self.current_step + 1:
+            elif session.time_of_arrival > self.current_step + 1:
                 break
 
-        self._update_power_statistics(self.departing_evs)
+        self._lap('ev_spawning')
+
+        column = self._telemetry_column()
+        self._update_power_statistics(self.departing_evs, column)
+        self._lap('power_statistics')
 
         self.current_step += 1
-        self._step_date()
 
         if self.current_step < self.simulation_length:
-            self.charge_power_potential[self.current_step] = calculate_charge_power_potential(
-                self)
+            if self.engine is not None:
+                ports = np.flatnonzero(self.engine.occupied)
+                self.power_potential.update_full(ports,
+                                                 ~(self.engine.current_capacity[ports] /
+                                                   self.engine.battery_capacity[ports] < 1))
+            else:
+                self.power_potential.update_full()
+            self.charge_power_potential[self.current_step] = self.power_potential.get(
+                self.current_step)
+        self._lap('charge_power_potential')
 
         self.current_evs_parked += self.current_ev_arrived - self.current_ev_departed
 
@@ -494,11 +680,29 @@ class EV2Gym(gym.Env):
                                       total_invalid_action_punishment)
         else:
             cost = None
+        self._lap('reward')
+
+        step = self.current_step - 1
+        self.episode_kpis.record_step(profits=total_costs,
+                                      energy_charged=self.current_energy_charged,
+                                      energy_discharged=self.current_energy_discharged,
+                                      power_setpoint=self.power_setpoints[step],
+                                      power_usage=self.current_power_usage[step],
+                                      transformer_overload=self.tr_overload[:, column].sum(),
+                                      reward=reward)
+        self.episode_kpis.record_departures([ev.location for ev in self.departing_evs],
+                                            user_satisfaction_list)
+        self._lap('kpis')
+
+        if self.telemetry is not None:
+            self.telemetry.record_step(self)
+            self._lap('telemetry')
 
         if visualize:
             visualize_step(self)
 
         self.render()
+        self._lap('render')
 
         return self._check_termination(reward, cost)
 
@@ -507,10 +711,13 @@ class EV2Gym(gym.Env):
         truncated = False
         action_mask = np.zeros(self.number_of_ports)
         # action mask is 1 if an EV is connected to the port
-        for i, cs in enumerate(self.charging_stations):
-            for j in range(cs.n_ports):
-                if cs.evs_connected[j] is not None:
-                    action_mask[i*cs.n_ports + j] = 1
+        if self.engine is not None:
+            action_mask[self.engine.occupied] = 1
+        else:
+            for i, cs in enumerate(self.charging_stations):
+                for j in range(cs.n_ports):
+                    if cs.evs_connected[j] is not None:
+                        action_mask[i*cs.n_ports + j] = 1
 
         # Check if the episode is done or any constraint is violated
         if self.current_step >= self.simulation_length or \
@@ -527,6 +734,9 @@ class EV2Gym(gym.Env):
                 """
 
             self.done = True
+            if self.telemetry is not None:
+                # the telemetry arrays become the memory-mapped arrays of the episode
+                self.telemetry.close(self)
             self.stats = get_statistics(self)
 
             self.stats['action_mask'] = action_mask
@@ -552,20 +762,23 @@ class EV2Gym(gym.Env):
                     pickle.dump(self, f)
                 ev_city_plot(self)
 
-            if self.cost_function is not None:
-                return self._get_observation(), reward, True, truncated, self.stats
-            else:
-                return self._get_observation(), reward, True, truncated, self.stats
+            info = self.stats
+            terminated = True
         else:
-            stats = {
+            info = {
                 'cost': cost,
                 'action_mask': action_mask,
             }
+            terminated = False
 
-            if self.cost_function is not None:
-                return self._get_observation(), reward, False, truncated, stats
-            else:
-                return self._get_observation(), reward, False, truncated, stats
+        self._lap('termination')
+        observation = self._get_observation()
+        self._lap('state')
+
+        if terminated and self.profile is not None:
+            self.profile.end_episode()
+
+        return observation, reward, terminated, truncated, info
 
     def render(self):
         '''Renders the simulation'''
@@ -573,11 +786,14 @@ class EV2Gym(gym.Env):
             self.renderer.render()
 
     def _save_sim_replay(self):
-        '''Saves the simulation data in a pickle file'''
+        '''Saves the simulation data in a replay file (see replay_format)'''
         replay = EvCityReplay(self)
         print(f"Saving replay file at {replay.replay_path}")
-        with open(replay.replay_path, 'wb') as f:
-            pickle.dump(replay, f)
+        if self.replay_format == 'pickle':
+            with open(replay.replay_path, 'wb') as f:
+                pickle.dump(replay, f)
+        else:
+            replay.save(compress=self.replay_format == 'columnar_compressed')
 
         return replay.replay_path
 
@@ -589,48 +805,109 @@ class EV2Gym(gym.Env):
 
         self.save_plots = save_plots
 
-    def _update_power_statistics(self, departing_evs):
-        '''Updates the power statistics of the simulation'''
+    def _telemetry_column(self):
+        '''Returns the column of the current step in the telemetry arrays'''
+        if self.telemetry is None:
+            return self.current_step
+        return self.telemetry.column(self.current_step)
+
+    def _update_power_statistics(self, departing_evs, column):
+        '''Updates the power statistics of the simulation at the given column of the telemetry arrays'''
 
         # if not self.lightweight_plots:
         for tr in self.transformers:
             # self.transformer_amps[tr.id, self.current_step] = tr.current_amps
-            self.tr_overload[tr.id,
-                             self.current_step] = tr.get_how_overloaded()
+            self.tr_power[tr.id, column] = tr.current_power
+            self.tr_overload[tr.id, column] = tr.get_how_overloaded()
             self.tr_inflexible_loads[tr.id,
-                                     self.current_step] = tr.inflexible_load[self.current_step]
+                                     column] = tr.inflexible_load[self.current_step]
             self.tr_solar_power[tr.id,
-                                self.current_step] = tr.solar_power[self.current_step]
+                                column] = tr.solar_power[self.current_step]
+
+        if self.engine is not None:
+            self._update_port_statistics_from_engine(departing_evs, column)
+            return
 
         for cs in self.charging_stations:
-            self.cs_power[cs.id, self.current_step] = cs.current_power_output
-            self.cs_current[cs.id, self.current_step] = cs.current_total_amps
+            self.cs_power[cs.id, column] = cs.current_power_output
+            self.cs_current[cs.id, column] = cs.current_total_amps
 
+            if self.lightweight_plots:
+                continue
+
+            offset = self.cs_port_offset[cs.id]
             for port in range(cs.n_ports):
-                if not self.lightweight_plots:
-                    self.port_current_signal[port, cs.id,
-                                             self.current_step] = cs.current_signal[port]
+                self.port_current_signal[offset + port,
+                                         column] = cs.current_signal[port]
                 ev = cs.evs_connected[port]
-                if ev is not None and not self.lightweight_plots:
-                    # self.port_power[port, cs.id,
-                    #                 self.current_step] = ev.current_energy
-                    self.port_current[port, cs.id,
-                                      self.current_step] = ev.actual_current
+                if ev is not None:
+                    self.port_current[offset + port,
+                                      column] = ev.actual_current
 
-                    self.port_energy_level[port, cs.id,
-                                           self.current_step] = ev.current_capacity/ev.battery_capacity
+                    self.port_energy_level[offset + port,
+                                           column] = ev.current_capacity/ev.battery_capacity
 
-            for ev in self.departing_evs:
-                if not self.lightweight_plots:
-                    self.port_energy_level[ev.id, ev.location, self.current_step] = \
-                        ev.current_capacity/ev.battery_capacity
-                    self.port_current[ev.id, ev.location,
-                                      self.current_step] = ev.actual_current
-
-    def _step_date(self):
-        '''Steps the simulation date by one timestep'''
-        self.sim_date = self.sim_date + \
-            datetime.timedelta(minutes=self.timescale)
+        if not self.lightweight_plots:
+            self._update_departing_port_statistics(self.departing_evs, column)
+
+    def _update_port_statistics_from_engine(self, departing_evs, column):
+        '''Updates the charging station and port statistics using the arrays of the engine'''
+
+        engine = self.engine
+        self.cs_power[:, column] = engine.cs_power
+        self.cs_current[:, column] = engine.cs_current
+
+        if self.lightweight_plots:
+            return
+
+        self.port_current_signal[:, column] = engine.current_signal
+
+        occupied = engine.occupied
+        self.port_current[occupied, column] = engine.actual_current[occupied]
+        self.port_energy_level[occupied, column] = \
+            engine.current_capacity[occupied] / engine.battery_capacity[occupied]
+
+        self._update_departing_port_statistics(departing_evs, column)
+
+    def _update_departing_port_statistics(self, departing_evs, column):
+        '''Records the last energy level and current of the EVs that departed in the current step'''
+        for ev in departing_evs:
+            port = self.cs_port_offset[ev.location] + ev.id
+            self.port_energy_level[port, column] = \
+                ev.current_capacity/ev.battery_capacity
+            self.port_current[port, column] = ev.actual_current
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the compiled observation builders are a cache and hold the feature functions, which cannot be pickled
+        state['observation_builders'] = {}
+        return state
+
+    def snapshot(self) -> EnvSnapshot:
+        '''
+        Returns a snapshot of the mutable state of the current episode (see ev2gym/utilities/snapshot.py),
+        restore it with restore to branch the episode from the current step, e.g. in tree search or lookahead controllers
+        '''
+        return take_snapshot(self)
+
+    def restore(self, snapshot) -> None:
+        '''Restores the state of the current episode saved with snapshot'''
+        restore_snapshot(self, snapshot)
+
+    @property
+    def kpis(self) -> dict:
+        '''The running KPIs of the current episode (see EpisodeKPIs.summary)'''
+        return self.episode_kpis.summary()
+
+    def _lap(self, phase):
+        '''Records the wall time of a phase of step or reset if profiling is enabled'''
+        if self.profile is not None:
+            self.profile.lap(phase)
+
+    @property
+    def sim_date(self) -> datetime.datetime:
+        '''The date of the current step (see the timeline attribute)'''
+        return self.timeline.date(self.current_step)
 
     def _get_observation(self):
 
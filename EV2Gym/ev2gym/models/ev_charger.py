@@ -38,6 +38,18 @@ class EV_Charger:
 
 '''
 
+    __slots__ = ('id', 'connected_bus', 'connected_transformer', 'geo_location',
+                 'n_ports', 'charger_type', 'timescale', 'min_charge_current',
+                 'max_charge_current', 'min_discharge_current',
+                 'max_discharge_current', 'phases', 'voltage',
+                 'current_power_output', 'evs_connected', 'n_evs_connected',
+                 'current_step', 'current_charge_price',
+                 'current_discharge_price', 'current_total_amps',
+                 'current_signal', 'total_energy_charged',
+                 'total_energy_discharged', 'total_profits', 'total_evs_served',
+                 'total_user_satisfaction', 'all_user_satisfaction', 'verbose',
+                 )
+
     def __init__(self,
                  id,
                  connected_bus,
@@ -93,6 +105,14 @@ class EV_Charger:
         self.all_user_satisfaction = []
         self.verbose = verbose
         
+    def __setstate__(self, state):
+        # chargers pickled before EV_Charger had __slots__ (e.g. in older replay files) store their state as a dict
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            if name in EV_Charger.__slots__:
+                setattr(self, name, value)
+
     def reset(self):
         '''Resets the EV charger status to the initial state'''
 
@@ -212,25 +232,38 @@ class EV_Charger:
                 if ev.is_departing(self.current_step) is not None:
                     # calculate battery degradation
                     # _,_ = ev.get_battery_degradation()
-                    self.evs_connected[i] = None
-                    self.n_evs_connected -= 1
-                    self.total_evs_served += 1
-                    ev_user_satisfaction = ev.get_user_satisfaction()
-                    self.total_user_satisfaction += ev_user_satisfaction
+                    ev_user_satisfaction = self.depart_ev(i)
                     user_satisfaction.append(ev_user_satisfaction)
-                    self.all_user_satisfaction.append(ev_user_satisfaction)
-                    
                     departing_evs.append(ev)
-                    if self.verbose:
-                        print(f'- EV {ev.id} is departing from CS {self.id}' +
-                              f' port {i}'
-                              f' with user satisfaction {ev_user_satisfaction}' +
-                              f' (SoC: {ev.get_soc()*100: 6.1f}%)')
 
         self.current_step += 1
 
         return profit, user_satisfaction, invalid_action_punishment, departing_evs
 
+    def depart_ev(self, index):
+        '''Removes the EV connected at port index and updates the user satisfaction statistics
+        Inputs:
+            - index: the port of the departing EV
+        Outputs:
+            - ev_user_satisfaction: the user satisfaction of the departing EV
+        '''
+        ev = self.evs_connected[index]
+
+        self.evs_connected[index] = None
+        self.n_evs_connected -= 1
+        self.total_evs_served += 1
+        ev_user_satisfaction = ev.get_user_satisfaction()
+        self.total_user_satisfaction += ev_user_satisfaction
+        self.all_user_satisfaction.append(ev_user_satisfaction)
+
+        if self.verbose:
+            print(f'- EV {ev.id} is departing from CS {self.id}' +
+                  f' port {index}'
+                  f' with user satisfaction {ev_user_satisfaction}' +
+                  f' (SoC: {ev.get_soc()*100: 6.1f}%)')
+
+        return ev_user_satisfaction
+
     def __str__(self) -> str:
 
         if self.total_evs_served == 0:
@@ -1,16 +1,125 @@
 '''
-This file is part of the ev2gym package. It is used to save the simulation data in a pickle file.
+This file is part of the ev2gym package. It is used to save the simulation data in a replay file.
+
+Replay files are saved either as a pickle of the EvCityReplay object or in the columnar replay
+format: an .npz file with one array per field, the sessions as EVSession columns, the transformers
+and charging stations as columns and the metadata and statistics as a json member. The per-port
+arrays (see SESSION_PORT_ARRAYS) are not stored, they are rebuilt from the sessions when they are
+first accessed. Uncompressed columnar replays are memory-mapped when they are loaded and compressed
+ones are decompressed field by field, so that only the fields that are used are read (see load_replay).
 '''
 
 import os
+import json
+import struct
+import pickle
+import zipfile
+import datetime
 import numpy as np
 import math
 from ev2gym.utilities.utils import get_statistics
+from ev2gym.models.ev import EV, sessions_to_columns, sessions_from_columns
+from ev2gym.models.ev_charger import EV_Charger
+from ev2gym.models.transformer import Transformer
+
+REPLAY_FORMAT_VERSION = 3
+# the oldest version that can still be loaded (version 2 replays store the per-port arrays)
+MIN_REPLAY_FORMAT_VERSION = 2
+# the member of a columnar replay file with the metadata
+META_MEMBER = '__replay__'
+
+# Array fields of EvCityReplay, stored as they are
+REPLAY_ARRAYS = ('power_setpoints', 'ev_load_potential', 'charge_prices', 'discharge_prices',
+                 'tra_max_amps', 'tra_min_amps', 'port_max_charge_current',
+                 'port_min_charge_current', 'port_max_discharge_current',
+                 'port_min_discharge_current', 'voltages', 'phases', 'cs_ch_efficiency',
+                 'cs_dis_efficiency', 'cs_transformer')
+# Per-port array fields of EvCityReplay, shape (max_n_ports, n_cs, sim_length), built from the sessions
+SESSION_PORT_ARRAYS = ('ev_max_energy', 'ev_min_energy', 'ev_max_ch_power', 'ev_max_dis_power',
+                       'u', 'energy_at_arrival', 'ev_arrival', 't_dep', 'ev_des_energy',
+                       'max_energy_at_departure')
+# Metadata fields of EvCityReplay, stored in the json member
+REPLAY_META = ('replay_path', 'sim_name', 'sim_length', 'n_cs', 'n_transformers', 'timescale',
+               'scenario', 'heterogeneous_specs', 'simulate_grid', 'max_n_ports', 'stats',
+               'unstirred_stats', 'optimal_stats')
+# Transformer arrays, shape (n_transformers, simulation_length)
+TRANSFORMER_ARRAYS = ('max_current', 'min_current', 'max_power', 'min_power', 'inflexible_load',
+                      'solar_power', 'inflexible_load_forecast', 'pv_generation_forecast')
+# Charging station fields, the arguments of EV_Charger
+CHARGER_FIELDS = ('id', 'connected_bus', 'connected_transformer', 'min_charge_current',
+                  'max_charge_current', 'min_discharge_current', 'max_discharge_current',
+                  'voltage', 'n_ports', 'charger_type', 'phases', 'timescale')
+
+
+def session_port_arrays(sessions, prev_capacities, max_n_ports, n_cs, sim_length) -> dict:
+    '''
+    Builds the per-port arrays of a replay (see SESSION_PORT_ARRAYS) from its sessions
+    Inputs:
+        - sessions: the EVSession records of the EVs of the replay
+        - prev_capacities: the prev_capacity of every EV at the end of the simulation
+    Returns:
+        - a dict with the arrays, shape (max_n_ports, n_cs, sim_length)
+    '''
+    arrays = {name: np.zeros([max_n_ports, n_cs, sim_length])
+              for name in SESSION_PORT_ARRAYS}
+    # ev_max_energy: ev max battery capacity, 0 if no ev is there
+    # ev_min_energy: ev min battery capacity, 0 if no ev is there
+    # ev_max_ch_power / ev_max_dis_power: ev max charging / discharging power, 0 if no ev is there
+    # u: 0 if port is empty and 1 if port is occupied
+    # energy_at_arrival: x when ev arrives at the port
+    # ev_arrival: 1 when an ev arrives-> power = 0 and energy = x
+    # t_dep: time of departure of the ev, 0 if port is empty
+    # ev_des_energy: desired energy of the ev, 0 if port is empty
+    # max_energy_at_departure: max energy of ev when only charging
+    ev_max_energy = arrays['ev_max_energy']
+    ev_max_ch_power = arrays['ev_max_ch_power']
+    ev_max_dis_power = arrays['ev_max_dis_power']
+    u = arrays['u']
+    energy_at_arrival = arrays['energy_at_arrival']
+    ev_arrival = arrays['ev_arrival']
+    t_dep_array = arrays['t_dep']
+    ev_des_energy = arrays['ev_des_energy']
+    max_energy_at_departure = arrays['max_energy_at_departure']
+
+    for session, prev_capacity in zip(sessions, prev_capacities):
+        port = session.id
+        cs_id = session.location
+        t_arr = session.time_of_arrival
+        original_t_dep = session.time_of_departure
+
+        if t_arr >= sim_length:
+            continue
+        if original_t_dep >= sim_length:
+            t_dep = sim_length
+        else:
+            t_dep = original_t_dep
+
+        ev_max_energy[port, cs_id, t_arr:t_dep] = session.battery_capacity
+        ev_max_ch_power[port, cs_id, t_arr:t_dep] = session.max_ac_charge_power
+        ev_max_dis_power[port, cs_id, t_arr:t_dep] = session.max_discharge_power
+        u[port, cs_id, t_arr:t_dep] = 1
+        energy_at_arrival[port, cs_id, t_arr] = session.battery_capacity_at_arrival
+        ev_arrival[port, cs_id, t_arr] = 1
+        if original_t_dep < sim_length:
+            t_dep_array[port, cs_id, t_dep] = 1
+            if prev_capacity < session.battery_capacity:
+                max_energy_at_departure[port, cs_id, t_dep] = prev_capacity  # -5
+            else:
+                max_energy_at_departure[port, cs_id, t_dep] = session.battery_capacity
+        else:
+            t_dep_array[port, cs_id, t_dep-1] = 1
+            max_energy_at_departure[port, cs_id, t_dep-1] = prev_capacity
+
+        ev_des_energy[port, cs_id, t_dep] = session.desired_capacity
+
+    return arrays
+
 
 class EvCityReplay():
     '''
-    This class is used to save the simulation data in a pickle file.
-    The pickle file can be used to create a math model of the simulation.    
+    This class is used to save the simulation data in a replay file, either pickled or in the
+    columnar replay format (see save and load_replay).
+    The replay file can be used to create a math model of the simulation.
     '''
 
     def __init__(self, env):
@@ -21,7 +130,8 @@ class EvCityReplay():
 
         self.stats = env.stats
 
-        self.replay_path = env.replay_path + 'replay_' + env.sim_name + '.pkl'
+        extension = '.pkl' if getattr(env, 'replay_format', 'pickle') == 'pickle' else '.npz'
+        self.replay_path = env.replay_path + 'replay_' + env.sim_name + extension
         self.sim_name = env.sim_name + '_replay'
         self.sim_length = env.simulation_length
         self.n_cs = env.cs
@@ -108,87 +218,260 @@ class EvCityReplay():
 
             self.cs_transformer[i] = cs.connected_transformer
 
-        self.ev_max_energy = np.zeros([self.max_n_ports,
-                                      self.n_cs,
-                                      self.sim_length])  # ev max battery capacity, 0 if no ev is there
-        self.ev_min_energy = np.zeros([self.max_n_ports,
-                                       self.n_cs,
-                                       self.sim_length])  # ev min battery capacity, 0 if no ev is there
-        self.ev_max_ch_power = np.zeros([self.max_n_ports,
-                                         self.n_cs,
-                                         self.sim_length])  # ev max charging power, 0 if no ev is there
-        # self.ev_min_ch_power = np.zeros([self.max_n_ports,
-        #                                  self.n_cs,
-        #                                  self.sim_length])  # ev min charging power, 0 if no ev is there
-        self.ev_max_dis_power = np.zeros([self.max_n_ports,
+        port_arrays = session_port_arrays(self.sessions,
+                                          [ev.prev_capacity for ev in self.EVs],
+                                          self.max_n_ports,
                                           self.n_cs,
-                                          self.sim_length])  # ev max discharging power, 0 if no ev is there
-        # self.ev_min_dis_power = np.zeros([self.max_n_ports,
-        #                                   self.n_cs,
-        #                                   self.sim_length])  # ev min discharging power, 0 if no ev is there
-        self.u = np.zeros([self.max_n_ports,
-                           self.n_cs,
-                           self.sim_length])  # u is 0 if port is empty and 1 if port is occupied
-        self.energy_at_arrival = np.zeros([self.max_n_ports,
-                                           self.n_cs,
-                                           self.sim_length])  # x when ev arrives at the port
-        self.ev_arrival = np.zeros([self.max_n_ports,
-                                    self.n_cs,
-                                    self.sim_length])  # 1 when an ev arrives-> power = 0 and energy = x
-        self.t_dep = np.zeros([self.max_n_ports,
-                               self.n_cs,
-                               self.sim_length])  # time of departure of the ev, 0 if port is empty
-        self.ev_des_energy = np.zeros([self.max_n_ports,
-                                       self.n_cs,
-                                       self.sim_length])  # desired energy of the ev, 0 if port is empty
-        self.max_energy_at_departure = np.zeros([self.max_n_ports,
-                                                self.n_cs,
-                                                self.sim_length])  # max energy of ev when only charging
-
-        for i, ev in enumerate(env.EVs):
-            port = ev.id
-            cs_id = ev.location
-            t_arr = ev.time_of_arrival
-            original_t_dep = ev.time_of_departure
-            # print(f'EV {i} is at port {port} of CS {cs_id} from {t_arr} to {original_t_dep}')            
-
-            if t_arr >= self.sim_length:
-                continue
-            if original_t_dep >= self.sim_length:
-                t_dep = self.sim_length
+                                          self.sim_length)
+        for name, values in port_arrays.items():
+            setattr(self, name, values)
+
+    @property
+    def sessions(self) -> list:
+        '''The EVSession records of the EVs of the replay'''
+        return [ev.to_session() for ev in self.EVs]
+
+    def save(self, path=None, compress=False) -> str:
+        '''
+        Saves the replay in the columnar replay format
+        Inputs:
+            - path: the replay file (default: replay_path)
+            - compress: whether to compress the arrays (compressed replays cannot be memory-mapped)
+        Returns:
+            - the path of the replay file
+        '''
+        path = self.replay_path if path is None else path
+
+        arrays = {name: np.asarray(getattr(self, name)) for name in REPLAY_ARRAYS}
+
+        for name, values in sessions_to_columns(self.sessions).items():
+            arrays[f'session_{name}'] = values
+        # the per-port arrays are rebuilt from the sessions and the final prev_capacity of the EVs
+        arrays['ev_prev_capacity'] = np.array([ev.prev_capacity for ev in self.EVs], dtype=float)
+
+        transformers = self.transformers
+        for name in TRANSFORMER_ARRAYS:
+            arrays[f'tr_{name}'] = np.array([getattr(tr, name) for tr in transformers],
+                                            dtype=float)
+        arrays['tr_id'] = np.array([tr.id for tr in transformers], dtype=np.int64)
+        arrays['tr_voltage'] = np.array([tr.voltage for tr in transformers], dtype=float)
+        arrays['tr_steps_ahead'] = np.array([tr.steps_ahead for tr in transformers],
+                                            dtype=np.int64)
+        # the charging stations and demand response events of every transformer, concatenated
+        arrays['tr_cs_ids'] = np.concatenate([np.asarray(tr.cs_ids, dtype=np.int64)
+                                              for tr in transformers])
+        arrays['tr_cs_ids_count'] = np.array([len(tr.cs_ids) for tr in transformers],
+                                             dtype=np.int64)
+        arrays['tr_dr_events'] = np.array([(event['event_start_step'],
+                                            event['event_end_step'],
+                                            event['capacity_percentage'])
+                                           for tr in transformers for event in tr.dr_events],
+                                          dtype=float).reshape(-1, 3)
+        arrays['tr_dr_events_count'] = np.array([len(tr.dr_events) for tr in transformers],
+                                                dtype=np.int64)
+
+        for name in CHARGER_FIELDS:
+            arrays[f'charger_{name}'] = np.array([getattr(cs, name)
+                                             for cs in self.charging_stations])
+
+        meta = {name: getattr(self, name) for name in REPLAY_META}
+        meta['version'] = REPLAY_FORMAT_VERSION
+        meta['sim_date'] = self.sim_date.isoformat()
+        # optimal_EVs is either None or the EVs of the replay
+        meta['has_optimal_EVs'] = self.optimal_EVs is not None
+        arrays[META_MEMBER] = np.frombuffer(json.dumps(meta, default=_json_default).encode(),
+                                            dtype=np.uint8)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            if compress:
+                np.savez_compressed(f, **arrays)
             else:
-                t_dep = original_t_dep                            
-
-            self.ev_max_energy[port, cs_id, t_arr:t_dep] = ev.battery_capacity
-            # self.ev_min_energy[port, cs_id, t_arr:t_dep] = ev.battery_capacity * ev.min_soc
-            self.ev_max_ch_power[port, cs_id,
-                                 t_arr:t_dep] = ev.max_ac_charge_power
-            # self.ev_min_ch_power[port, cs_id,
-            #                      t_arr:t_dep] = 0
-            self.ev_max_dis_power[port, cs_id,
-                                  t_arr:t_dep] = ev.max_discharge_power
-            # self.ev_min_dis_power[port, cs_id,
-            #                       t_arr:t_dep] = 0
-            self.u[port, cs_id, t_arr:t_dep] = 1            
-            self.energy_at_arrival[port, cs_id,
-                                   t_arr] = ev.battery_capacity_at_arrival
-            self.ev_arrival[port, cs_id, t_arr] = 1
-            if original_t_dep < self.sim_length:
-                self.t_dep[port, cs_id, t_dep] = 1            
-                if ev.prev_capacity < ev.battery_capacity:
-                    self.max_energy_at_departure[port, cs_id, t_dep] = ev.prev_capacity #-5
-                else:
-                    self.max_energy_at_departure[port, cs_id, t_dep] = ev.battery_capacity
+                np.savez(f, **arrays)
+
+        return path
+
+
+def _json_default(value):
+    '''Converts the numpy values of the statistics to json'''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Cannot store {type(value)} in a replay file')
+
+
+def _npz_members(path) -> dict:
+    '''
+    Returns how every array of the .npz file at path can be read: the offset, shape, order and
+    dtype of the array data for stored (uncompressed) members, or None for compressed members
+    '''
+    members = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') \
+                else info.filename
+            members[name] = (info.filename, None)
+            if info.compress_type != zipfile.ZIP_STORED:
+                continue
+
+            # the data of a stored member starts after its local file header
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
             else:
-                self.t_dep[port, cs_id, t_dep-1] = 1                            
-                self.max_energy_at_departure[port, cs_id, t_dep-1] = ev.prev_capacity
-            
-            self.ev_des_energy[port, cs_id, t_dep] = ev.desired_capacity
-
-        # print(f'u: {self.u}')
-        # print(f'ev_arrival: {self.ev_arrival}')
-        # print(f't_dep: {self.t_dep}')
-        # print(f'ev_des_energy: {self.ev_des_energy}')
-        # print(f'ev_max_energy: {self.ev_max_energy}')
-        # print(f'ev_max_ch_power: {self.ev_max_ch_power}')
-        # print(f'ev_max_dis_power: {self.ev_max_dis_power}')
\ No newline at end of file
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if not dtype.hasobject and int(np.prod(shape)) > 0:
+                members[name] = (info.filename,
+                                 (f.tell(), shape, 'F' if fortran_order else 'C', dtype))
+    return members
+
+
+class ColumnarReplay():
+    '''
+    A replay file in the columnar replay format, with the same fields as EvCityReplay.
+
+    The arrays are only read when they are accessed: uncompressed replays are memory-mapped
+    and the members of compressed replays are decompressed one at a time. The sessions,
+    EVs, transformers and charging stations are rebuilt from their columns, and the per-port
+    arrays from the sessions, on first access.
+    The EVs are new EVs in their arrival state (see EV.from_session).
+
+    Attributes:
+        - path: the replay file
+        - the metadata and the arrays of EvCityReplay (see REPLAY_META, REPLAY_ARRAYS and
+          SESSION_PORT_ARRAYS)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._members = _npz_members(path)
+        self._objects = {}
+
+        meta = json.loads(self._read(META_MEMBER).tobytes().decode())
+        if not MIN_REPLAY_FORMAT_VERSION <= meta['version'] <= REPLAY_FORMAT_VERSION:
+            raise ValueError(f'The replay file {path} has version {meta["version"]}' +
+                             f' instead of {REPLAY_FORMAT_VERSION}')
+
+        for name in REPLAY_META:
+            setattr(self, name, meta[name])
+        self.sim_date = datetime.datetime.fromisoformat(meta['sim_date'])
+        self.has_optimal_EVs = meta['has_optimal_EVs']
+        self.unstirred_EVs = None
+
+    def _read(self, name) -> np.ndarray:
+        '''Reads the array name, memory-mapped if the member is not compressed'''
+        file_name, mapping = self._members[name]
+        if mapping is not None:
+            offset, shape, order, dtype = mapping
+            return np.memmap(self.path, dtype=dtype, mode='r', offset=offset,
+                             shape=shape, order=order)
+
+        with zipfile.ZipFile(self.path) as zf, zf.open(file_name) as f:
+            return np.lib.format.read_array(f)
+
+    def __getattr__(self, name):
+        # only called for the attributes that are not set yet, i.e. the arrays that are not read yet
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in self._members:
+            value = self._read(name)
+        elif name in SESSION_PORT_ARRAYS:
+            port_arrays = session_port_arrays(self.sessions,
+                                              self._read('ev_prev_capacity'),
+                                              self.max_n_ports,
+                                              self.n_cs,
+                                              self.sim_length)
+            for array_name, values in port_arrays.items():
+                setattr(self, array_name, values)
+            value = port_arrays[name]
+        else:
+            raise AttributeError(name)
+
+        setattr(self, name, value)
+        return value
+
+    def _columns(self, prefix) -> dict:
+        return {name[len(prefix):]: self._read(name)
+                for name in self._members if name.startswith(prefix)}
+
+    @property
+    def sessions(self) -> list:
+        '''The EVSession records of the EVs of the replay'''
+        if 'sessions' not in self._objects:
+            self._objects['sessions'] = sessions_from_columns(self._columns('session_'))
+        return self._objects['sessions']
+
+    @property
+    def EVs(self) -> list:
+        if 'EVs' not in self._objects:
+            self._objects['EVs'] = [EV.from_session(session) for session in self.sessions]
+        return self._objects['EVs']
+
+    @property
+    def optimal_EVs(self):
+        return self.EVs if self.has_optimal_EVs else None
+
+    @property
+    def transformers(self) -> list:
+        if 'transformers' not in self._objects:
+            self._objects['transformers'] = self._load_transformers()
+        return self._objects['transformers']
+
+    @property
+    def charging_stations(self) -> list:
+        if 'charging_stations' not in self._objects:
+            columns = self._columns('charger_')
+            self._objects['charging_stations'] = [
+                EV_Charger(**{name: columns[name][i].item() for name in CHARGER_FIELDS})
+                for i in range(self.n_cs)]
+        return self._objects['charging_stations']
+
+    def _load_transformers(self) -> list:
+        '''Rebuilds the Transformer objects from their columns'''
+        columns = self._columns('tr_')
+        cs_ids_offsets = np.concatenate(([0], np.cumsum(columns['cs_ids_count'])))
+        dr_offsets = np.concatenate(([0], np.cumsum(columns['dr_events_count'])))
+
+        transformers = []
+        for i in range(self.n_transformers):
+            # the arrays of the transformer are set directly, the constructor generates them
+            tr = Transformer.__new__(Transformer)
+            tr.id = int(columns['id'][i])
+            tr.voltage = float(columns['voltage'][i])
+            for name in TRANSFORMER_ARRAYS:
+                setattr(tr, name, np.array(columns[name][i]))
+            tr.cs_ids = np.array(columns['cs_ids'][cs_ids_offsets[i]:cs_ids_offsets[i+1]])
+            tr.simulation_length = self.sim_length
+            tr.steps_ahead = int(columns['steps_ahead'][i])
+            tr.dr_events = [{'event_start_step': int(event[0]),
+                             'event_end_step': int(event[1]),
+                             'capacity_percentage': event[2]}
+                            for event in columns['dr_events'][dr_offsets[i]:dr_offsets[i+1]]]
+            tr.current_amps = 0
+            tr.current_power = 0
+            tr.current_step = 0
+            transformers.append(tr)
+        return transformers
+
+
+def load_replay(path):
+    '''
+    Loads a replay file, either in the columnar replay format or pickled
+    Returns:
+        - a ColumnarReplay or an EvCityReplay
+    '''
+    if zipfile.is_zipfile(path):
+        return ColumnarReplay(path)
+
+    with open(path, 'rb') as f:
+        return pickle.load(f)
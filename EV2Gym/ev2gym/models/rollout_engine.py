@@ -0,0 +1,417 @@
+'''
+This file contains the RolloutEngine class, a batched what-if simulator for model-based controllers
+(e.g. MPC, CEM or MPPI planners): it rolls out K candidate action sequences from the current state
+of an EV2Gym environment at once, without modifying the environment.
+
+Usage:
+    rollouts = RolloutEngine(env, n_branches=K)
+    traces = rollouts.rollout(actions)  # actions: (K, H, number_of_ports)
+    best = traces['reward'].sum(axis=1).argmax()
+'''
+
+import math
+import numpy as np
+
+from ev2gym.models.ev import EV
+from ev2gym.models.array_engine import ArrayEngine, efficiency_curve
+from ev2gym.models.transformer import Transformer
+from ev2gym.rl_agent import reward as rewards
+from ev2gym.rl_agent import cost as costs
+
+
+class RolloutEngine(ArrayEngine):
+    '''
+    Array engine that simulates K branches of the charging network of an environment at once.
+
+    The port and charging station arrays of the engine hold K copies of the charging network
+    (branch k uses the ports k * number_of_ports to (k+1) * number_of_ports - 1), which are loaded
+    from the current state of the environment at the start of every rollout. Every step applies the
+    charger action normalization and the battery model of ArrayEngine to all branches, then the
+    departures, transformer loads, EV arrivals and charge power potential exactly as EV2Gym.step,
+    so the traces of a branch are the ones the environment would produce for its action sequence.
+
+    The rewards and costs are computed with the reward and cost functions of the environment. The
+    example functions of rl_agent/reward.py and rl_agent/cost.py have batched versions (see
+    BATCHED_FUNCTIONS), other functions are called once per branch and step with a read-only view
+    of the branch.
+
+    The battery degradation statistics of the EVs (SoC sums and means) are not simulated.
+
+    Attributes:
+        - env: the simulated environment
+        - n_branches: the number of branches K
+
+    Methods:
+        - rollout: simulates K action sequences from the current state of the environment
+    '''
+
+    def __init__(self, env, n_branches):
+
+        self.env = env
+        self.n_branches = n_branches
+        # engine with the current state of the environment if it does not use the array engine
+        self.source = ArrayEngine(env) if env.engine is None else None
+        base = env.engine if env.engine is not None else self.source
+
+        self.timescale = base.timescale
+        self.charging_stations = base.charging_stations
+        self.base_n_ports = base.n_ports
+        self.base_n_cs = base.n_cs
+        self.base_n_transformers = base.n_transformers
+        self.base_cs_port_offset = base.cs_port_offset
+
+        K = n_branches
+        self.n_ports = K * base.n_ports
+        self.n_cs = K * base.n_cs
+        self.n_transformers = K * base.n_transformers
+
+        self.port_cs = (base.port_cs[None, :] +
+                        base.n_cs * np.arange(K)[:, None]).ravel()
+        self.cs_port_offset = (base.cs_port_offset[None, :] +
+                               base.n_ports * np.arange(K)[:, None]).ravel()
+        self.cs_transformer = (base.cs_transformer[None, :] +
+                               base.n_transformers * np.arange(K)[:, None]).ravel()
+        self.cs_max_charge_current = np.tile(base.cs_max_charge_current, K)
+        for name in ('port_max_charge_current', 'port_min_charge_current',
+                     'port_max_discharge_current', 'port_min_discharge_current',
+                     'port_voltage', 'port_phases', 'port_number'):
+            setattr(self, name, np.tile(getattr(base, name), K))
+
+        self._allocate()
+        self.evs = [None] * self.n_ports
+        self.desired_capacity = np.ones(self.n_ports)
+
+        # static limits of the charge power potential of every charging station
+        cs = self.charging_stations
+        self.max_cs_power = np.array([math.sqrt(c.phases) * c.voltage * c.max_charge_current / 1000
+                                      for c in cs])
+        self.min_cs_power = np.array([math.sqrt(c.phases) * c.voltage * c.min_charge_current / 1000
+                                      for c in cs])
+
+    def rollout(self, actions) -> dict:
+        '''
+        Simulates K action sequences of H steps from the current state of the environment
+        Inputs:
+            - actions: array of shape (K, H, number_of_ports) taking values in [-1,1]
+        Returns:
+            - a dict of traces with one row per branch:
+                - reward, cost: the reward and cost of every step, shape (K, H) (cost is None without a cost function)
+                - total_costs: the profits + costs of charging and discharging of every step, shape (K, H)
+                - power_usage, energy_charged, energy_discharged: the charging network totals of every step, shape (K, H)
+                - charge_power_potential: the charge power potential after every step, shape (K, H)
+                - tr_power, tr_overload: the power and overload of every transformer, shape (K, n_transformers, H)
+                - user_satisfaction, ev_departures: the sum of the user satisfaction and the number of the departing EVs, shape (K, H)
+                - invalid_action_punishment: the number of actions given to empty ports, shape (K, H)
+                - soc, occupied: the SoC and occupancy of every port after the last step, shape (K, number_of_ports)
+        '''
+        env = self.env
+        K = self.n_branches
+        P = self.base_n_ports
+        actions = np.asarray(actions, dtype=float)
+        assert actions.ndim == 3 and actions.shape[0] == K and actions.shape[2] == P, \
+            f'The actions must have shape ({K}, horizon, {P})'
+        H = actions.shape[1]
+        start = env.current_step
+        assert not env.done, 'Episode is done, please reset the environment'
+        assert start + H <= env.simulation_length, \
+            f'The horizon {H} exceeds the simulation length after step {start}'
+
+        self._load_state()
+
+        n_tr = self.base_n_transformers
+        traces = {name: np.zeros((K, H))
+                  for name in ('reward', 'total_costs', 'power_usage', 'energy_charged',
+                               'energy_discharged', 'user_satisfaction', 'ev_departures',
+                               'invalid_action_punishment')}
+        traces['tr_power'] = np.zeros((K, n_tr, H))
+        traces['tr_overload'] = np.zeros((K, n_tr, H))
+        # the charge power potential of steps start to start + H
+        potential = np.zeros((K, H + 1))
+        potential[:, 0] = env.charge_power_potential[start]
+        cost = np.zeros((K, H)) if env.cost_function is not None else None
+
+        tr_base = np.array([[tr.inflexible_load[step] + tr.solar_power[step]
+                             for tr in env.transformers]
+                            for step in range(start, start + H)])
+        branch = np.repeat(np.arange(K), P)
+        spawned = env.total_evs_spawned
+
+        for h in range(H):
+            step = start + h
+            stepped = self.occupied.copy()
+
+            self._step_ports(actions[:, h].ravel(),
+                             np.tile(env.charge_prices[:, step], K),
+                             np.tile(env.discharge_prices[:, step], K))
+
+            traces['total_costs'][:, h] = self.cs_profits.reshape(K, -1).sum(axis=1)
+            traces['power_usage'][:, h] = self.cs_power.reshape(K, -1).sum(axis=1)
+            traces['energy_charged'][:, h] = self.cs_energy_charged.reshape(K, -1).sum(axis=1)
+            traces['energy_discharged'][:, h] = self.cs_energy_discharged.reshape(K, -1).sum(axis=1)
+            traces['invalid_action_punishment'][:, h] = P - stepped.reshape(K, P).sum(axis=1)
+
+            # departures, in port order as in ArrayEngine.end_step
+            departing = np.flatnonzero(self.occupied & (self.time_of_departure <= step))
+            capacity = self.current_capacity[departing]
+            desired = self.desired_capacity[departing]
+            satisfaction = np.where(capacity < desired - 0.001, capacity / desired, 1)
+            departing_branch = branch[departing]
+            traces['user_satisfaction'][:, h] = np.bincount(departing_branch, weights=satisfaction,
+                                                            minlength=K)
+            traces['ev_departures'][:, h] = np.bincount(departing_branch, minlength=K)
+            self.occupied[departing] = False
+
+            # transformer loads (Transformer.reset and Transformer.step)
+            tr_power = tr_base[h] + np.bincount(self.cs_transformer, weights=self.cs_power,
+                                                minlength=self.n_transformers).reshape(K, n_tr)
+            max_power = np.array([tr.max_power[step] for tr in env.transformers])
+            min_power = np.array([tr.min_power[step] for tr in env.transformers])
+            overloaded = (tr_power > max_power + 0.0001) | (tr_power < min_power - 0.0001)
+            traces['tr_power'][:, :, h] = tr_power
+            traces['tr_overload'][:, :, h] = np.where(overloaded,
+                                                      np.abs(tr_power - max_power), 0)
+
+            spawned = self._spawn_evs(spawned, step + 1)
+
+            if step + 1 < env.simulation_length:
+                potential[:, h + 1] = self._charge_power_potential(step + 1)
+
+            step_values = {'step': step,
+                           'power_usage': traces['power_usage'][:, h],
+                           'charge_power_potential': potential[:, h],
+                           'previous_charge_power_potential': potential[:, h - 1] if h > 0
+                           else np.full(K, env.charge_power_potential[step - 1]),
+                           'total_costs': traces['total_costs'][:, h],
+                           'tr_power': tr_power,
+                           'tr_overload': traces['tr_overload'][:, :, h],
+                           'departing_branch': departing_branch,
+                           'satisfaction': satisfaction,
+                           'invalid_action_punishment': traces['invalid_action_punishment'][:, h],
+                           }
+            traces['reward'][:, h] = self._evaluate(env.reward_function, step_values)
+            if cost is not None:
+                cost[:, h] = self._evaluate(env.cost_function, step_values)
+
+        traces['cost'] = cost
+        traces['charge_power_potential'] = potential[:, 1:]
+        traces['soc'] = (self.current_capacity / self.battery_capacity).reshape(K, P)
+        traces['occupied'] = self.occupied.reshape(K, P).copy()
+        return traces
+
+    def _load_state(self) -> None:
+        '''Copies the current state of the environment to all branches'''
+        env = self.env
+        source = env.engine
+        if source is None:
+            source = self.source
+            source.reset()
+            for cs in env.charging_stations:
+                for index, ev in enumerate(cs.evs_connected):
+                    if ev is not None:
+                        source.connect_ev(ev, cs.id, index)
+
+        K = self.n_branches
+        for name in self._PORT_VARIABLES:
+            values = getattr(source, name)
+            getattr(self, name)[:] = np.tile(values, (K, 1)) if values.ndim == 2 \
+                else np.tile(values, K)
+
+        self.desired_capacity[:] = np.tile([ev.desired_capacity if ev is not None else 1
+                                            for ev in source.evs], K)
+
+    def _spawn_evs(self, spawned, arrival_step) -> int:
+        '''
+        Connects the EVs arriving at arrival_step to the first free port of their charging station
+        in all branches (the free ports do not depend on the actions)
+        Returns:
+            - the number of spawned sessions
+        '''
+        sessions = self.env.EVs_profiles
+        P = self.base_n_ports
+        branch_offsets = P * np.arange(self.n_branches)
+
+        while spawned < len(sessions):
+            session = sessions[spawned]
+            if session.time_of_arrival > arrival_step:
+                break
+            spawned += 1
+            if session.time_of_arrival < arrival_step:
+                continue
+
+            ev = EV.from_session(session)
+            cs_id = ev.location
+            offset = self.base_cs_port_offset[cs_id]
+            free = np.flatnonzero(~self.occupied[offset:offset + self.charging_stations[cs_id].n_ports])
+            assert len(free) > 0, f'No free port at CS {cs_id}'
+            ports = offset + free[0] + branch_offsets
+
+            self.occupied[ports] = True
+            for name in self._EV_FLOAT_VARIABLES + self._EV_INT_VARIABLES:
+                getattr(self, name)[ports] = getattr(ev, name)
+            self.desired_capacity[ports] = ev.desired_capacity
+            self.charge_efficiency[ports] = efficiency_curve(ev.charge_efficiency)
+            if isinstance(ev.charge_efficiency, (dict, np.ndarray)):
+                self.discharge_efficiency[ports] = efficiency_curve(ev.discharge_efficiency)
+            else:
+                self.discharge_efficiency[ports] = ev.discharge_efficiency
+
+        return spawned
+
+    def _charge_power_potential(self, step) -> np.ndarray:
+        '''Returns the charge power potential of every branch at step (see calculate_charge_power_potential)'''
+        ports = np.flatnonzero(self.occupied &
+                               (self.current_capacity / self.battery_capacity < 1) &
+                               (self.time_of_departure > step))
+
+        sqrt_phases = np.sqrt(np.minimum(self.port_phases[ports], self.ev_phases[ports]))
+        voltage = self.port_voltage[ports]
+        ev_current = self.max_ac_charge_power[ports] * 1000 / (sqrt_phases * voltage)
+        current = np.minimum(self.port_max_charge_current[ports], ev_current)
+        power = np.zeros(self.n_ports)
+        power[ports] = sqrt_phases * voltage * current / 1000
+
+        cs_potential = np.bincount(self.port_cs, weights=power,
+                                   minlength=self.n_cs).reshape(self.n_branches, -1)
+        cs_potential = np.where(cs_potential > self.max_cs_power, self.max_cs_power,
+                                np.where(cs_potential < self.min_cs_power, 0, cs_potential))
+        return cs_potential.sum(axis=1)
+
+    def _evaluate(self, function, values) -> np.ndarray:
+        '''Returns the value of a reward or cost function for every branch'''
+        batched = BATCHED_FUNCTIONS.get(function)
+        if batched is not None:
+            return batched(self.env, values)
+
+        result = np.zeros(self.n_branches)
+        for k in range(self.n_branches):
+            view = _BranchView(self.env, values, k)
+            user_satisfaction_list = values['satisfaction'][values['departing_branch'] == k].tolist()
+            result[k] = function(view,
+                                 values['total_costs'][k],
+                                 user_satisfaction_list,
+                                 values['invalid_action_punishment'][k])
+        return result
+
+
+class _BranchSeries():
+    '''A time series of the environment whose value at step is the one of a branch'''
+
+    def __init__(self, series, step, value):
+        self.series = series
+        self.step = step
+        self.value = value
+
+    def __getitem__(self, index):
+        if index == self.step:
+            return self.value
+        return self.series[index]
+
+    def __len__(self):
+        return len(self.series)
+
+
+class _TransformerView():
+    '''A transformer of a branch, with the power of the branch at the current step'''
+
+    is_overloaded = Transformer.is_overloaded
+    get_how_overloaded = Transformer.get_how_overloaded
+
+    def __init__(self, transformer, step, power):
+        self.transformer = transformer
+        self.current_step = step
+        self.current_power = power
+
+    def __getattr__(self, name):
+        return getattr(self.transformer, name)
+
+
+class _BranchView():
+    '''
+    Read-only view of a branch of a rollout after a step, passed to the reward and cost functions
+    without a batched version
+    '''
+
+    def __init__(self, env, values, k):
+        step = values['step']
+        self.env = env
+        self.current_step = step + 1
+        self.current_power_usage = _BranchSeries(env.current_power_usage, step,
+                                                 values['power_usage'][k])
+        self.charge_power_potential = _BranchSeries(
+            _BranchSeries(env.charge_power_potential, step - 1,
+                          values['previous_charge_power_potential'][k]),
+            step, values['charge_power_potential'][k])
+        self.transformers = [_TransformerView(tr, step, values['tr_power'][k, i])
+                             for i, tr in enumerate(env.transformers)]
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+
+def _squared_tracking_error(env, v):
+    setpoint = env.power_setpoints[v['step']]
+    return -(np.minimum(setpoint, v['charge_power_potential']) - v['power_usage'])**2
+
+
+def _subtract_transformer_overload(reward, v, weight=100):
+    for i in range(v['tr_overload'].shape[1]):
+        reward -= weight * v['tr_overload'][:, i]
+    return reward
+
+
+def _batched_SqTrError_TrPenalty_UserIncentives(env, v):
+    setpoint = env.power_setpoints[v['step']]
+    tr_max_limit = env.transformers[0].max_power[v['step']]
+    reward = -(np.minimum(np.minimum(setpoint, v['charge_power_potential']), tr_max_limit) -
+               v['power_usage'])**2
+    reward = _subtract_transformer_overload(reward, v)
+    np.subtract.at(reward, v['departing_branch'], 1000 * (1 - v['satisfaction']))
+    return reward
+
+
+def _batched_ProfitMax_TrPenalty_UserIncentives(env, v):
+    reward = _subtract_transformer_overload(v['total_costs'].copy(), v)
+    np.subtract.at(reward, v['departing_branch'], 100 * np.exp(-10 * v['satisfaction']))
+    return reward
+
+
+def _batched_SquaredTrackingErrorRewardWithPenalty(env, v):
+    reward = _squared_tracking_error(env, v)
+    not_charging = (v['power_usage'] == 0) & (v['previous_charge_power_potential'] != 0)
+    return np.where(not_charging, reward - 100, reward)
+
+
+def _batched_SimpleReward(env, v):
+    return -(env.power_setpoints[v['step']] - v['power_usage'])**2
+
+
+def _batched_MinimizeTrackerSurplusWithChargeRewards(env, v):
+    setpoint = env.power_setpoints[v['step']]
+    usage = v['power_usage']
+    return np.where(setpoint < usage, -(usage - setpoint)**2, 0) + usage
+
+
+def _batched_profit_maximization(env, v):
+    reward = v['total_costs'].copy()
+    np.subtract.at(reward, v['departing_branch'], 100 * np.exp(-10 * v['satisfaction']))
+    return reward
+
+
+def _batched_transformer_overload_usrpenalty_cost(env, v):
+    cost = -_subtract_transformer_overload(np.zeros(len(v['total_costs'])), v)
+    np.add.at(cost, v['departing_branch'], 100 * np.exp(-10 * v['satisfaction']))
+    return cost
+
+
+# Batched versions of the example reward and cost functions: function -> f(env, step values) -> (K,)
+BATCHED_FUNCTIONS = {
+    rewards.SquaredTrackingErrorReward: _squared_tracking_error,
+    rewards.SqTrError_TrPenalty_UserIncentives: _batched_SqTrError_TrPenalty_UserIncentives,
+    rewards.ProfitMax_TrPenalty_UserIncentives: _batched_ProfitMax_TrPenalty_UserIncentives,
+    rewards.SquaredTrackingErrorRewardWithPenalty: _batched_SquaredTrackingErrorRewardWithPenalty,
+    rewards.SimpleReward: _batched_SimpleReward,
+    rewards.MinimizeTrackerSurplusWithChargeRewards: _batched_MinimizeTrackerSurplusWithChargeRewards,
+    rewards.profit_maximization: _batched_profit_maximization,
+    costs.transformer_overload_usrpenalty_cost: _batched_transformer_overload_usrpenalty_cost,
+    costs.ProfitMax_TrPenalty_UserIncentives_safety: lambda env, v: v['total_costs'].copy(),
+}
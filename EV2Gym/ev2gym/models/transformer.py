@@ -102,8 +102,8 @@ class Transformer():
             event_start_hour = np.clip(event_start_hour, 0, 23*60)
             event_start_step = event_start_hour // env.timescale
 
-            sim_start_step = (env.sim_date.hour * 60 +
-                              env.sim_date.minute) // env.timescale
+            sim_start_step = (env.timeline.hour[0] * 60 +
+                              env.timeline.minute[0]) // env.timescale
             event_start_step = int(event_start_step - sim_start_step)
 
             event_end_step = int(event_start_step +
@@ -223,13 +223,9 @@ class Transformer():
             self.inflexible_load = self.inflexible_load * \
                 mult * (max(self.max_power) /
                         self.inflexible_load.max()+0.0000001)
-            # for each step
-            for j in range(env.simulation_length):
-                if self.inflexible_load[j] > self.max_power[j]:
-                    self.inflexible_load[j] = self.max_power[j]
-
-                elif self.inflexible_load[j] < self.min_power[j]:
-                    self.inflexible_load[j] = self.min_power[j]
+            self.inflexible_load = np.clip(self.inflexible_load,
+                                           self.min_power,
+                                           self.max_power)
 
         self.generate_inflexible_loads_forecast(env)
 
@@ -0,0 +1,196 @@
+'''
+This file contains the VectorEV2Gym class, a gymnasium vector environment that simulates
+many EV2Gym episodes in one process using batched arrays.
+'''
+
+import numpy as np
+from gymnasium.vector import VectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.array_engine import BatchedArrayEngine
+from ev2gym.rl_agent.graph_observation import GraphObservationSpace, collate_graphs
+
+
+class VectorEV2Gym(VectorEnv):
+    '''
+    In-process vector environment of EV2Gym.
+
+    Every sub-environment is an EV2Gym instance running with the array engine, and the
+    engines of all the sub-environments share one set of batched arrays (BatchedArrayEngine).
+    The EVs and chargers of all the episodes are therefore stepped with a single set of
+    array operations, while the EV arrivals, statistics, observations and rewards are
+    computed by every sub-environment as usual.
+
+    Episodes that finish are reset automatically at the next step (gymnasium NEXT_STEP autoreset mode):
+    the actions given to them are ignored and the first observation of the new episode is returned.
+
+    Graph observations (e.g. PublicPST_GNN) are returned as a single GraphObservation that batches
+    the graphs of all the sub-environments (see collate_graphs).
+
+    Attributes:
+        - num_envs: the number of sub-environments
+        - config_file: the config file of all the sub-environments
+        - seed: the seed of the first sub-environment, the i-th sub-environment uses seed + i
+
+    Status variables:
+        - envs: the list of EV2Gym sub-environments
+        - engine: the batched array engine of all sub-environments
+
+    Methods:
+        - reset: resets all sub-environments
+        - step: steps all sub-environments with an array of shape (num_envs, number_of_ports)
+    '''
+
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(self,
+                 num_envs=1,
+                 config_file=None,
+                 seed=None,
+                 **kwargs,  # extra arguments of the EV2Gym sub-environments
+                 ):
+
+        assert num_envs > 0, "Please provide a positive number of environments"
+
+        kwargs['use_array_engine'] = True
+        self.envs = [EV2Gym(config_file=config_file,
+                            seed=None if seed is None else seed + i,
+                            **kwargs)
+                     for i in range(num_envs)]
+
+        self.num_envs = num_envs
+        self.engine = BatchedArrayEngine([env.engine for env in self.envs])
+
+        self.single_action_space = self.envs[0].action_space
+        self.single_observation_space = self.envs[0].observation_space
+        assert all(env.observation_space.shape == self.single_observation_space.shape
+                   for env in self.envs), "All the sub-environments must have the same observation space"
+
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.graph_observations = isinstance(self.single_observation_space,
+                                             GraphObservationSpace)
+        if self.graph_observations:
+            assert all(env.observation_space == self.single_observation_space
+                       for env in self.envs), "All the sub-environments must have the same observation space"
+            # the collated graphs of the sub-environments belong to the space of a single graph
+            self.observation_space = self.single_observation_space
+            self._observations = [None] * num_envs
+        else:
+            self.observation_space = batch_space(self.single_observation_space,
+                                                 num_envs)
+            self._observations = np.zeros((num_envs,) + self.single_observation_space.shape,
+                                          dtype=self.single_observation_space.dtype)
+        self.render_mode = None
+
+        self._rewards = np.zeros(num_envs)
+        self._terminations = np.zeros(num_envs, dtype=bool)
+        self._truncations = np.zeros(num_envs, dtype=bool)
+        self._autoreset_envs = np.zeros(num_envs, dtype=bool)
+
+    def reset(self, seed=None, options=None):
+        '''
+        Resets all sub-environments
+        Inputs:
+            - seed: None, an integer (the i-th sub-environment uses seed + i) or a list of seeds
+        Returns:
+            - the stacked observations and the vector info dict
+        '''
+        if seed is None or isinstance(seed, (int, np.integer)):
+            seeds = [None if seed is None else seed + i
+                     for i in range(self.num_envs)]
+        else:
+            assert len(seed) == self.num_envs, \
+                f"Expected {self.num_envs} seeds, got {len(seed)}"
+            seeds = seed
+
+        infos = {}
+        for i, env in enumerate(self.envs):
+            obs, info = env.reset(seed=seeds[i], options=options)
+            self._observations[i] = obs
+            infos = self._add_info(infos, info, i)
+
+        self._terminations[:] = False
+        self._truncations[:] = False
+        self._autoreset_envs[:] = False
+
+        return self._batch_observations(), infos
+
+    def step(self, actions):
+        '''
+        Steps all sub-environments
+        Inputs:
+            - actions: an array of shape (num_envs, number_of_ports) taking values in [-1,1]
+        Returns:
+            - the stacked observations, rewards, terminations, truncations and the vector info dict
+        '''
+        actions = np.asarray(actions, dtype=float).reshape(self.num_envs, -1)
+        infos = {}
+
+        for i in np.flatnonzero(self._autoreset_envs):
+            obs, info = self.envs[i].reset()
+            self._observations[i] = obs
+            self._rewards[i] = 0
+            self._terminations[i] = False
+            self._truncations[i] = False
+            infos = self._add_info(infos, info, i)
+
+        stepped_envs = ~self._autoreset_envs
+        for i in np.flatnonzero(stepped_envs):
+            self.envs[i]._begin_step()
+
+        step_results = self.engine.step(
+            list(actions),
+            [env.charge_prices[:, env.current_step] for env in self.envs],
+            [env.discharge_prices[:, env.current_step] for env in self.envs],
+            [env.current_step for env in self.envs],
+            stepped_envs)
+
+        for i in np.flatnonzero(stepped_envs):
+            if self.envs[i].profile is not None:
+                # the batched engine step is shared by all sub-environments and is not attributed to them
+                self.envs[i].profile.start()
+
+            obs, reward, terminated, truncated, info = \
+                self.envs[i]._end_step(*step_results[i])
+
+            self._observations[i] = obs
+            self._rewards[i] = reward
+            self._terminations[i] = terminated
+            self._truncations[i] = truncated
+            infos = self._add_info(infos, info, i)
+
+        self._autoreset_envs = np.logical_or(self._terminations,
+                                             self._truncations)
+
+        return self._batch_observations(), self._rewards.copy(), \
+            self._terminations.copy(), self._truncations.copy(), infos
+
+    def _batch_observations(self):
+        '''Returns the observations of all sub-environments, stacked or collated into one graph'''
+        if self.graph_observations:
+            return collate_graphs(self._observations)
+        return self._observations.copy()
+
+    def call(self, name, *args, **kwargs):
+        '''Calls a method (or gets an attribute) of every sub-environment and returns the results as a tuple'''
+        results = []
+        for env in self.envs:
+            function = getattr(env, name)
+            results.append(function(*args, **kwargs)
+                           if callable(function) else function)
+        return tuple(results)
+
+    def get_attr(self, name):
+        '''Returns an attribute of every sub-environment as a tuple'''
+        return tuple(getattr(env, name) for env in self.envs)
+
+    def set_attr(self, name, values):
+        '''Sets an attribute of every sub-environment, values is a single value or a list with a value per sub-environment'''
+        if not isinstance(values, (list, tuple)):
+            values = [values] * self.num_envs
+        assert len(values) == self.num_envs, \
+            f"Expected {self.num_envs} values, got {len(values)}"
+
+        for env, value in zip(self.envs, values):
+            setattr(env, name, value)
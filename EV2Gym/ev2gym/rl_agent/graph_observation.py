@@ -0,0 +1,344 @@
+'''
+This file contains the GraphObservation, GraphObservationSpace and GraphObservationBuilder classes
+and the collate_graphs function, which are used to build heterogeneous graph observations
+(environment, transformer, charging station and EV nodes) for GNN agents (see PublicPST_GNN in
+ev2gym/rl_agent/state.py).
+'''
+
+import numpy as np
+from gymnasium import spaces
+
+from ev2gym.rl_agent.observation import FEATURES, PORT_FEATURES, gather_ports
+
+# Node types, nodes are numbered in this order: [env, transformers, charging stations, EVs]
+ENV_NODE, TRANSFORMER_NODE, CS_NODE, EV_NODE = 0, 1, 2, 3
+
+# Number of features of the transformer and charging station nodes
+N_TR_FEATURES = 3
+N_CS_FEATURES = 5
+
+
+class GraphObservation():
+    '''
+    Heterogeneous graph observation with CSR adjacency.
+
+    The graph is undirected: the environment node is connected to every transformer, every
+    transformer to its charging stations and every charging station to its connected EVs.
+    A batch of graphs (see collate_graphs) is a single disconnected graph.
+
+    Attributes:
+        - env_features, tr_features, cs_features, ev_features: the feature matrices of every node type
+        - env_indexes, tr_indexes, cs_indexes, ev_indexes: the node ids of every node type
+        - node_types: the type of every node
+        - indptr, indices: the CSR adjacency, the neighbours of node i are indices[indptr[i]:indptr[i+1]]
+        - action_mapper: the action (port) index of every EV node
+        - n_actions: the number of actions (ports) of the graph(s)
+        - batch: the graph of every node
+        - num_graphs: the number of graphs
+    '''
+
+    def __init__(self,
+                 env_features,
+                 tr_features,
+                 cs_features,
+                 ev_features,
+                 indptr,
+                 indices,
+                 action_mapper,
+                 n_actions,
+                 batch=None,
+                 num_graphs=1,
+                 ):
+
+        self.env_features = env_features
+        self.tr_features = tr_features
+        self.cs_features = cs_features
+        self.ev_features = ev_features
+        self.indptr = indptr
+        self.indices = indices
+        # a list, so that the EV node of an action can be found with action_mapper.index(action)
+        self.action_mapper = action_mapper
+        self.n_actions = n_actions
+        self.num_graphs = num_graphs
+
+        counts = [len(env_features), len(tr_features),
+                  len(cs_features), len(ev_features)]
+        if batch is None:
+            # single graph, the nodes of every type are contiguous
+            self.node_types = np.repeat(np.arange(4), counts)
+            self.batch = np.zeros(sum(counts), dtype=int)
+        else:
+            self.node_types, self.batch = batch
+
+        self.env_indexes = np.flatnonzero(self.node_types == ENV_NODE)
+        self.tr_indexes = np.flatnonzero(self.node_types == TRANSFORMER_NODE)
+        self.cs_indexes = np.flatnonzero(self.node_types == CS_NODE)
+        self.ev_indexes = np.flatnonzero(self.node_types == EV_NODE)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_types)
+
+    @property
+    def edge_index(self) -> np.ndarray:
+        '''The adjacency in COO format, shape (2, number of directed edges)'''
+        sources = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        return np.stack((sources, self.indices))
+
+
+class GraphObservationSpace(spaces.Space):
+    '''
+    The observation space of the GraphObservations of a GraphObservationBuilder.
+
+    The number of EV nodes changes with the occupied ports, so the space has no shape. A
+    GraphObservation belongs to the space if it has the feature widths of the builder, the nodes
+    of num_graphs graphs of the charging network and at most one EV node per port. Batches of
+    graphs (see collate_graphs) belong to the same space.
+
+    Attributes:
+        - builder: the GraphObservationBuilder of the observations
+        - n_env_features, n_ev_features: the number of features of the environment and EV nodes
+
+    Methods:
+        - sample: returns a graph with random occupied ports and random features
+        - contains: returns whether a GraphObservation belongs to the space
+    '''
+
+    def __init__(self, builder, seed=None):
+        self.builder = builder
+        self.n_env_features = len(builder.env_features)
+        self.n_ev_features = len(builder.ev_features)
+        super().__init__(shape=None, dtype=None, seed=seed)
+
+    def sample(self, mask=None, probability=None) -> GraphObservation:
+        assert mask is None and probability is None, \
+            'Masked sampling is not supported by GraphObservationSpace'
+        builder = self.builder
+        ev_ports, indptr, indices = builder.topology(
+            self.np_random.random(builder.n_ports) < 0.5)
+        return GraphObservation(env_features=self.np_random.normal(size=(1, self.n_env_features)),
+                                tr_features=self.np_random.normal(size=(builder.n_tr, N_TR_FEATURES)),
+                                cs_features=self.np_random.normal(size=(builder.n_cs, N_CS_FEATURES)),
+                                ev_features=self.np_random.normal(size=(len(ev_ports), self.n_ev_features)),
+                                indptr=indptr,
+                                indices=indices,
+                                action_mapper=ev_ports.tolist(),
+                                n_actions=builder.n_ports,
+                                )
+
+    def contains(self, x) -> bool:
+        if not isinstance(x, GraphObservation):
+            return False
+        builder = self.builder
+        n = x.num_graphs
+        return x.env_features.shape == (n, self.n_env_features) and \
+            x.tr_features.shape == (n * builder.n_tr, N_TR_FEATURES) and \
+            x.cs_features.shape == (n * builder.n_cs, N_CS_FEATURES) and \
+            x.ev_features.ndim == 2 and x.ev_features.shape[1] == self.n_ev_features and \
+            x.n_actions == n * builder.n_ports and \
+            len(x.action_mapper) == len(x.ev_features) <= x.n_actions and \
+            len(x.indptr) == x.num_nodes + 1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GraphObservationSpace) and \
+            self.n_env_features == other.n_env_features and \
+            self.n_ev_features == other.n_ev_features and \
+            self.builder.n_tr == other.builder.n_tr and \
+            self.builder.n_cs == other.builder.n_cs and \
+            self.builder.n_ports == other.builder.n_ports
+
+    def __repr__(self) -> str:
+        return f'GraphObservationSpace(transformers={self.builder.n_tr}, ' + \
+            f'charging_stations={self.builder.n_cs}, ports={self.builder.n_ports})'
+
+
+class GraphObservationBuilder():
+    '''
+    Builds GraphObservations of an environment.
+
+    The environment, transformer and charging station nodes and the edges between them are
+    compiled once. The EV nodes and the charging station-EV edges are only recomputed when the
+    occupied ports change (arrivals and departures), every other step only the feature
+    matrices are refreshed with vectorized gathers.
+
+    Attributes:
+        - env_features: the names of the features of the environment node (see FEATURES in observation.py)
+        - ev_features: the names of the features of the EV nodes (see PORT_FEATURES in observation.py)
+        - observation_space: the GraphObservationSpace of the observations
+
+    Methods:
+        - topology: returns the EV ports and the CSR adjacency of a set of occupied ports
+        - build: returns the GraphObservation of the current step
+    '''
+
+    def __init__(self,
+                 env,
+                 env_features=('step',
+                               'normalized_step',
+                               'setpoint',
+                               'last_charge_power_potential',
+                               'power_usage'),
+                 ev_features=('full',
+                              'total_energy_exchanged',
+                              'time_since_arrival',
+                              'soc',
+                              'time_to_departure'),
+                 ):
+
+        for feature in env_features:
+            assert FEATURES[feature][0](env) == 1, \
+                f'Feature {feature} is not a scalar'
+
+        self.env_features = tuple(env_features)
+        self.ev_features = tuple(ev_features)
+
+        self.n_tr = len(env.transformers)
+        self.n_cs = len(env.charging_stations)
+        n_ports = np.array([cs.n_ports for cs in env.charging_stations])
+        self.n_ports = int(n_ports.sum())
+
+        cs_port_offset = np.concatenate(([0], np.cumsum(n_ports)))
+        self.port_cs = np.repeat(np.arange(self.n_cs), n_ports)
+        self.port_number = np.arange(self.n_ports) - \
+            cs_port_offset[self.port_cs]
+        self.all_ports = np.arange(self.n_ports)
+
+        tr_ids = [tr.id for tr in env.transformers]
+        cs_transformer = np.array([tr_ids.index(cs.connected_transformer)
+                                   for cs in env.charging_stations], dtype=int)
+        self.cs_node = 1 + self.n_tr + np.arange(self.n_cs)
+        self.first_ev_node = 1 + self.n_tr + self.n_cs
+
+        # static edges: env - transformers and transformers - charging stations
+        tr_node = 1 + np.arange(self.n_tr)
+        sources = np.concatenate((np.zeros(self.n_tr, dtype=int), tr_node,
+                                  1 + cs_transformer, self.cs_node))
+        targets = np.concatenate((tr_node, np.zeros(self.n_tr, dtype=int),
+                                  self.cs_node, 1 + cs_transformer))
+        self.static_sources = sources
+        self.static_targets = targets
+
+        self.cs_static_features = np.array([[cs.get_max_power(),
+                                             cs.get_min_power(),
+                                             cs.n_ports]
+                                            for cs in env.charging_stations], dtype=float)
+
+        self.ev_variables = []
+        for feature in self.ev_features:
+            for name in PORT_FEATURES[feature][0]:
+                if name not in self.ev_variables:
+                    self.ev_variables.append(name)
+
+        self.occupied = None
+
+        self.observation_space = GraphObservationSpace(self)
+
+    def topology(self, occupied) -> tuple:
+        '''
+        Returns the EV ports and the CSR adjacency (indptr, indices) of the graph with EVs at the occupied ports
+        '''
+        ev_ports = np.flatnonzero(occupied)
+        ev_node = self.first_ev_node + np.arange(len(ev_ports))
+        ev_cs_node = self.cs_node[self.port_cs[ev_ports]]
+
+        sources = np.concatenate((self.static_sources, ev_cs_node, ev_node))
+        targets = np.concatenate((self.static_targets, ev_node, ev_cs_node))
+
+        order = np.argsort(sources, kind='stable')
+        indptr = np.concatenate(([0], np.cumsum(
+            np.bincount(sources, minlength=self.first_ev_node + len(ev_node)))))
+        return ev_ports, indptr, targets[order]
+
+    def _update_topology(self, occupied) -> None:
+        '''Recomputes the EV nodes and the CSR adjacency after arrivals and departures'''
+
+        self.occupied = occupied
+        self.ev_ports, self.indptr, self.indices = self.topology(occupied)
+        self.n_evs_connected = np.bincount(self.port_cs[self.ev_ports],
+                                           minlength=self.n_cs)
+        self.action_mapper = self.ev_ports.tolist()
+
+    def build(self, env) -> GraphObservation:
+        '''Returns the GraphObservation of the current step of env'''
+
+        occupied, ports = gather_ports(env, self.all_ports, self.port_cs,
+                                       self.port_number, self.ev_variables)
+
+        if self.occupied is None or not np.array_equal(occupied, self.occupied):
+            self._update_topology(occupied)
+
+        env_features = np.zeros((1, len(self.env_features)))
+        for k, feature in enumerate(self.env_features):
+            FEATURES[feature][1](env, env_features[0, k:k+1])
+
+        step = min(env.current_step, env.simulation_length - 1)
+        tr_features = np.array([[tr.max_power[step],
+                                 tr.current_power,
+                                 tr.inflexible_load[step] + tr.solar_power[step]]
+                                for tr in env.transformers],
+                               dtype=float).reshape(self.n_tr, N_TR_FEATURES)
+
+        engine = getattr(env, 'engine', None)
+        if engine is not None:
+            cs_power = engine.cs_power
+        else:
+            cs_power = [cs.current_power_output for cs in env.charging_stations]
+        cs_features = np.column_stack((self.cs_static_features,
+                                       self.n_evs_connected,
+                                       cs_power))
+
+        ports = {name: values[self.ev_ports] for name, values in ports.items()}
+        ev_features = np.zeros((len(self.ev_ports), len(self.ev_features)))
+        for k, feature in enumerate(self.ev_features):
+            ev_features[:, k] = PORT_FEATURES[feature][1](env, ports)
+
+        return GraphObservation(env_features=env_features,
+                                tr_features=tr_features,
+                                cs_features=cs_features,
+                                ev_features=ev_features,
+                                indptr=self.indptr,
+                                indices=self.indices,
+                                action_mapper=list(self.action_mapper),
+                                n_actions=self.n_ports,
+                                )
+
+
+def collate_graphs(observations) -> GraphObservation:
+    '''
+    Batches the GraphObservations of many environments into a single disconnected graph.
+    The node ids, the CSR adjacency and the action indexes of every graph are shifted by the
+    number of nodes and actions of the previous graphs, and batch holds the graph of every node.
+    '''
+
+    node_offsets = np.cumsum([0] + [obs.num_nodes for obs in observations])
+    edge_offsets = np.cumsum([0] + [len(obs.indices) for obs in observations])
+    action_offsets = np.cumsum([0] + [obs.n_actions for obs in observations])
+    graph_offsets = np.cumsum([0] + [obs.num_graphs for obs in observations])
+
+    indptr = np.concatenate([[0]] + [obs.indptr[1:] + edge_offsets[i]
+                                     for i, obs in enumerate(observations)])
+    indices = np.concatenate([obs.indices + node_offsets[i]
+                              for i, obs in enumerate(observations)])
+    node_types = np.concatenate([obs.node_types for obs in observations])
+    batch = np.concatenate([obs.batch + graph_offsets[i]
+                            for i, obs in enumerate(observations)])
+
+    # the features of every node type are stacked in node order
+    def stack(name):
+        return np.concatenate([getattr(obs, name) for obs in observations])
+
+    action_mapper = [action + action_offsets[i]
+                     for i, obs in enumerate(observations)
+                     for action in obs.action_mapper]
+
+    return GraphObservation(env_features=stack('env_features'),
+                            tr_features=stack('tr_features'),
+                            cs_features=stack('cs_features'),
+                            ev_features=stack('ev_features'),
+                            indptr=indptr,
+                            indices=indices,
+                            action_mapper=action_mapper,
+                            n_actions=int(action_offsets[-1]),
+                            batch=(node_types, batch),
+                            num_graphs=int(graph_offsets[-1]),
+                            )
@@ -0,0 +1,288 @@
+'''
+This file contains the ObservationSpec and ObservationBuilder classes, which are used to
+describe observations as a list of named feature blocks and to build them with vectorized
+gathers into a preallocated buffer (see the state functions in ev2gym/rl_agent/state.py).
+'''
+
+import numpy as np
+
+# Number of steps of the forecast windows (prices, loads and power limits)
+HORIZON = 20
+
+
+def _window(values, step, horizon, out) -> None:
+    '''Writes values[step:step+horizon] to out, padded with zeros after the end of values'''
+    window = values[step:step+horizon]
+    out[:len(window)] = window
+    out[len(window):] = 0
+
+
+def _last(values, env) -> float:
+    '''Returns the value of the current step, or of the last step at the end of the simulation'''
+    return values[min(env.current_step, env.simulation_length - 1)]
+
+
+def _time_of_day(env, out) -> None:
+    '''Writes the sine and cosine of the time of day of the current step to out'''
+    timeline = env.timeline
+    step = env.current_step
+    angle = 2*np.pi * (timeline.hour[step]*60 + timeline.minute[step]) / (24*60)
+    out[0] = np.sin(angle)
+    out[1] = np.cos(angle)
+
+
+# Global features: name -> (size(env), write(env, out))
+FEATURES = {
+    'step': (lambda env: 1,
+             lambda env, out: out.fill(env.current_step)),
+    'normalized_step': (lambda env: 1,
+                        lambda env, out: out.fill(env.current_step/env.simulation_length)),
+    # the power setpoint of the current step, zero at the end of the simulation
+    'setpoint': (lambda env: 1,
+                 lambda env, out: out.fill(env.power_setpoints[env.current_step]
+                                           if env.current_step < env.simulation_length else 0)),
+    # the power setpoint of the current step, the last one at the end of the simulation
+    'last_setpoint': (lambda env: 1,
+                      lambda env, out: out.fill(_last(env.power_setpoints, env))),
+    'last_charge_power_potential': (lambda env: 1,
+                                    lambda env, out: out.fill(_last(env.charge_power_potential, env))),
+    # the total power of the charging stations in the previous step
+    'power_usage': (lambda env: 1,
+                    lambda env, out: out.fill(env.current_power_usage[env.current_step-1])),
+    'charge_price_window': (lambda env: HORIZON,
+                            lambda env, out: _window(abs(env.charge_prices[0]), env.current_step,
+                                                     HORIZON, out)),
+    # the calendar of the current step, read from the timeline of the episode
+    'hour': (lambda env: 1,
+             lambda env, out: out.fill(env.timeline.hour[env.current_step])),
+    'weekday': (lambda env: 1,
+                lambda env, out: out.fill(env.timeline.weekday[env.current_step])),
+    'time_of_day': (lambda env: 2, _time_of_day),
+}
+
+
+def _net_load_forecast(env, tr, out) -> None:
+    loads, pv = env.transformer_forecasts.get_load_pv_forecast(step=env.current_step,
+                                                               horizon=HORIZON,
+                                                               tr_index=tr.id)
+    np.subtract(loads, pv, out=out)
+
+
+def _power_limit_forecast(env, tr, out) -> None:
+    out[:] = env.transformer_forecasts.get_power_limits(step=env.current_step,
+                                                        horizon=HORIZON,
+                                                        tr_index=tr.id)
+
+
+# Transformer features: name -> (size(env, tr), write(env, tr, out))
+TRANSFORMER_FEATURES = {
+    'net_load_forecast': (lambda env, tr: HORIZON,
+                          _net_load_forecast),
+    'power_limit_forecast': (lambda env, tr: HORIZON,
+                             _power_limit_forecast),
+    'max_current': (lambda env, tr: len(tr.max_current),
+                    lambda env, tr, out: np.divide(tr.max_current, 100, out=out)),
+}
+
+# Port features: name -> (EV variables, value(env, ports)), the values of empty ports are set to zero
+PORT_FEATURES = {
+    # 1 if the EV is full, 0.5 otherwise
+    'full': (('current_capacity', 'battery_capacity'),
+             lambda env, ports: np.where(ports['current_capacity'] /
+                                         ports['battery_capacity'] == 1, 1, 0.5)),
+    'soc': (('current_capacity', 'battery_capacity'),
+            lambda env, ports: ports['current_capacity'] / ports['battery_capacity']),
+    'total_energy_exchanged': (('total_energy_exchanged',),
+                               lambda env, ports: ports['total_energy_exchanged']),
+    'time_since_arrival': (('time_of_arrival',),
+                           lambda env, ports: env.current_step - ports['time_of_arrival']),
+    'time_to_departure': (('time_of_departure',),
+                          lambda env, ports: ports['time_of_departure'] - env.current_step),
+    'normalized_arrival': (('time_of_arrival',),
+                           lambda env, ports: ports['time_of_arrival'] / env.simulation_length),
+    'normalized_departure': (('time_of_departure',),
+                             lambda env, ports: ports['time_of_departure'] / env.simulation_length),
+}
+
+
+def gather_ports(env, ports, cs_of_port, port_number, variables):
+    '''
+    Returns whether the given ports are occupied and a dict with the EV variables of their EVs
+    (zero in empty ports), read from the ArrayEngine arrays if it is enabled
+    Inputs:
+        - ports: global port offsets (charging stations in list order)
+        - cs_of_port, port_number: the charging station and the port number of every global port
+        - variables: the names of the EV variables
+    '''
+    engine = getattr(env, 'engine', None)
+    if engine is not None:
+        return engine.occupied[ports], {name: getattr(engine, name)[ports]
+                                        for name in variables}
+
+    evs = [env.charging_stations[cs].evs_connected[port]
+           for cs, port in zip(cs_of_port[ports].tolist(),
+                               port_number[ports].tolist())]
+    occupied = np.array([ev is not None for ev in evs], dtype=bool)
+    connected = [ev for ev in evs if ev is not None]
+
+    values = {}
+    for name in variables:
+        # battery_capacity is used as a divisor, keep it non-zero in empty ports
+        values[name] = np.ones(len(evs)) if name == 'battery_capacity' \
+            else np.zeros(len(evs))
+        values[name][occupied] = [getattr(ev, name) for ev in connected]
+    return occupied, values
+
+
+class ObservationSpec():
+    '''
+    Declarative description of an observation, the observation vector is laid out as:
+        [features, for every transformer: [transformer_features, for every port of the transformer: port_features]]
+    The ports of a transformer are the ports of its charging stations, in charging station order.
+
+    Attributes:
+        - name: the name of the observation (the key of the compiled builder in env.observation_builders)
+        - features: the names of the global features (see FEATURES)
+        - transformer_features: the names of the per-transformer features (see TRANSFORMER_FEATURES)
+        - port_features: the names of the per-port features (see PORT_FEATURES)
+        - dtype: the dtype of the observation
+    '''
+
+    def __init__(self,
+                 name,
+                 features=(),
+                 transformer_features=(),
+                 port_features=(),
+                 dtype=np.float64,
+                 ):
+
+        for feature in features:
+            assert feature in FEATURES, f'Unknown feature {feature}'
+        for feature in transformer_features:
+            assert feature in TRANSFORMER_FEATURES, f'Unknown transformer feature {feature}'
+        for feature in port_features:
+            assert feature in PORT_FEATURES, f'Unknown port feature {feature}'
+
+        self.name = name
+        self.features = tuple(features)
+        self.transformer_features = tuple(transformer_features)
+        self.port_features = tuple(port_features)
+        self.dtype = dtype
+
+
+class ObservationBuilder():
+    '''
+    An ObservationSpec compiled for the topology of an environment.
+
+    The position of every feature block in the observation vector is computed once, the
+    per-port features are then computed for all ports at once and scattered into the
+    preallocated buffer with a single index map.
+
+    Attributes:
+        - spec: the ObservationSpec
+        - size: the size of the observation vector
+        - buffer: the preallocated observation vector
+
+    Methods:
+        - build: writes the observation of the current step to the buffer
+    '''
+
+    def __init__(self, env, spec):
+
+        self.spec = spec
+
+        position = 0
+        self.feature_slices = []
+        for feature in spec.features:
+            size = FEATURES[feature][0](env)
+            self.feature_slices.append((FEATURES[feature][1],
+                                        slice(position, position + size)))
+            position += size
+
+        # the ports in observation order, as global port offsets (charging stations in list order)
+        cs_port_offset = np.cumsum([0] + [cs.n_ports
+                                          for cs in env.charging_stations])
+        n_port_features = len(spec.port_features)
+
+        self.transformer_slices = []
+        port_order = []
+        port_positions = []
+        for tr_index, tr in enumerate(env.transformers):
+            for feature in spec.transformer_features:
+                size = TRANSFORMER_FEATURES[feature][0](env, tr)
+                self.transformer_slices.append((TRANSFORMER_FEATURES[feature][1], tr_index,
+                                                slice(position, position + size)))
+                position += size
+
+            for cs_index, cs in enumerate(env.charging_stations):
+                if cs.connected_transformer == tr.id:
+                    ports = np.arange(cs_port_offset[cs_index],
+                                      cs_port_offset[cs_index + 1])
+                    port_order.append(ports)
+                    port_positions.append(position + n_port_features *
+                                          np.arange(len(ports)))
+                    position += n_port_features * len(ports)
+
+        self.port_order = np.concatenate(port_order) if port_order \
+            else np.zeros(0, dtype=int)
+        # position of every (port, port feature) pair in the observation vector
+        port_positions = np.concatenate(port_positions) if port_positions \
+            else np.zeros(0, dtype=int)
+        self.port_positions = port_positions[:, None] + \
+            np.arange(n_port_features)[None, :]
+
+        self.port_variables = []
+        for feature in spec.port_features:
+            for name in PORT_FEATURES[feature][0]:
+                if name not in self.port_variables:
+                    self.port_variables.append(name)
+
+        self.cs_of_port = np.repeat(np.arange(len(env.charging_stations)),
+                                    np.diff(cs_port_offset))
+        self.port_number = np.arange(cs_port_offset[-1]) - \
+            cs_port_offset[self.cs_of_port]
+
+        self.size = position
+        self.buffer = np.zeros(self.size, dtype=spec.dtype)
+        self._port_values = np.zeros((len(self.port_order), n_port_features))
+
+    def _gather_ports(self, env):
+        '''Returns whether every port (in observation order) is occupied and the EV variables of its EV'''
+        return gather_ports(env, self.port_order, self.cs_of_port, self.port_number,
+                            self.port_variables)
+
+    def build(self, env, copy=True) -> np.ndarray:
+        '''
+        Writes the observation of the current step of env to the buffer
+        Inputs:
+            - env: the environment the builder was compiled for
+            - copy: whether to return a copy of the buffer (the buffer is overwritten in the next call)
+        '''
+        buffer = self.buffer
+
+        for write, index in self.feature_slices:
+            write(env, buffer[index])
+
+        for write, tr_index, index in self.transformer_slices:
+            write(env, env.transformers[tr_index], buffer[index])
+
+        if self.spec.port_features and len(self.port_order) > 0:
+            occupied, ports = self._gather_ports(env)
+            for k, feature in enumerate(self.spec.port_features):
+                self._port_values[:, k] = PORT_FEATURES[feature][1](env, ports)
+            self._port_values[~occupied] = 0
+            buffer[self.port_positions] = self._port_values
+
+        return buffer.copy() if copy else buffer
+
+
+def build_observation(env, spec, copy=True) -> np.ndarray:
+    '''
+    Builds the observation described by spec, compiling the spec for env on the first call
+    '''
+    builder = env.observation_builders.get(spec.name)
+    if builder is None or builder.spec is not spec:
+        builder = ObservationBuilder(env, spec)
+        env.observation_builders[spec.name] = builder
+
+    return builder.build(env, copy=copy)
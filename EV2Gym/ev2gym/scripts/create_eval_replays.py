@@ -25,7 +25,7 @@ def evalreplay(config_file,
                                eval_mode="unstirred",
                                save_replay=True)
 
-    new_replay_path = f"replay/replay_{env.sim_name}.pkl"
+    new_replay_path = f"replay/replay_{env.sim_name}.npz"
     # new_replay_path = replay_path
 
     _ = env.reset()
@@ -70,6 +70,7 @@ setup(
             "ev2gym-demo=ev2gym.tools.demo:main",
             "ev2gym-cli=ev2gym.tools.cli:main",
             "ev2gym-web=ev2gym.tools.web_app:main",
+            "ev2gym-bundle=ev2gym.utilities.dataset_bundle:main",
         ],
     },
     include_package_data=True,
@@ -12,7 +12,6 @@ Usage:
 
 import os
 import sys
-import pickle
 import argparse
 import numpy as np
 import pandas as pd
@@ -27,7 +26,7 @@ warnings.filterwarnings('ignore')
 sys.path.append(str(Path(__file__).parent.parent))
 
 from tools.demo import run_simulation
-from ev2gym.models.replay import EvCityReplay
+from ev2gym.models.replay import EvCityReplay, load_replay
 
 
 class EV2GymAnalyzer:
@@ -40,8 +39,7 @@ class EV2GymAnalyzer:
     def load_replay(self, replay_path: str) -> Optional[EvCityReplay]:
         """Charge un fichier replay de simulation"""
         try:
-            with open(replay_path, 'rb') as f:
-                replay = pickle.load(f)
+            replay = load_replay(replay_path)
             print(f"✅ Replay chargé: {replay_path}")
             return replay
         except FileNotFoundError:
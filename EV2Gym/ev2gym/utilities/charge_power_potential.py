@@ -0,0 +1,181 @@
+'''
+This file contains the ChargePowerPotential class, which keeps the total charge power potential
+of the parked EVs up to date incrementally (see calculate_charge_power_potential in utils.py).
+'''
+
+import math
+import numpy as np
+
+
+class ChargePowerPotential():
+    '''
+    Incremental version of calculate_charge_power_potential.
+
+    The charge power of a port only depends on its EV and charging station, and it only counts
+    while the EV is connected, not full and not in its departure step. The per-port powers and
+    the clamped per-charging station potentials are therefore only updated on arrivals,
+    departures, EVs becoming full (or not full again after discharging) and departure steps,
+    and the total potential is kept as a running sum of the charging station potentials.
+
+    Attributes:
+        - n_ports: the number of ports of every charging station
+        - max_cs_power, min_cs_power: the power limits of every charging station in kW
+
+    Status variables:
+        - evs: the EV connected to every port (global port offset, charging stations in list order)
+        - port_active: whether the EV of every port counts for the charge power potential
+        - port_power: the charge power potential of every port in kW
+        - cs_potential: the clamped charge power potential of every charging station in kW
+        - total: the total charge power potential in kW
+
+    Methods:
+        - connect/disconnect: register arrivals and departures
+        - update_full: updates the ports whose EV became full or not full
+        - get: returns the total charge power potential of a step
+        - get_state/set_state: copy the status variables (see EV2Gym.snapshot)
+    '''
+
+    def __init__(self, charging_stations):
+
+        self.charging_stations = charging_stations
+        self.n_ports = [cs.n_ports for cs in charging_stations]
+        self.cs_port_offset = np.concatenate(([0], np.cumsum(self.n_ports))).tolist()
+        self.port_cs = np.repeat(np.arange(len(charging_stations)),
+                                 self.n_ports).tolist()
+
+        self.max_cs_power = [math.sqrt(cs.phases) * cs.voltage * cs.max_charge_current / 1000
+                             for cs in charging_stations]
+        self.min_cs_power = [math.sqrt(cs.phases) * cs.voltage * cs.min_charge_current / 1000
+                             for cs in charging_stations]
+
+        self.reset()
+
+    def reset(self) -> None:
+        '''Disconnects all EVs'''
+        n_ports = self.cs_port_offset[-1]
+
+        self.evs = [None] * n_ports
+        self.connected = {}
+        self.port_full = np.zeros(n_ports, dtype=bool)
+        self.port_expired = [False] * n_ports
+        self.port_active = [False] * n_ports
+        self.port_power = [0.0] * n_ports
+        self.cs_potential = [0.0] * len(self.charging_stations)
+        # the ports whose EV stops counting at every step (departure steps)
+        self.expiry = {}
+        self.dirty_cs = set()
+        self.n_active = 0
+        self.total = 0
+
+    def connect(self, cs_id, index, ev) -> None:
+        '''Registers the EV that arrived at port index of charging station cs_id'''
+        port = self.cs_port_offset[cs_id] + index
+
+        self.evs[port] = ev
+        self.connected[port] = ev
+        self.port_full[port] = not ev.get_soc() < 1
+        self.port_expired[port] = False
+        self.expiry.setdefault(ev.time_of_departure, []).append((port, ev))
+        self._update_port(port)
+
+    def disconnect(self, cs_id, index) -> None:
+        '''Registers the departure of the EV at port index of charging station cs_id'''
+        port = self.cs_port_offset[cs_id] + index
+
+        self.evs[port] = None
+        self.connected.pop(port, None)
+        self._update_port(port)
+
+    def update_full(self, ports=None, full=None) -> None:
+        '''
+        Updates the ports whose EV became full or not full
+        Inputs:
+            - ports, full: the connected ports and whether their EV is full (e.g. from the ArrayEngine arrays),
+              if None the SoC of every connected EV is checked
+        '''
+        if ports is None:
+            ports = list(self.connected)
+            full = [not ev.get_soc() < 1 for ev in self.connected.values()]
+        else:
+            ports = np.asarray(ports)
+            full = np.asarray(full)
+            changed = full != self.port_full[ports]
+            ports = ports[changed].tolist()
+            full = full[changed].tolist()
+
+        for port, is_full in zip(ports, full):
+            if is_full != self.port_full[port]:
+                self.port_full[port] = is_full
+                self._update_port(port)
+
+    def get(self, step) -> float:
+        '''Returns the total charge power potential at step'''
+
+        for port, ev in self.expiry.pop(step, []):
+            if self.evs[port] is ev:
+                self.port_expired[port] = True
+                self._update_port(port)
+
+        for cs_id in self.dirty_cs:
+            start = self.cs_port_offset[cs_id]
+            cs_power_potential = 0
+            for port in range(start, start + self.n_ports[cs_id]):
+                cs_power_potential += self.port_power[port]
+
+            if cs_power_potential > self.max_cs_power[cs_id]:
+                potential = self.max_cs_power[cs_id]
+            elif cs_power_potential < self.min_cs_power[cs_id]:
+                potential = 0
+            else:
+                potential = cs_power_potential
+
+            self.total += potential - self.cs_potential[cs_id]
+            self.cs_potential[cs_id] = potential
+        self.dirty_cs.clear()
+
+        if self.n_active == 0:
+            # avoid the rounding residue of the running sum when no EV can charge
+            self.total = 0
+
+        return self.total
+
+    def get_state(self) -> tuple:
+        '''Returns a copy of the status variables'''
+        return (list(self.evs), dict(self.connected), self.port_full.copy(),
+                list(self.port_expired), list(self.port_active), list(self.port_power),
+                list(self.cs_potential), {step: list(ports) for step, ports in self.expiry.items()},
+                set(self.dirty_cs), self.n_active, self.total)
+
+    def set_state(self, state) -> None:
+        '''Restores the status variables of get_state'''
+        evs, connected, port_full, port_expired, port_active, port_power, \
+            cs_potential, expiry, dirty_cs, self.n_active, self.total = state
+        self.evs = list(evs)
+        self.connected = dict(connected)
+        self.port_full = port_full.copy()
+        self.port_expired = list(port_expired)
+        self.port_active = list(port_active)
+        self.port_power = list(port_power)
+        self.cs_potential = list(cs_potential)
+        self.expiry = {step: list(ports) for step, ports in expiry.items()}
+        self.dirty_cs = set(dirty_cs)
+
+    def _update_port(self, port) -> None:
+        '''Recomputes the charge power potential of a port'''
+        ev = self.evs[port]
+        active = ev is not None and not self.port_full[port] and \
+            not self.port_expired[port]
+        self.n_active += int(active) - int(self.port_active[port])
+        self.port_active[port] = active
+
+        power = 0.0
+        if active:
+            cs = self.charging_stations[self.port_cs[port]]
+            phases = min(cs.phases, ev.ev_phases)
+            ev_current = ev.max_ac_charge_power * \
+                1000/(math.sqrt(phases)*cs.voltage)
+            current = min(cs.max_charge_current, ev_current)
+            power = math.sqrt(phases) * cs.voltage*current/1000
+
+        self.port_power[port] = power
+        self.dirty_cs.add(self.port_cs[port])
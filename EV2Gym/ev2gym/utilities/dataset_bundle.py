@@ -0,0 +1,250 @@
+'''
+This file contains the precompiled binary dataset bundle of EV2Gym.
+
+The bundle is a directory with one .npy file per array and a manifest.json file.
+It holds the datasets of ev2gym/data already parsed and resampled for the supported
+timescales, and the arrays are opened with np.memmap, so building an environment only
+reads the rows of the simulated episode. The manifest stores the version of the bundle
+and the checksum of every source file, so that a stale bundle is detected and ignored.
+
+Build the bundle with:
+    ev2gym-bundle [--path PATH]
+or
+    python -m ev2gym.utilities.dataset_bundle [--path PATH]
+
+The bundle is read from the directory in the EV2GYM_BUNDLE_PATH environment variable, or from
+ev2gym/data/bundle if it is not set. Set EV2GYM_BUNDLE_PATH when the package directory is
+read-only (e.g. in site-packages), both to build the bundle and to use it.
+'''
+
+import os
+import json
+import hashlib
+import argparse
+import datetime
+import pkg_resources
+import numpy as np
+
+BUNDLE_VERSION = 1
+# Timescales (in minutes) for which the time series are precompiled
+SUPPORTED_TIMESCALES = (5, 15, 60)
+
+# Source files of the bundle, relative to the ev2gym package
+BUNDLE_SOURCES = ('data/residential_loads.csv',
+                  'data/pv_netherlands.csv',
+                  'data/Netherlands_day-ahead-2015-2024.csv',
+                  'data/distribution-of-arrival.csv',
+                  'data/distribution-of-arrival-weekend.csv',
+                  'data/distribution-of-connection-time.csv',
+                  'data/distribution-of-energy-demand.csv',
+                  'data/mean-demand-per-arrival.csv',
+                  'data/mean-session-length-per.csv',
+                  'data/time_of_connection_vs_hour.npy',
+                  )
+
+MANIFEST_FILE = 'manifest.json'
+# Environment variable with the directory of the bundle
+BUNDLE_PATH_VARIABLE = 'EV2GYM_BUNDLE_PATH'
+
+
+class DatasetBundle():
+    '''
+    A precompiled dataset bundle opened with memory-mapped arrays.
+
+    Attributes:
+        - path: the directory of the bundle
+        - manifest: the content of the manifest file
+
+    Methods:
+        - get_array: returns a memory-mapped array of the bundle, or None if it is not part of it
+        - get_table: returns the columns of a table of the bundle, or None if it is not part of it
+    '''
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self._arrays = {}
+
+    def __contains__(self, name) -> bool:
+        return name in self.manifest['arrays']
+
+    def get_array(self, name):
+        '''Returns the memory-mapped array name of the bundle, or None if it is not part of the bundle'''
+        if name not in self:
+            return None
+
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, self.manifest['arrays'][name]),
+                                         mmap_mode='r')
+        return self._arrays[name]
+
+    def get_table(self, name):
+        '''Returns a dict with the (memory-mapped) columns of the table name, or None if it is not part of the bundle'''
+        if name not in self.manifest['tables']:
+            return None
+
+        return {column: self.get_array(array_name)
+                for column, array_name in self.manifest['tables'][name]}
+
+
+def default_bundle_path() -> str:
+    '''Returns the directory of the dataset bundle: EV2GYM_BUNDLE_PATH if it is set, else ev2gym/data/bundle'''
+    path = os.environ.get(BUNDLE_PATH_VARIABLE)
+    if path:
+        return os.path.expanduser(path)
+    return pkg_resources.resource_filename('ev2gym', 'data/bundle')
+
+
+def source_checksums() -> dict:
+    '''Returns the sha256 checksum of every existing source file of the bundle'''
+    checksums = {}
+    for source in BUNDLE_SOURCES:
+        file_path = pkg_resources.resource_filename('ev2gym', source)
+        if not os.path.exists(file_path):
+            continue
+
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+        checksums[source] = sha256.hexdigest()
+
+    return checksums
+
+
+def open_dataset_bundle(path=None, verbose=False):
+    '''
+    Opens the dataset bundle at path (default: default_bundle_path())
+    Returns:
+        - a DatasetBundle, or None if there is no bundle, it has another version or any source file changed after it was built
+    '''
+    path = default_bundle_path() if path is None else path
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != BUNDLE_VERSION:
+        print(f'Warning: the dataset bundle at {path} has version {manifest.get("version")}' +
+              f' instead of {BUNDLE_VERSION}, rebuild it with ev2gym-bundle')
+        return None
+
+    # source files that are not available are read from the bundle
+    recorded = manifest['sources']
+    stale = [source for source, checksum in source_checksums().items()
+             if recorded.get(source) != checksum]
+    if stale:
+        print(f'Warning: the dataset bundle at {path} is stale ({", ".join(stale)} changed),' +
+              ' rebuild it with ev2gym-bundle')
+        return None
+
+    if verbose:
+        print(f'Loaded dataset bundle {path} built at {manifest["created"]}')
+
+    return DatasetBundle(path, manifest)
+
+
+def build_dataset_bundle(path=None, timescales=SUPPORTED_TIMESCALES, verbose=True) -> str:
+    '''
+    Compiles the datasets of ev2gym/data into a binary bundle
+    Inputs:
+        - path: the directory of the bundle (default: default_bundle_path())
+        - timescales: the timescales (in minutes) of the precompiled time series
+    Returns:
+        - the directory of the bundle
+    '''
+    # the parsers of the loaders are the reference implementation of the bundle contents
+    from ev2gym.utilities import loaders
+
+    path = default_bundle_path() if path is None else path
+    os.makedirs(path, exist_ok=True)
+
+    arrays = {}
+    tables = {}
+
+    def add_array(name, array):
+        file_name = f'{name}.npy'
+        np.save(os.path.join(path, file_name), np.ascontiguousarray(array))
+        arrays[name] = file_name
+        if verbose:
+            print(f'  {name}: {array.shape} {array.dtype}')
+
+    def add_table(name, columns):
+        tables[name] = []
+        for i, (column, values) in enumerate(columns.items()):
+            add_array(f'{name}_{i}', values)
+            tables[name].append((column, f'{name}_{i}'))
+
+    if verbose:
+        print(f'Building dataset bundle at {path}')
+
+    for timescale in timescales:
+        add_array(f'residential_loads_{timescale}',
+                  loaders._parse_residential_loads(timescale, use_bundle=False))
+        add_array(f'pv_generation_{timescale}',
+                  loaders._parse_pv_generation(timescale, use_bundle=False))
+
+    prices = loaders._parse_electricity_prices(use_bundle=False)
+    add_array('hourly_prices', prices['hourly_prices'])
+
+    (df_arrival_week,
+     df_arrival_weekend,
+     df_connection_time,
+     df_energy_demand,
+     time_of_connection_vs_hour,
+     df_req_energy,
+     df_time_of_stay_vs_arrival) = loaders._parse_ev_spawn_scenarios(use_bundle=False)
+
+    add_table('arrival_week', df_arrival_week)
+    add_table('arrival_weekend', df_arrival_weekend)
+    add_table('connection_time', df_connection_time)
+    add_table('energy_demand', df_energy_demand)
+    add_table('req_energy', df_req_energy)
+    add_table('time_of_stay_vs_arrival', df_time_of_stay_vs_arrival)
+    add_array('time_of_connection_vs_hour', time_of_connection_vs_hour)
+
+    manifest = {'version': BUNDLE_VERSION,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'timescales': list(timescales),
+                'price_epoch': str(prices['epoch']),
+                'sources': source_checksums(),
+                'arrays': arrays,
+                'tables': tables,
+                }
+
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    if verbose:
+        print(f'Dataset bundle written at {path}')
+        if os.path.abspath(path) != os.path.abspath(default_bundle_path()):
+            print(f'Set {BUNDLE_PATH_VARIABLE}={path} to use it')
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the precompiled binary dataset bundle of EV2Gym')
+    parser.add_argument('--path', type=str, default=None,
+                        help=f'directory of the bundle (default: ${BUNDLE_PATH_VARIABLE} or ev2gym/data/bundle)')
+    parser.add_argument('--timescales', type=int, nargs='+', default=list(SUPPORTED_TIMESCALES),
+                        help='timescales (in minutes) of the precompiled time series')
+    parser.add_argument('--check', action='store_true',
+                        help='only check whether the bundle is up to date')
+    args = parser.parse_args()
+
+    if args.check:
+        bundle = open_dataset_bundle(args.path, verbose=True)
+        if bundle is None:
+            print('The dataset bundle is missing or stale')
+            raise SystemExit(1)
+        return
+
+    build_dataset_bundle(args.path, timescales=args.timescales)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+This file contains the EVSpecCatalog class, the compiled form of an EV specs file
+(e.g. ev2gym/data/ev_specs_v2g_enabled2024.json).
+'''
+
+import numpy as np
+
+# Current levels (in A) of the dense efficiency curves, from 0 to 100 A
+EFFICIENCY_LEVELS = 101
+
+
+class EVSpecCatalog():
+    '''
+    Catalog of EV models compiled once from an EV specs dict into arrays indexed by model.
+
+    The EVs of heterogeneous simulations reference a row (model index) of the catalog, so
+    models are sampled in bulk and the efficiency curves are shared instead of being rebuilt
+    for every spawned EV.
+
+    Attributes:
+        - specs: the EV specs dict the catalog was compiled from
+        - names: the name of every EV model
+        - n_models: the number of EV models
+        - registrations: the normalized number of registrations of every model (sampling probabilities)
+        - battery_capacity: the battery capacity of every model in kWh
+        - max_ac_charge_power, max_dc_charge_power, max_dc_discharge_power: the power limits of every model in kW
+        - has_efficiency_curve: whether the model has a 3-phase charge efficiency curve
+        - efficiency: the 3-phase charge efficiency (in %) of every model for every current level from 0 to 100 A,
+          shape (n_models, EFFICIENCY_LEVELS)
+
+    Methods:
+        - sample: samples EV models according to their number of registrations
+    '''
+
+    def __init__(self, specs):
+
+        self.specs = specs
+        self.names = list(specs.keys())
+        self.n_models = len(self.names)
+
+        registrations = np.array([specs[name]['number_of_registrations']
+                                  for name in self.names], dtype=float)
+        self.registrations = registrations / registrations.sum()
+
+        self.battery_capacity = self._column('battery_capacity')
+        self.max_ac_charge_power = self._column('max_ac_charge_power')
+        self.max_dc_charge_power = self._column('max_dc_charge_power')
+        self.max_dc_discharge_power = self._column('max_dc_discharge_power')
+
+        self.has_efficiency_curve = np.array(['3ph_ch_efficiency' in specs[name]
+                                              for name in self.names])
+        self.efficiency = np.ones((self.n_models, EFFICIENCY_LEVELS))
+        for model, name in enumerate(self.names):
+            if self.has_efficiency_curve[model]:
+                self.efficiency[model] = self._efficiency_curve(specs[name])
+
+        # the catalog is shared by all environments using the same specs file
+        for array in (self.registrations, self.battery_capacity, self.max_ac_charge_power,
+                      self.max_dc_charge_power, self.max_dc_discharge_power,
+                      self.has_efficiency_curve, self.efficiency):
+            array.setflags(write=False)
+
+    def _column(self, key) -> np.ndarray:
+        return np.array([self.specs[name][key] for name in self.names],
+                        dtype=float)
+
+    @staticmethod
+    def _efficiency_curve(ev_spec) -> np.ndarray:
+        '''
+        Returns the dense 3-phase charge efficiency curve (in %) of an EV model.
+        The current levels without efficiency use the efficiency of the closest current level.
+        '''
+        charge_efficiency_v = ev_spec["3ph_ch_efficiency"]
+        current_levels = ev_spec["ch_current"]
+        assert len(charge_efficiency_v) == len(current_levels)
+        assert all([0 <= x <= 100 for x in charge_efficiency_v])
+
+        # make a dict with charge leves kay and charge efficiency value
+        charge_efficiency = dict(zip(current_levels, charge_efficiency_v))
+
+        for i in range(0, EFFICIENCY_LEVELS):
+            if i not in charge_efficiency or charge_efficiency[i] == 0:
+                nonzero_keys = [
+                    k for k, v in charge_efficiency.items() if v != 0]
+                if nonzero_keys:
+                    closest = min(nonzero_keys, key=lambda x: abs(x - i))
+                    charge_efficiency[i] = charge_efficiency[closest]
+
+        return np.array([charge_efficiency.get(i, 1)
+                         for i in range(EFFICIENCY_LEVELS)], dtype=float)
+
+    def sample(self, size=None):
+        '''Samples size EV models (a single model index if size is None) according to their number of registrations'''
+        return np.random.choice(self.n_models, size=size, p=self.registrations)
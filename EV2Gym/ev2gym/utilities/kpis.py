@@ -0,0 +1,125 @@
+'''
+This file contains the EpisodeKPIs class, which keeps the running KPIs of an EV2Gym episode
+(read them mid-episode with env.kpis).
+'''
+
+import numpy as np
+
+
+class EpisodeKPIs():
+    '''
+    Running KPIs of an episode, updated at the end of every step with O(1) work per step
+    (plus O(1) per departing EV), so that they can be read at any point of the episode.
+    At the end of a full-length episode they agree with the final statistics of get_statistics.
+
+    Attributes:
+        - n_cs: the number of charging stations
+        - timescale: the timescale of the simulation in minutes
+
+    Status variables:
+        - steps: the number of recorded steps
+        - total_profits, total_energy_charged, total_energy_discharged, total_reward: the running totals
+        - tracking_error, energy_tracking_error, power_tracker_violation: the running power tracking errors
+        - total_transformer_overload: the running transformer overload
+        - cs_evs_served, cs_user_satisfaction: the number of served EVs and the sum of their user satisfaction per charging station
+
+    Methods:
+        - record_step: adds the results of a step
+        - record_departures: adds the user satisfaction of the departing EVs
+        - summary: returns the current KPIs
+        - get_state/set_state: copy the running KPIs (see EV2Gym.snapshot)
+    '''
+
+    def __init__(self, n_cs, timescale):
+        self.n_cs = n_cs
+        self.timescale = timescale
+
+        self.steps = 0
+        self.total_profits = 0
+        self.total_energy_charged = 0
+        self.total_energy_discharged = 0
+        self.total_reward = 0
+        self.tracking_error = 0
+        self.energy_tracking_error = 0
+        self.power_tracker_violation = 0
+        self.total_transformer_overload = 0
+
+        self.cs_evs_served = np.zeros(n_cs, dtype=int)
+        self.cs_user_satisfaction = np.zeros(n_cs)
+
+    def record_step(self,
+                    profits,
+                    energy_charged,
+                    energy_discharged,
+                    power_setpoint,
+                    power_usage,
+                    transformer_overload,
+                    reward,
+                    ) -> None:
+        '''
+        Adds the results of a step
+        Inputs:
+            - profits: the total profit + costs of charging and discharging of the step
+            - energy_charged, energy_discharged: the energy charged and discharged in the step in kWh
+            - power_setpoint, power_usage: the power setpoint and the power usage of the step in kW
+            - transformer_overload: the total transformer overload of the step
+            - reward: the reward of the step
+        '''
+        self.steps += 1
+        self.total_profits += profits
+        self.total_energy_charged += energy_charged
+        self.total_energy_discharged += energy_discharged
+        self.total_reward += reward
+
+        error = power_setpoint - power_usage
+        self.tracking_error += error**2
+        self.energy_tracking_error += abs(error)
+        if error < 0:
+            self.power_tracker_violation -= error
+
+        self.total_transformer_overload += transformer_overload
+
+    def record_departures(self, cs_ids, user_satisfaction) -> None:
+        '''
+        Adds the user satisfaction of the EVs that departed from the charging stations cs_ids
+        '''
+        if len(cs_ids) == 0:
+            return
+        np.add.at(self.cs_evs_served, cs_ids, 1)
+        np.add.at(self.cs_user_satisfaction, cs_ids, user_satisfaction)
+
+    def get_state(self) -> dict:
+        '''Returns a copy of the running KPIs'''
+        state = self.__dict__.copy()
+        state['cs_evs_served'] = self.cs_evs_served.copy()
+        state['cs_user_satisfaction'] = self.cs_user_satisfaction.copy()
+        return state
+
+    def set_state(self, state) -> None:
+        '''Restores the running KPIs of get_state'''
+        self.__dict__.update(state)
+        self.cs_evs_served = state['cs_evs_served'].copy()
+        self.cs_user_satisfaction = state['cs_user_satisfaction'].copy()
+
+    def summary(self) -> dict:
+        '''Returns the current KPIs with the same names as in get_statistics'''
+
+        served = self.cs_evs_served > 0
+        if served.any():
+            average_user_satisfaction = np.mean(self.cs_user_satisfaction[served] /
+                                                self.cs_evs_served[served])
+        else:
+            average_user_satisfaction = np.nan
+
+        return {'steps': self.steps,
+                'total_ev_served': int(self.cs_evs_served.sum()),
+                'total_profits': self.total_profits,
+                'total_energy_charged': self.total_energy_charged,
+                'total_energy_discharged': self.total_energy_discharged,
+                'average_user_satisfaction': average_user_satisfaction,
+                'power_tracker_violation': self.power_tracker_violation,
+                'tracking_error': self.tracking_error,
+                'energy_tracking_error': self.energy_tracking_error * self.timescale / 60,
+                'total_transformer_overload': self.total_transformer_overload,
+                'total_reward': self.total_reward,
+                }
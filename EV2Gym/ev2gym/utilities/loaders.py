@@ -8,13 +8,85 @@ import math
 import datetime
 import pkg_resources
 import json
+import threading
 from typing import List, Tuple
 
 from ev2gym.models.ev_charger import EV_Charger
-from ev2gym.models.ev import EV
+from ev2gym.models.ev import EVSession
 from ev2gym.models.transformer import Transformer
 
-from ev2gym.utilities.utils import EV_spawner, generate_power_setpoints, EV_spawner_GF
+from ev2gym.utilities.utils import EV_spawner, EV_spawner_sequential, generate_power_setpoints, EV_spawner_GF
+from ev2gym.utilities.dataset_bundle import open_dataset_bundle, default_bundle_path
+from ev2gym.utilities.ev_catalog import EVSpecCatalog
+
+# Process-wide registry of the parsed datasets, shared by all the environments of the process
+_dataset_cache = {}
+_dataset_locks = {}
+_dataset_registry_lock = threading.Lock()
+
+
+def load_dataset(key, loader):
+    '''
+    Returns the dataset registered under key, parsing it with loader() only the first time it is requested.
+    The registry is thread-safe and the NumPy arrays of the datasets are made read-only,
+    since they are shared by all the environment instances of the process.
+    Inputs:
+        - key: a hashable identifier of the dataset, e.g. (file_path, timescale)
+        - loader: a function without arguments that parses the dataset
+    '''
+    with _dataset_registry_lock:
+        if key in _dataset_cache:
+            return _dataset_cache[key]
+        lock = _dataset_locks.setdefault(key, threading.Lock())
+
+    # parse different datasets in parallel, but every dataset only once
+    with lock:
+        if key not in _dataset_cache:
+            _dataset_cache[key] = _read_only(loader())
+        return _dataset_cache[key]
+
+
+def clear_dataset_cache() -> None:
+    '''Removes all the datasets from the process-wide registry'''
+    with _dataset_registry_lock:
+        _dataset_cache.clear()
+        _dataset_locks.clear()
+
+
+def _dataset_bundle():
+    '''
+    Returns the precompiled dataset bundle at default_bundle_path() (opened once per process and path),
+    or None if it is not available
+    '''
+    path = default_bundle_path()
+    return load_dataset(('dataset_bundle', path), lambda: open_dataset_bundle(path))
+
+
+def _read_only(data):
+    '''Makes the NumPy arrays of a dataset (also inside tuples and dicts) read-only'''
+    if isinstance(data, np.ndarray):
+        data.setflags(write=False)
+    elif isinstance(data, (tuple, list)):
+        for item in data:
+            _read_only(item)
+    elif isinstance(data, dict):
+        for item in data.values():
+            _read_only(item)
+    return data
+
+
+def _dataset_index(simulation_date, dataset_starting_date, timescale, length) -> int:
+    '''
+    Returns the row of a dataset with the given timescale that corresponds to the simulation date.
+    The year of the simulation date is replaced with the year of the dataset.
+    '''
+    date = simulation_date.replace(year=dataset_starting_date.year)
+    minutes = (date - dataset_starting_date).total_seconds() / 60
+
+    if minutes % timescale != 0 or not 0 <= minutes // timescale < length:
+        raise IndexError(f'Date {date} is not part of the dataset')
+
+    return int(minutes // timescale)
 
 
 def load_ev_spawn_scenarios(env) -> None:
@@ -29,27 +101,77 @@ def load_ev_spawn_scenarios(env) -> None:
             ev_specs_file = pkg_resources.resource_filename(
                 'ev2gym', 'data/ev_specs.json')
         
-        with open(ev_specs_file) as f:
-            env.ev_specs = json.load(f)
-
-        registrations = np.zeros(len(env.ev_specs.keys()))
-        for i, ev_name in enumerate(env.ev_specs.keys()):
-            # sum the total number of registrations
-            registrations[i] = env.ev_specs[ev_name]['number_of_registrations']
-
-        env.normalized_ev_registrations = registrations/registrations.sum()
+        env.ev_catalog = load_dataset(('ev_specs', ev_specs_file),
+                                      lambda: _parse_ev_specs(ev_specs_file))
+        env.ev_specs = env.ev_catalog.specs
+        env.normalized_ev_registrations = env.ev_catalog.registrations
 
     if env.scenario == 'GF':
-        env.df_arrival = np.load('./GF_data/time_of_arrival.npy')  # weekdays
-        env.time_of_connection_vs_hour_weekday = np.load(
-            './GF_data/weekday_time_of_stay.npy')
-        env.time_of_connection_vs_hour_weekend = np.load(
-            './GF_data/weekend_time_of_stay.npy')
-        env.df_req_energy_weekday = np.load('./GF_data/weekday_volumeKWh.npy')
-        env.df_req_energy_weekend = np.load('./GF_data/weekend_volumeKWh.npy')
+        env.df_arrival = load_dataset(
+            ('npy', './GF_data/time_of_arrival.npy'),
+            lambda: np.load('./GF_data/time_of_arrival.npy'))  # weekdays
+        env.time_of_connection_vs_hour_weekday = load_dataset(
+            ('npy', './GF_data/weekday_time_of_stay.npy'),
+            lambda: np.load('./GF_data/weekday_time_of_stay.npy'))
+        env.time_of_connection_vs_hour_weekend = load_dataset(
+            ('npy', './GF_data/weekend_time_of_stay.npy'),
+            lambda: np.load('./GF_data/weekend_time_of_stay.npy'))
+        env.df_req_energy_weekday = load_dataset(
+            ('npy', './GF_data/weekday_volumeKWh.npy'),
+            lambda: np.load('./GF_data/weekday_volumeKWh.npy'))
+        env.df_req_energy_weekend = load_dataset(
+            ('npy', './GF_data/weekend_volumeKWh.npy'),
+            lambda: np.load('./GF_data/weekend_volumeKWh.npy'))
 
         return
 
+    # the tables are dicts of read-only NumPy arrays (one per column) shared by all the environments
+    (env.df_arrival_week,
+     env.df_arrival_weekend,
+     env.df_connection_time,
+     env.df_energy_demand,
+     env.time_of_connection_vs_hour,
+     env.df_req_energy,
+     env.df_time_of_stay_vs_arrival) = load_dataset(('ev_spawn_scenarios',),
+                                                    _parse_ev_spawn_scenarios)
+
+
+def _parse_ev_specs(ev_specs_file):
+    '''Reads the EV specs file and compiles it into an EVSpecCatalog'''
+
+    with open(ev_specs_file) as f:
+        ev_specs = json.load(f)
+
+    return EVSpecCatalog(ev_specs)
+
+
+def _table_columns(df) -> dict:
+    '''Returns the columns of a table as a dict of NumPy arrays, the non-numeric columns as strings'''
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object or not np.issubdtype(values.dtype, np.number):
+            values = values.astype(str)
+        columns[column] = values
+    return columns
+
+
+def _parse_ev_spawn_scenarios(use_bundle=True):
+    '''
+    Reads the arrival, connection time and energy demand distributions of the EV spawn scenarios
+    Returns:
+        - the tables as dicts of NumPy arrays (one per column), they are made read-only by load_dataset
+    '''
+
+    bundle = _dataset_bundle() if use_bundle else None
+    if bundle is not None:
+        # the memory-mapped columns of the bundle are used directly
+        tables = [bundle.get_table(name)
+                  for name in ('arrival_week', 'arrival_weekend', 'connection_time',
+                               'energy_demand', 'req_energy', 'time_of_stay_vs_arrival')]
+        return tables[0], tables[1], tables[2], tables[3], \
+            bundle.get_array('time_of_connection_vs_hour'), tables[4], tables[5]
+
     df_arrival_week_file = pkg_resources.resource_filename(
         'ev2gym', 'data/distribution-of-arrival.csv')
     df_arrival_weekend_file = pkg_resources.resource_filename(
@@ -66,26 +188,31 @@ def load_ev_spawn_scenarios(env) -> None:
     df_time_of_stay_vs_arrival_file = pkg_resources.resource_filename(
         'ev2gym', 'data/mean-session-length-per.csv')
 
-    env.df_arrival_week = pd.read_csv(df_arrival_week_file)  # weekdays
-    env.df_arrival_weekend = pd.read_csv(df_arrival_weekend_file)  # weekends
-    env.df_connection_time = pd.read_csv(
+    df_arrival_week = pd.read_csv(df_arrival_week_file)  # weekdays
+    df_arrival_weekend = pd.read_csv(df_arrival_weekend_file)  # weekends
+    df_connection_time = pd.read_csv(
         df_connection_time_file)  # connection time
-    env.df_energy_demand = pd.read_csv(df_energy_demand_file)  # energy demand
-    env.time_of_connection_vs_hour = np.load(
+    df_energy_demand = pd.read_csv(df_energy_demand_file)  # energy demand
+    time_of_connection_vs_hour = np.load(
         time_of_connection_vs_hour_file)  # time of connection vs hour
 
-    env.df_req_energy = pd.read_csv(
+    df_req_energy = pd.read_csv(
         df_req_energy_file)  # energy demand per arrival
     # replace column work with workplace
-    env.df_req_energy = env.df_req_energy.rename(columns={'work': 'workplace',
-                                                          'home': 'private'})
-    env.df_req_energy = env.df_req_energy.fillna(0)
+    df_req_energy = df_req_energy.rename(columns={'work': 'workplace',
+                                                  'home': 'private'})
+    df_req_energy = df_req_energy.fillna(0)
 
-    env.df_time_of_stay_vs_arrival = pd.read_csv(
+    df_time_of_stay_vs_arrival = pd.read_csv(
         df_time_of_stay_vs_arrival_file)  # time of stay vs arrival
-    env.df_time_of_stay_vs_arrival = env.df_time_of_stay_vs_arrival.fillna(0)
-    env.df_time_of_stay_vs_arrival = env.df_time_of_stay_vs_arrival.rename(columns={'work': 'workplace',
-                                                                                    'home': 'private'})
+    df_time_of_stay_vs_arrival = df_time_of_stay_vs_arrival.fillna(0)
+    df_time_of_stay_vs_arrival = df_time_of_stay_vs_arrival.rename(columns={'work': 'workplace',
+                                                                            'home': 'private'})
+
+    return _table_columns(df_arrival_week), _table_columns(df_arrival_weekend), \
+        _table_columns(df_connection_time), _table_columns(df_energy_demand), \
+        time_of_connection_vs_hour, _table_columns(df_req_energy), \
+        _table_columns(df_time_of_stay_vs_arrival)
 
 
 def load_power_setpoints(env) -> np.ndarray:
@@ -105,18 +232,47 @@ def generate_residential_inflexible_loads(env) -> np.ndarray:
     in the simulation.
     '''
 
+    data = load_dataset(('residential_loads', env.timescale),
+                        lambda: _parse_residential_loads(env.timescale))
+
+    simulation_length = env.simulation_length
+    number_of_transformers = env.number_of_transformers
+
+    dataset_starting_date = datetime.datetime(2022, 1, 1)
+    simulation_index = _dataset_index(env.sim_starting_date,
+                                      dataset_starting_date,
+                                      env.timescale,
+                                      data.shape[0])
+
+    # select the data for the simulation date
+    data = pd.DataFrame(data[simulation_index:simulation_index+simulation_length])
+    new_data = pd.DataFrame()
+
+    for i in range(number_of_transformers):
+        new_data['tr_'+str(i)] = data.sample(10, axis=1,
+                                             random_state=env.tr_seed).sum(axis=1)
+
+    # return the "tr_" columns
+    return new_data.to_numpy().T
+
+
+def _parse_residential_loads(desired_timescale, use_bundle=True) -> np.ndarray:
+    '''
+    Reads the residential loads and resamples them to the desired timescale
+    Returns:
+        - a matrix of size (two years of steps, number of households) starting on 2022-01-01 00:00
+    '''
+
+    bundle = _dataset_bundle() if use_bundle else None
+    if bundle is not None and f'residential_loads_{desired_timescale}' in bundle:
+        return bundle.get_array(f'residential_loads_{desired_timescale}')
+
     # Load the data
     data_path = pkg_resources.resource_filename(
         'ev2gym', 'data/residential_loads.csv')
     data = pd.read_csv(data_path, header=None)
 
-    desired_timescale = env.timescale
-    simulation_length = env.simulation_length
-    simulation_date = env.sim_starting_date.strftime('%Y-%m-%d %H:%M:%S')
-    number_of_transformers = env.number_of_transformers
-
     dataset_timescale = 15
-    dataset_starting_date = '2022-01-01 00:00:00'
 
     if desired_timescale > dataset_timescale:
         data = data.groupby(
@@ -130,51 +286,55 @@ def generate_residential_inflexible_loads(env) -> np.ndarray:
     # duplicate the data to have two years of data
     data = pd.concat([data, data], ignore_index=True)
 
-    # add a date column to the dataframe
-    data['date'] = pd.date_range(
-        start=dataset_starting_date, periods=data.shape[0], freq=f'{desired_timescale}min')
+    return data.to_numpy()
+
 
-    # find year of the data
-    year = int(dataset_starting_date.split('-')[0])
-    # replace the year of the simulation date with the year of the data
-    simulation_date = f'{year}-{simulation_date.split("-")[1]}-{simulation_date.split("-")[2]}'
+def generate_pv_generation(env) -> np.ndarray:
+    '''
+    This function loads the PV generation of each transformer by loading the data from a file
+    and then adding minor variations to the data
+    '''
 
-    simulation_index = data[data['date'] == simulation_date].index[0]
+    data = load_dataset(('pv_generation', env.timescale),
+                        lambda: _parse_pv_generation(env.timescale))
+
+    simulation_length = env.simulation_length
+    number_of_transformers = env.number_of_transformers
+
+    dataset_starting_date = datetime.datetime(2019, 1, 1)
+    simulation_index = _dataset_index(env.sim_starting_date,
+                                      dataset_starting_date,
+                                      env.timescale,
+                                      data.shape[0])
 
     # select the data for the simulation date
     data = data[simulation_index:simulation_index+simulation_length]
 
-    # drop the date column
-    data = data.drop(columns=['date'])
-    new_data = pd.DataFrame()
-
+    new_data = np.zeros((number_of_transformers, len(data)))
     for i in range(number_of_transformers):
-        new_data['tr_'+str(i)] = data.sample(10, axis=1,
-                                             random_state=env.tr_seed).sum(axis=1)
+        new_data[i, :] = data * env.tr_rng.uniform(0.9, 1.1)
 
-    # return the "tr_" columns
-    return new_data.to_numpy().T
+    return new_data
 
 
-def generate_pv_generation(env) -> np.ndarray:
+def _parse_pv_generation(desired_timescale, use_bundle=True) -> np.ndarray:
     '''
-    This function loads the PV generation of each transformer by loading the data from a file
-    and then adding minor variations to the data
+    Reads the PV generation, resamples it to the desired timescale and smooths it
+    Returns:
+        - a vector with two years of steps starting on 2019-01-01 00:00
     '''
 
+    bundle = _dataset_bundle() if use_bundle else None
+    if bundle is not None and f'pv_generation_{desired_timescale}' in bundle:
+        return bundle.get_array(f'pv_generation_{desired_timescale}')
+
     # Load the data
     data_path = pkg_resources.resource_filename(
         'ev2gym', 'data/pv_netherlands.csv')
     data = pd.read_csv(data_path, sep=',', header=0)
     data.drop(['time', 'local_time'], inplace=True, axis=1)
 
-    desired_timescale = env.timescale
-    simulation_length = env.simulation_length
-    simulation_date = env.sim_starting_date.strftime('%Y-%m-%d %H:%M:%S')
-    number_of_transformers = env.number_of_transformers
-
     dataset_timescale = 60
-    dataset_starting_date = '2019-01-01 00:00:00'
 
     if desired_timescale > dataset_timescale:
         data = data.groupby(
@@ -196,28 +356,7 @@ def generate_pv_generation(env) -> np.ndarray:
     # duplicate the data to have two years of data
     data = pd.concat([data, data], ignore_index=True)
 
-    # add a date column to the dataframe
-    data['date'] = pd.date_range(
-        start=dataset_starting_date, periods=data.shape[0], freq=f'{desired_timescale}min')
-
-    # find year of the data
-    year = int(dataset_starting_date.split('-')[0])
-    # replace the year of the simulation date with the year of the data
-    simulation_date = f'{year}-{simulation_date.split("-")[1]}-{simulation_date.split("-")[2]}'
-
-    simulation_index = data[data['date'] == simulation_date].index[0]
-
-    # select the data for the simulation date
-    data = data[simulation_index:simulation_index+simulation_length]
-
-    # drop the date column
-    data = data.drop(columns=['date'])
-    new_data = pd.DataFrame()
-
-    for i in range(number_of_transformers):
-        new_data['tr_'+str(i)] = data * env.tr_rng.uniform(0.9, 1.1)
-
-    return new_data.to_numpy().T
+    return data['electricity'].to_numpy()
 
 
 def load_transformers(env) -> List[Transformer]:
@@ -361,12 +500,12 @@ def load_ev_charger_profiles(env) -> List[EV_Charger]:
         return charging_stations
 
 
-def load_ev_profiles(env) -> List[EV]:
+def load_ev_profiles(env) -> List[EVSession]:
     '''Loads the EV profiles of the simulation
     If load_from_replay_path is None, then the EV profiles are created randomly
 
     Returns:
-        - ev_profiles: a list of ev_profile objects'''
+        - ev_profiles: a list of EVSession records, sorted by time of arrival'''
 
     if env.load_from_replay_path is None:
 
@@ -376,13 +515,18 @@ def load_ev_profiles(env) -> List[EV]:
                 ev_profiles = EV_spawner_GF(env)
             return ev_profiles
 
-        ev_profiles = EV_spawner(env)
+        if "sequential_ev_spawner" in env.config and env.config["sequential_ev_spawner"]:
+            spawner = EV_spawner_sequential
+        else:
+            spawner = EV_spawner
+
+        ev_profiles = spawner(env)
         while len(ev_profiles) == 0:
-            ev_profiles = EV_spawner(env)
+            ev_profiles = spawner(env)
 
         return ev_profiles
     else:
-        return env.replay.EVs
+        return list(env.replay.sessions)
 
 def load_electricity_prices(env) -> Tuple[np.ndarray, np.ndarray]:
     '''Loads the electricity prices of the simulation
@@ -397,53 +541,83 @@ def load_electricity_prices(env) -> Tuple[np.ndarray, np.ndarray]:
 
     if env.price_data is None:
         # else load historical prices
-        file_path = pkg_resources.resource_filename(
-            'ev2gym', 'data/Netherlands_day-ahead-2015-2024.csv')
-        env.price_data = pd.read_csv(file_path, sep=',', header=0)
-        drop_columns = ['Country', 'Datetime (Local)']        
-
-        env.price_data.drop(drop_columns, inplace=True, axis=1)
-        env.price_data['year'] = pd.DatetimeIndex(env.price_data['Datetime (UTC)']).year
-        env.price_data['month'] = pd.DatetimeIndex(env.price_data['Datetime (UTC)']).month
-        env.price_data['day'] = pd.DatetimeIndex(env.price_data['Datetime (UTC)']).day
-        env.price_data['hour'] = pd.DatetimeIndex(env.price_data['Datetime (UTC)']).hour
+        env.price_data = load_dataset(('electricity_prices',),
+                                      _parse_electricity_prices)
 
     # assume charge and discharge prices are the same
     # assume prices are the same for all charging stations
 
-    data = env.price_data
-    charge_prices = np.zeros((env.cs, env.simulation_length))
-    discharge_prices = np.zeros((env.cs, env.simulation_length))
     # for every simulation step, take the price of the corresponding hour
-    sim_temp_date = env.sim_date
-    for i in range(env.simulation_length):
-
-        year = sim_temp_date.year
-        month = sim_temp_date.month
-        day = sim_temp_date.day
-        hour = sim_temp_date.hour
-        # find the corresponding price
-        try:
-            charge_prices[:, i] = -data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                            'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-            discharge_prices[:, i] = data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                              'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-        except:
-            print(
-                'Error: no price found for the given date and hour. Using 2022 prices instead.')
-
-            year = 2022
-            if day > 28:
-                day -= 1
-            print("Debug:", year, month, day, hour)
-            charge_prices[:, i] = -data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                            'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-            discharge_prices[:, i] = data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                              'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-
-        # step to next
-        sim_temp_date = sim_temp_date + \
-            datetime.timedelta(minutes=env.timescale)
+    prices = get_hourly_prices(env.price_data,
+                               env.timeline)
+
+    charge_prices = np.tile(-prices/1000, (env.cs, 1))  # €/kWh
+    discharge_prices = np.tile(prices/1000, (env.cs, 1))  # €/kWh
 
     discharge_prices = discharge_prices * env.config['discharge_price_factor']
-    return charge_prices, discharge_prices
\ No newline at end of file
+    return charge_prices, discharge_prices
+
+def get_hourly_prices(price_data, timeline) -> np.ndarray:
+    '''
+    Returns the day-ahead price (EUR/MWhe) of the hour of every simulation step,
+    gathered from the hourly price index with the hours of the episode timeline.
+    Hours without a price (or outside of the dataset) use the price of the same
+    month, day and hour of 2022 (the day before if the day is after the 28th).
+    '''
+    epoch = price_data['epoch']
+    hourly_prices = price_data['hourly_prices']
+    simulation_length = timeline.simulation_length
+
+    # the epoch of the prices is a whole hour
+    hours = timeline.hours_since_epoch[:simulation_length] - \
+        epoch.astype('datetime64[h]').astype(np.int64)
+
+    in_range = (hours >= 0) & (hours < len(hourly_prices))
+    prices = np.full(simulation_length, np.nan)
+    prices[in_range] = hourly_prices[hours[in_range]]
+
+    missing = np.flatnonzero(np.isnan(prices))
+    if len(missing) > 0:
+        print(f'Error: no price found for {len(missing)} steps. Using 2022 prices instead.')
+
+        for i in missing:
+            date = timeline.date(i)
+            day = date.day - 1 if date.day > 28 else date.day
+            fallback = datetime.datetime(2022, date.month, day, date.hour)
+            hour = int((np.datetime64(fallback, 'h') - epoch).astype(int))
+            if not 0 <= hour < len(hourly_prices) or np.isnan(hourly_prices[hour]):
+                raise IndexError(f'No price found for {date} and {fallback}')
+            prices[i] = hourly_prices[hour]
+
+    return prices
+
+
+def _parse_electricity_prices(use_bundle=True) -> dict:
+    '''
+    Reads the historical day-ahead prices and compiles them in an hourly price index
+    Returns:
+        - a dict with the first hour of the dataset (epoch) and the price (EUR/MWhe) of every
+        hour since the epoch (hourly_prices), NaN for the hours without price
+    '''
+
+    bundle = _dataset_bundle() if use_bundle else None
+    if bundle is not None:
+        return {'epoch': np.datetime64(bundle.manifest['price_epoch'], 'h'),
+                'hourly_prices': bundle.get_array('hourly_prices')}
+    file_path = pkg_resources.resource_filename(
+        'ev2gym', 'data/Netherlands_day-ahead-2015-2024.csv')
+    price_data = pd.read_csv(file_path, sep=',', header=0)
+
+    hours = pd.DatetimeIndex(price_data['Datetime (UTC)']).to_numpy(
+        dtype='datetime64[h]')
+    prices = price_data['Price (EUR/MWhe)'].to_numpy(dtype=float)
+
+    epoch = hours.min()
+    offsets = (hours - epoch).astype(int)
+    # keep the first price of every hour
+    offsets, first = np.unique(offsets, return_index=True)
+
+    hourly_prices = np.full(offsets[-1] + 1, np.nan)
+    hourly_prices[offsets] = prices[first]
+
+    return {'epoch': epoch, 'hourly_prices': hourly_prices}
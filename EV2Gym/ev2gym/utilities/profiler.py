@@ -0,0 +1,123 @@
+'''
+This file contains the EV2GymProfiler class, which records the wall time of the phases of
+the step and reset methods of EV2Gym (enable it with EV2Gym(..., profile=True)).
+'''
+
+import time
+from collections import deque
+
+# Phases of EV2Gym.step, in execution order
+STEP_PHASES = ('charging_stations',
+               'ev_spawning',
+               'power_statistics',
+               'charge_power_potential',
+               'reward',
+               'kpis',
+               'telemetry',
+               'render',
+               'termination',
+               'state',
+               )
+
+# Phases of EV2Gym.reset, in execution order
+RESET_PHASES = ('reset',
+                'reset_ev_spawning',
+                'reset_power_setpoints',
+                'reset_statistics',
+                'reset_state',
+                )
+
+
+class EV2GymProfiler():
+    '''
+    Low-overhead wall time counters for the phases of EV2Gym.step and EV2Gym.reset.
+
+    The environment calls start() at the beginning of step/reset and lap(phase) at the end of
+    every phase, so every lap costs a single perf_counter call and two dict updates.
+
+    Attributes:
+        - max_episodes: the number of episode summaries that are kept
+
+    Status variables:
+        - total_time: the total wall time (in seconds) of every phase since the profiler was created or cleared
+        - calls: the number of times every phase was recorded
+        - episodes: the summaries of the last finished episodes
+
+    Methods:
+        - start: starts timing a new sequence of phases
+        - lap: records the wall time since the previous lap under a phase
+        - summary: returns the total, number of calls, mean and share of every phase
+        - start_episode/end_episode: delimit the episodes for the per-episode summaries
+        - clear: clears all counters
+    '''
+
+    def __init__(self, max_episodes=100):
+        self.max_episodes = max_episodes
+        self.clear()
+
+    def clear(self) -> None:
+        '''Clears all counters and episode summaries'''
+        self.total_time = {}
+        self.calls = {}
+        self.episodes = deque(maxlen=self.max_episodes)
+        self._episode_time = {}
+        self._episode_calls = {}
+        self._last = time.perf_counter()
+
+    def start(self) -> None:
+        '''Starts timing a new sequence of phases'''
+        self._last = time.perf_counter()
+
+    def lap(self, phase) -> None:
+        '''Records the wall time since the previous lap (or start) under phase'''
+        now = time.perf_counter()
+        self.total_time[phase] = self.total_time.get(phase, 0) + now - self._last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self._last = now
+
+    def start_episode(self) -> None:
+        '''Marks the start of an episode'''
+        self._episode_time = dict(self.total_time)
+        self._episode_calls = dict(self.calls)
+
+    def end_episode(self) -> dict:
+        '''Returns the summary of the phases since the start of the episode and keeps it in episodes'''
+        summary = self.summary(since=(self._episode_time, self._episode_calls))
+        self.episodes.append(summary)
+        return summary
+
+    def summary(self, since=None) -> dict:
+        '''
+        Returns a dict with the total time (s), the number of calls, the mean time per call (ms)
+        and the share of the total time (%) of every phase, in execution order
+        Inputs:
+            - since: optional (total_time, calls) counters to subtract
+        '''
+        since_time, since_calls = since if since is not None else ({}, {})
+
+        phases = [phase for phase in RESET_PHASES + STEP_PHASES
+                  if phase in self.total_time]
+        phases += [phase for phase in self.total_time if phase not in phases]
+
+        totals = {phase: self.total_time[phase] - since_time.get(phase, 0)
+                  for phase in phases}
+        overall = sum(totals.values())
+
+        summary = {}
+        for phase in phases:
+            calls = self.calls[phase] - since_calls.get(phase, 0)
+            if calls == 0:
+                continue
+            summary[phase] = {'total': totals[phase],
+                              'calls': calls,
+                              'mean_ms': 1000 * totals[phase] / calls,
+                              'share': 100 * totals[phase] / overall if overall > 0 else 0,
+                              }
+        return summary
+
+    def __str__(self) -> str:
+        lines = [f'{"phase":<24}{"total (s)":>12}{"calls":>10}{"mean (ms)":>12}{"share (%)":>12}']
+        for phase, values in self.summary().items():
+            lines.append(f'{phase:<24}{values["total"]:>12.4f}{values["calls"]:>10d}' +
+                         f'{values["mean_ms"]:>12.4f}{values["share"]:>12.2f}')
+        return '\n'.join(lines)
@@ -0,0 +1,295 @@
+'''
+This file contains the offline scenario bank of EV2Gym.
+
+A scenario is everything an EV2Gym episode samples before it starts: the starting date, the EV
+sessions, the power setpoints, the electricity prices and the inflexible loads, PV generation,
+forecasts and demand response events of the transformers. The scenario bank pre-generates
+thousands of scenarios of a config file in a process pool and stores them as a directory with
+one .npy file per array and a manifest.json file (like the dataset bundle in dataset_bundle.py).
+The arrays are opened with np.memmap and indexed by scenario, so that an environment created with
+EV2Gym(..., scenario_bank=path) resets by copying the rows of one scenario, without generating
+anything.
+
+The scenarios of a bank only hold the exogenous data of the episodes, the charging stations and
+the transformers are the ones of the environment that uses the bank (the manifest records their
+number, and a bank is only accepted by environments with the same topology and simulation length).
+
+Generate a bank with:
+    python -m ev2gym.utilities.scenario_bank --config_file CONFIG --path PATH --n_scenarios N [--workers W]
+'''
+
+import os
+import json
+import argparse
+import datetime
+import multiprocessing as mp
+import numpy as np
+
+from ev2gym.models.ev import sessions_to_columns, sessions_from_columns
+
+SCENARIO_BANK_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# Transformer arrays of a scenario, shape (n_transformers, simulation_length)
+TRANSFORMER_ARRAYS = ('inflexible_load',
+                      'solar_power',
+                      'inflexible_load_forecast',
+                      'pv_generation_forecast',
+                      'max_power',
+                      'min_power',
+                      'max_current',
+                      'min_current',
+                      )
+
+def scenario_of(env) -> dict:
+    '''
+    Returns the scenario of the current episode of env as a dict of arrays
+    '''
+    scenario = {'sim_date': np.datetime64(env.sim_starting_date, 's').astype(np.int64),
+                'power_setpoints': np.asarray(env.power_setpoints, dtype=float),
+                'charge_prices': np.asarray(env.charge_prices, dtype=float),
+                'discharge_prices': np.asarray(env.discharge_prices, dtype=float),
+                }
+
+    for name in TRANSFORMER_ARRAYS:
+        scenario[name] = np.array([getattr(tr, name)
+                                   for tr in env.transformers], dtype=float)
+
+    events = [[(event['event_start_step'], event['event_end_step'], event['capacity_percentage'])
+               for event in tr.dr_events] for tr in env.transformers]
+    scenario['dr_events_count'] = np.array([len(e) for e in events], dtype=np.int64)
+    events = np.array([event for tr_events in events for event in tr_events],
+                      dtype=float).reshape(-1, 3)
+    scenario['dr_events'] = events
+
+    for name, values in sessions_to_columns(env.EVs_profiles).items():
+        scenario[f'session_{name}'] = values
+
+    return scenario
+
+
+def _generate_scenarios(args) -> list:
+    '''Worker of generate_scenario_bank, returns the scenarios of the given seeds'''
+    # imported here to avoid a circular import with ev2gym_env
+    from ev2gym.models.ev2gym_env import EV2Gym
+
+    config_file, seeds, env_kwargs = args
+    scenarios = []
+    for seed in seeds:
+        env = EV2Gym(config_file=config_file, seed=seed, **env_kwargs)
+        env.reset(seed=seed)
+        scenarios.append(scenario_of(env))
+    return scenarios
+
+
+class ScenarioBank():
+    '''
+    An offline scenario bank opened with memory-mapped arrays.
+
+    Attributes:
+        - path: the directory of the bank
+        - manifest: the content of the manifest file
+        - seeds: the seed every scenario was generated with
+
+    Methods:
+        - get: returns a scenario by index
+        - apply: sets the scenario of an environment
+    '''
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.seeds = list(manifest['seeds'])
+
+        self.arrays = {name: np.load(os.path.join(path, file_name), mmap_mode='r')
+                       for name, file_name in manifest['arrays'].items()}
+
+    def __len__(self) -> int:
+        return self.manifest['n_scenarios']
+
+    def check_env(self, env) -> None:
+        '''Raises a ValueError if the scenarios of the bank do not fit the topology of env'''
+        expected = {'simulation_length': env.simulation_length,
+                    'timescale': env.timescale,
+                    'n_cs': env.cs,
+                    'n_transformers': len(env.transformers),
+                    'n_ports': int(env.number_of_ports),
+                    }
+        mismatch = [f'{key}={self.manifest[key]} (env: {value})'
+                    for key, value in expected.items() if self.manifest[key] != value]
+        if mismatch:
+            raise ValueError(f'The scenario bank at {self.path} does not fit the environment: ' +
+                             ', '.join(mismatch))
+
+    def get(self, index) -> dict:
+        '''
+        Returns the scenario index with the EV sessions as a list of EVSession records
+        '''
+        arrays = self.arrays
+        scenario = {name: arrays[name][index]
+                    for name in ('power_setpoints', 'charge_prices', 'discharge_prices')
+                    + TRANSFORMER_ARRAYS}
+        scenario['sim_date'] = np.datetime64(int(arrays['sim_date'][index]), 's').item()
+
+        start, end = arrays['dr_events_offsets'][index:index+2]
+        events = arrays['dr_events'][start:end]
+        counts = arrays['dr_events_count'][index]
+        tr_offsets = np.concatenate(([0], np.cumsum(counts)))
+        scenario['dr_events'] = [[{'event_start_step': int(event[0]),
+                                   'event_end_step': int(event[1]),
+                                   'capacity_percentage': event[2]}
+                                  for event in events[tr_offsets[i]:tr_offsets[i+1]]]
+                                 for i in range(len(counts))]
+
+        start, end = arrays['session_offsets'][index:index+2]
+        scenario['sessions'] = sessions_from_columns(
+            {name[len('session_'):]: values[start:end]
+             for name, values in arrays.items() if name.startswith('session_')
+             and name != 'session_offsets'})
+        return scenario
+
+    def apply(self, env, index) -> None:
+        '''
+        Sets the scenario index as the current episode of env (called by EV2Gym.reset)
+        '''
+        scenario = self.get(index)
+
+        env.scenario_index = index
+        env.sim_starting_date = scenario['sim_date']
+        env.EVs_profiles = scenario['sessions']
+        env.power_setpoints = np.array(scenario['power_setpoints'])
+        env.charge_prices = np.array(scenario['charge_prices'])
+        env.discharge_prices = np.array(scenario['discharge_prices'])
+
+        for i, tr in enumerate(env.transformers):
+            for name in TRANSFORMER_ARRAYS:
+                # copies, the forecasts are updated in place during the episode
+                setattr(tr, name, np.array(scenario[name][i]))
+            tr.dr_events = scenario['dr_events'][i]
+
+
+def open_scenario_bank(path) -> ScenarioBank:
+    '''
+    Opens the scenario bank at path
+    Returns:
+        - a ScenarioBank, raises a ValueError if the bank has another version
+    '''
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != SCENARIO_BANK_VERSION:
+        raise ValueError(f'The scenario bank at {path} has version {manifest.get("version")}' +
+                         f' instead of {SCENARIO_BANK_VERSION}, generate it again')
+
+    return ScenarioBank(path, manifest)
+
+
+def generate_scenario_bank(config_file,
+                           path,
+                           n_scenarios,
+                           seed=0,
+                           workers=None,
+                           chunk_size=16,
+                           verbose=True,
+                           **env_kwargs,
+                           ) -> str:
+    '''
+    Generates n_scenarios scenarios of config_file in a process pool and stores them at path
+    Inputs:
+        - seed: the seed of the first scenario, scenario i is the episode of EV2Gym(config_file, seed=seed + i) after reset(seed=seed + i)
+        - workers: the number of worker processes (default: the number of cpus), 0 generates the scenarios in this process
+        - chunk_size: the number of scenarios generated per task
+        - env_kwargs: extra arguments of the EV2Gym environments
+    Returns:
+        - the directory of the bank
+    '''
+    seeds = [seed + i for i in range(n_scenarios)]
+    tasks = [(config_file, seeds[i:i+chunk_size], env_kwargs)
+             for i in range(0, n_scenarios, chunk_size)]
+
+    if verbose:
+        print(f'Generating {n_scenarios} scenarios of {config_file} at {path}')
+
+    scenarios = []
+    if workers == 0:
+        for task in tasks:
+            scenarios += _generate_scenarios(task)
+    else:
+        with mp.Pool(workers) as pool:
+            for chunk in pool.imap(_generate_scenarios, tasks):
+                scenarios += chunk
+                if verbose:
+                    print(f'  {len(scenarios)}/{n_scenarios} scenarios')
+
+    # the topology of the bank, checked by the environments that use it
+    from ev2gym.models.ev2gym_env import EV2Gym
+    env = EV2Gym(config_file=config_file, seed=seed, **env_kwargs)
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {}
+
+    def add_array(name, array):
+        file_name = f'{name}.npy'
+        np.save(os.path.join(path, file_name), np.ascontiguousarray(array))
+        arrays[name] = file_name
+
+    for name in scenarios[0]:
+        if name.startswith('session_') or name == 'dr_events':
+            # variable length, concatenated with an offsets array
+            values = [scenario[name] for scenario in scenarios]
+            if name.startswith('session_') and values[0].ndim == 2:
+                width = max(v.shape[1] for v in values)
+                values = [np.pad(v, ((0, 0), (0, width - v.shape[1])), constant_values=np.nan)
+                          for v in values]
+            add_array(name, np.concatenate(values))
+        else:
+            add_array(name, np.stack([scenario[name] for scenario in scenarios]))
+
+    add_array('session_offsets', np.cumsum(
+        [0] + [len(scenario['session_id']) for scenario in scenarios]))
+    add_array('dr_events_offsets', np.cumsum(
+        [0] + [len(scenario['dr_events']) for scenario in scenarios]))
+
+    manifest = {'version': SCENARIO_BANK_VERSION,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'config_file': os.path.abspath(config_file),
+                'n_scenarios': n_scenarios,
+                'seeds': seeds,
+                'simulation_length': env.simulation_length,
+                'timescale': env.timescale,
+                'n_cs': env.cs,
+                'n_transformers': len(env.transformers),
+                'n_ports': int(env.number_of_ports),
+                'arrays': arrays,
+                }
+
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    if verbose:
+        print(f'Scenario bank written at {path}')
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate an offline scenario bank of EV2Gym')
+    parser.add_argument('--config_file', type=str, required=True,
+                        help='the config file of the scenarios')
+    parser.add_argument('--path', type=str, required=True,
+                        help='directory of the scenario bank')
+    parser.add_argument('--n_scenarios', type=int, default=1000,
+                        help='number of scenarios')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first scenario')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: the number of cpus)')
+    args = parser.parse_args()
+
+    generate_scenario_bank(args.config_file, args.path, args.n_scenarios,
+                           seed=args.seed, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+This file contains the EnvSnapshot class, which stores the mutable state of an EV2Gym episode in
+compact arrays (see EV2Gym.snapshot and EV2Gym.restore).
+
+Everything that does not change during an episode (the EV sessions, prices, power setpoints,
+transformer limits and forecasts, the charging network) is shared with the environment and never
+copied. A snapshot only stores the status variables of the connected EVs, the charging stations,
+the transformers and the simulation core, the counters and random states of the environment and
+the lengths of the append-only lists. The telemetry columns of the steps after the snapshot are
+zero when it is taken, so restore clears them instead of copying them.
+'''
+
+import random
+from typing import NamedTuple
+import numpy as np
+
+# Status variables of the EVs that change while they are connected
+EV_STATUS_FLOAT_FIELDS = ('current_capacity',
+                          'prev_capacity',
+                          'current_energy',
+                          'actual_current',
+                          'previous_power',
+                          'required_energy',
+                          'total_energy_exchanged',
+                          'abs_total_energy_exchanged',
+                          'soc_sum',
+                          'active_soc_mean',
+                          'active_soc_abs_deviation',
+                          'calendar_loss',
+                          'cyclic_loss',
+                          )
+EV_STATUS_INT_FIELDS = ('charging_cycles',
+                        'min_emergency_battery_capacity_metric',
+                        'soc_steps',
+                        'active_soc_steps',
+                        )
+
+# Status variables of the charging stations
+CS_STATUS_FLOAT_FIELDS = ('current_power_output',
+                          'current_total_amps',
+                          'current_charge_price',
+                          'current_discharge_price',
+                          'total_energy_charged',
+                          'total_energy_discharged',
+                          'total_profits',
+                          'total_user_satisfaction',
+                          )
+CS_STATUS_INT_FIELDS = ('n_evs_connected',
+                        'current_step',
+                        'total_evs_served',
+                        )
+
+# Status variables of the transformers
+TRANSFORMER_STATUS_FIELDS = ('current_amps', 'current_power')
+
+# Counters and status variables of the environment, the simulation date is derived from current_step
+ENV_STATUS_FIELDS = ('current_step',
+                     'done',
+                     'stats',
+                     'total_evs_spawned',
+                     'total_reward',
+                     'current_ev_departed',
+                     'current_ev_arrived',
+                     'current_evs_parked',
+                     'current_energy_charged',
+                     'current_energy_discharged',
+                     )
+
+
+class EnvSnapshot(NamedTuple):
+    '''
+    The mutable state of an EV2Gym episode at a step, returned by EV2Gym.snapshot
+    '''
+    sessions: list  # the EV sessions of the episode, to check that the episode was not reset
+    env_status: tuple  # the values of ENV_STATUS_FIELDS
+    n_evs: int  # the number of spawned EVs
+    departing_evs: tuple
+    port_evs: tuple  # the EV connected to every port (global port offset)
+    ev_float: np.ndarray  # (connected EVs, EV_STATUS_FLOAT_FIELDS)
+    ev_int: np.ndarray  # (connected EVs, EV_STATUS_INT_FIELDS)
+    cs_float: np.ndarray  # (n_cs, CS_STATUS_FLOAT_FIELDS)
+    cs_int: np.ndarray  # (n_cs, CS_STATUS_INT_FIELDS + the number of user satisfaction values)
+    cs_signal: np.ndarray  # the current signal of every port
+    tr_status: np.ndarray  # (n_transformers, TRANSFORMER_STATUS_FIELDS + current_step)
+    port_arrivals: np.ndarray  # the number of arrivals of every port, None with lightweight plots
+    random_states: tuple  # the states of np.random, random and env.tr_rng
+    engine: dict
+    power_potential: tuple
+    kpis: dict
+    forecasts: int
+
+
+def take_snapshot(env) -> EnvSnapshot:
+    '''
+    Returns the snapshot of the current state of env
+    '''
+    assert env.telemetry is None, \
+        'Snapshots are not supported when the telemetry is streamed to disk'
+
+    port_evs = tuple(ev for cs in env.charging_stations for ev in cs.evs_connected)
+    evs = [ev for ev in port_evs if ev is not None]
+
+    ev_float = np.array([[getattr(ev, name) for name in EV_STATUS_FLOAT_FIELDS]
+                         for ev in evs], dtype=float)
+    ev_float = ev_float.reshape(len(evs), len(EV_STATUS_FLOAT_FIELDS))
+    ev_int = np.array([[getattr(ev, name) for name in EV_STATUS_INT_FIELDS]
+                       for ev in evs], dtype=np.int64)
+    ev_int = ev_int.reshape(len(evs), len(EV_STATUS_INT_FIELDS))
+
+    cs_float = np.array([[getattr(cs, name) for name in CS_STATUS_FLOAT_FIELDS]
+                         for cs in env.charging_stations], dtype=float)
+    cs_int = np.array([[getattr(cs, name) for name in CS_STATUS_INT_FIELDS]
+                       + [len(cs.all_user_satisfaction)]
+                       for cs in env.charging_stations], dtype=np.int64)
+    cs_signal = np.array([signal for cs in env.charging_stations
+                          for signal in cs.current_signal], dtype=float)
+
+    tr_status = np.array([[getattr(tr, name) for name in TRANSFORMER_STATUS_FIELDS]
+                          + [tr.current_step] for tr in env.transformers], dtype=float)
+
+    port_arrivals = None
+    if not env.lightweight_plots:
+        port_arrivals = np.array([len(arrivals) for arrivals in env.port_arrival.values()],
+                                 dtype=np.int64)
+
+    return EnvSnapshot(sessions=env.EVs_profiles,
+                       env_status=tuple(getattr(env, name) for name in ENV_STATUS_FIELDS),
+                       n_evs=len(env.EVs),
+                       departing_evs=tuple(getattr(env, 'departing_evs', ())),
+                       port_evs=port_evs,
+                       ev_float=ev_float,
+                       ev_int=ev_int,
+                       cs_float=cs_float,
+                       cs_int=cs_int,
+                       cs_signal=cs_signal,
+                       tr_status=tr_status,
+                       port_arrivals=port_arrivals,
+                       random_states=(np.random.get_state(), random.getstate(),
+                                      env.tr_rng.bit_generator.state),
+                       engine=env.engine.get_state() if env.engine is not None else None,
+                       power_potential=env.power_potential.get_state(),
+                       kpis=env.episode_kpis.get_state(),
+                       forecasts=env.transformer_forecasts.get_state(),
+                       )
+
+
+def restore_snapshot(env, snapshot) -> None:
+    '''
+    Restores the state of env saved in snapshot, the snapshot can be restored any number of times
+    '''
+    assert env.telemetry is None, \
+        'Snapshots are not supported when the telemetry is streamed to disk'
+    if snapshot.sessions is not env.EVs_profiles:
+        raise ValueError('The snapshot belongs to another episode')
+
+    for name, value in zip(ENV_STATUS_FIELDS, snapshot.env_status):
+        setattr(env, name, value)
+    step = env.current_step
+
+    # the EVs spawned after the snapshot are dropped
+    del env.EVs[snapshot.n_evs:]
+    env.departing_evs = list(snapshot.departing_evs)
+
+    evs = [ev for ev in snapshot.port_evs if ev is not None]
+    ev_float = snapshot.ev_float.tolist()
+    ev_int = snapshot.ev_int.tolist()
+    for ev, float_values, int_values in zip(evs, ev_float, ev_int):
+        for name, value in zip(EV_STATUS_FLOAT_FIELDS, float_values):
+            setattr(ev, name, value)
+        for name, value in zip(EV_STATUS_INT_FIELDS, int_values):
+            setattr(ev, name, value)
+
+    cs_float = snapshot.cs_float.tolist()
+    cs_int = snapshot.cs_int.tolist()
+    cs_signal = snapshot.cs_signal.tolist()
+    port_evs = snapshot.port_evs
+    offset = 0
+    for cs, float_values, int_values in zip(env.charging_stations, cs_float, cs_int):
+        for name, value in zip(CS_STATUS_FLOAT_FIELDS, float_values):
+            setattr(cs, name, value)
+        for name, value in zip(CS_STATUS_INT_FIELDS, int_values):
+            setattr(cs, name, value)
+        del cs.all_user_satisfaction[int_values[-1]:]
+        cs.evs_connected = list(port_evs[offset:offset + cs.n_ports])
+        cs.current_signal = cs_signal[offset:offset + cs.n_ports]
+        offset += cs.n_ports
+
+    for tr, values in zip(env.transformers, snapshot.tr_status.tolist()):
+        for name, value in zip(TRANSFORMER_STATUS_FIELDS, values):
+            setattr(tr, name, value)
+        tr.current_step = int(values[-1])
+
+    # the telemetry of the steps after the snapshot was not recorded yet
+    env.current_power_usage[step:] = 0
+    env.charge_power_potential[step + 1:] = 0
+    for name in env.telemetry_arrays:
+        getattr(env, name)[:, step:] = 0
+
+    if snapshot.port_arrivals is not None:
+        for arrivals, n in zip(env.port_arrival.values(), snapshot.port_arrivals.tolist()):
+            del arrivals[n:]
+
+    np_state, random_state, tr_rng_state = snapshot.random_states
+    np.random.set_state(np_state)
+    random.setstate(random_state)
+    env.tr_rng.bit_generator.state = tr_rng_state
+
+    if env.engine is not None:
+        env.engine.set_state(snapshot.engine)
+    env.power_potential.set_state(snapshot.power_potential)
+    env.episode_kpis.set_state(snapshot.kpis)
+    env.transformer_forecasts.set_state(snapshot.forecasts)
@@ -0,0 +1,219 @@
+'''
+This file contains the TelemetryRecorder class, which streams the per-step telemetry of an EV2Gym
+episode to disk in chunks, so that the memory used by the telemetry does not grow with the
+simulation length (see the telemetry_path argument of EV2Gym).
+
+An episode is recorded as a directory with one .npy file per telemetry array and a manifest.json
+file. The files store the arrays with the steps first, shape (simulation_length, n), so that every
+chunk is a contiguous block of the file, and open_telemetry returns them transposed as
+memory-mapped arrays with the (n, simulation_length) shape of the telemetry of EV2Gym.
+'''
+
+import os
+import json
+import queue
+import datetime
+import threading
+import numpy as np
+
+TELEMETRY_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+class TelemetryRecorder():
+    '''
+    Streams telemetry arrays of shape (n, simulation_length) to disk chunk by chunk.
+
+    Only the current chunk of every array is kept in memory, as an array of shape (n, chunk_size)
+    whose column step - chunk_start holds the values of a step. When a chunk is complete it is
+    handed to a background thread, which appends it to the files of the episode, and a new
+    zero-filled chunk is attached to the environment. At most max_pending chunks wait for the
+    writer, the simulation blocks when the disk cannot keep up.
+
+    Attributes:
+        - path: the directory of the recorded episode
+        - arrays: the number of rows and the dtype of every telemetry array
+        - simulation_length: the number of steps of the episode
+        - chunk_size: the number of steps per chunk
+
+    Status variables:
+        - buffers: the current chunk of every array
+        - chunk_start: the first step of the current chunk
+        - steps: the number of recorded steps
+        - closed: whether the episode was written completely
+
+    Methods:
+        - column: returns the column of a step in the current chunk
+        - attach: sets the current chunks as attributes of an object (the environment)
+        - record_step: marks the current step as recorded and moves to the next chunk when it is full
+        - close: writes the last chunk and the manifest and waits for the writer
+    '''
+
+    def __init__(self,
+                 path,
+                 arrays,  # {name: (number of rows, dtype)}
+                 simulation_length,
+                 chunk_size=1024,
+                 max_pending=2,  # number of chunks that can wait for the writer
+                 ):
+
+        self.path = path
+        self.arrays = {name: (int(rows), np.dtype(dtype))
+                       for name, (rows, dtype) in arrays.items()}
+        self.simulation_length = simulation_length
+        self.chunk_size = max(1, min(chunk_size, simulation_length))
+        self.max_pending = max_pending
+
+        self.chunk_start = 0
+        self.steps = 0
+        self.closed = False
+
+        self._queue = None
+        self._writer = None
+        self._error = None
+        self._new_chunk()
+
+    def column(self, step) -> int:
+        '''Returns the column of step in the current chunk'''
+        return step - self.chunk_start
+
+    def attach(self, obj) -> None:
+        '''Sets the current chunk of every array as an attribute of obj'''
+        for name, buffer in self.buffers.items():
+            setattr(obj, name, buffer)
+
+    def record_step(self, obj=None) -> None:
+        '''
+        Marks the current step as recorded, when the chunk is full it is submitted to the writer
+        and the new chunk is attached to obj
+        '''
+        self.steps += 1
+        if self.steps - self.chunk_start == self.chunk_size:
+            self._submit()
+            self.chunk_start = self.steps
+            self._new_chunk()
+            if obj is not None:
+                self.attach(obj)
+
+    def close(self, obj=None) -> None:
+        '''
+        Writes the recorded steps of the last chunk and the manifest, and waits for the writer.
+        If obj is given, its telemetry arrays are replaced by the memory-mapped arrays of the episode
+        '''
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.steps > self.chunk_start:
+            self._submit()
+        self.buffers = {}
+
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._queue = None
+            self._writer = None
+        self._raise_writer_error()
+
+        if self.steps == 0:
+            return
+
+        manifest = {'version': TELEMETRY_VERSION,
+                    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'simulation_length': self.simulation_length,
+                    'steps': self.steps,
+                    'chunk_size': self.chunk_size,
+                    'arrays': {name: {'file': f'{name}.npy',
+                                      'rows': rows,
+                                      'dtype': dtype.str}
+                               for name, (rows, dtype) in self.arrays.items()},
+                    }
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        if obj is not None:
+            for name, array in open_telemetry(self.path).items():
+                setattr(obj, name, array)
+
+    def _new_chunk(self) -> None:
+        '''Allocates the zero-filled chunk of every array'''
+        self.buffers = {name: np.zeros([rows, self.chunk_size], dtype=dtype)
+                        for name, (rows, dtype) in self.arrays.items()}
+
+    def _submit(self) -> None:
+        '''Hands the recorded steps of the current chunk to the writer'''
+        self._raise_writer_error()
+        if self._writer is None:
+            self._start_writer()
+        self._queue.put((self.chunk_start, self.steps - self.chunk_start, self.buffers))
+
+    def _start_writer(self) -> None:
+        '''Preallocates the files of the episode and starts the writer thread'''
+        os.makedirs(self.path, exist_ok=True)
+
+        offsets = {}
+        for name, (rows, dtype) in self.arrays.items():
+            array = np.lib.format.open_memmap(os.path.join(self.path, f'{name}.npy'),
+                                              mode='w+', dtype=dtype,
+                                              shape=(self.simulation_length, rows))
+            offsets[name] = array.offset
+            del array
+
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._writer = threading.Thread(target=self._write_chunks,
+                                        args=(offsets,), daemon=True)
+        self._writer.start()
+
+    def _write_chunks(self, offsets) -> None:
+        '''Writer thread, appends the submitted chunks to the files of the episode'''
+        files = {name: open(os.path.join(self.path, f'{name}.npy'), 'r+b')
+                 for name in self.arrays}
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._error is not None:
+                    # keep consuming so that the simulation does not block
+                    continue
+                start, n_steps, buffers = item
+                try:
+                    for name, buffer in buffers.items():
+                        rows, dtype = self.arrays[name]
+                        f = files[name]
+                        f.seek(offsets[name] + start * rows * dtype.itemsize)
+                        f.write(np.ascontiguousarray(buffer[:, :n_steps].T).tobytes())
+                        f.flush()
+                except Exception as e:
+                    self._error = e
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _raise_writer_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f'Writing the telemetry at {self.path} failed') from self._error
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the writer thread and its queue belong to the original recorder
+        state['_queue'] = None
+        state['_writer'] = None
+        return state
+
+
+def open_telemetry(path) -> dict:
+    '''
+    Opens the telemetry of an episode recorded at path
+    Returns:
+        - a dict with the memory-mapped telemetry arrays, shape (n, simulation_length)
+    '''
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != TELEMETRY_VERSION:
+        raise ValueError(f'The telemetry at {path} has version {manifest.get("version")}' +
+                         f' instead of {TELEMETRY_VERSION}')
+
+    return {name: np.load(os.path.join(path, array['file']), mmap_mode='r').T
+            for name, array in manifest['arrays'].items()}
@@ -0,0 +1,64 @@
+'''
+This file contains the EpisodeTimeline class, which holds the calendar of every step of an EV2Gym
+episode as integer arrays (see EV2Gym.timeline).
+
+The timeline is computed once when the starting date of an episode is set. The spawners, the
+electricity price loader, the transformers, the observation builders and the plots read the
+weekday, hour or minute of a step from its arrays instead of stepping datetime objects, and
+EV2Gym.sim_date is derived from it only when it is read.
+'''
+
+import datetime
+import numpy as np
+
+
+class EpisodeTimeline():
+    '''
+    The calendar of the steps 0 to simulation_length of an episode (the last one is the end of
+    the episode), with a resolution of one minute.
+
+    Attributes:
+        - start_date: the date of step 0
+        - timescale: the number of minutes per step
+        - simulation_length: the number of steps of the episode
+        - minutes_since_epoch: the minutes since 1970-01-01 00:00 of every step
+        - hours_since_epoch: the hours since 1970-01-01 00:00 of every step
+        - weekday: the day of the week of every step (0 is Monday)
+        - hour: the hour of every step
+        - minute: the minute of every step
+        - slot: the 15-minute slot of the day of every step (0-95), the resolution of the arrival rates
+
+    Methods:
+        - date: returns the datetime of a step
+        - datetimes: returns the datetime64 of every step
+    '''
+
+    def __init__(self,
+                 start_date,  # datetime of step 0
+                 timescale,  # minutes per step
+                 simulation_length,
+                 ):
+
+        self.start_date = start_date
+        self.timescale = timescale
+        self.simulation_length = simulation_length
+
+        start = np.datetime64(start_date, 'm').astype(np.int64)
+        self.minutes_since_epoch = start + \
+            np.arange(simulation_length + 1, dtype=np.int64) * timescale
+        self.hours_since_epoch = self.minutes_since_epoch // 60
+        days = self.minutes_since_epoch // (24*60)
+
+        # 1970-01-01 was a Thursday
+        self.weekday = (days + 3) % 7
+        self.hour = self.hours_since_epoch % 24
+        self.minute = self.minutes_since_epoch % 60
+        self.slot = self.hour*4 + self.minute//15
+
+    def date(self, step) -> datetime.datetime:
+        '''Returns the datetime of step'''
+        return self.start_date + datetime.timedelta(minutes=self.timescale * int(step))
+
+    def datetimes(self) -> np.ndarray:
+        '''Returns the datetime64 of every step'''
+        return self.minutes_since_epoch.astype('datetime64[m]')
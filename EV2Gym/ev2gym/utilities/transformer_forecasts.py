@@ -0,0 +1,161 @@
+'''
+This file contains the TransformerForecasts class, which precomputes the power limit, load and PV
+forecasts of all transformers of an episode (see get_power_limits and get_load_pv_forecast in
+ev2gym/models/transformer.py).
+'''
+
+import numpy as np
+
+
+class TransformerForecasts():
+    '''
+    Per-episode forecast matrices of all transformers, built once at reset so that the forecasts
+    of the next horizon steps are sliding-window views of the matrices instead of new arrays.
+
+    The load and PV forecasts are matrices of shape (n_transformers, T + max_horizon), padded
+    with zeros. As in get_load_pv_forecast, the first value of a forecast window is the realised
+    value of the step, which is written to the matrices when the step is queried.
+
+    The power limits known at a step depend on the demand response events announced so far
+    (steps_ahead steps before they start). The limits are therefore stored once per announcement
+    state, with shape (n_transformers, n_events + 1, T + max_horizon), and a query only selects
+    the row of the events announced up to the queried step.
+
+    Attributes:
+        - n_transformers: the number of transformers
+        - simulation_length: the number of steps of the episode
+        - max_horizon: the longest horizon that can be queried from the matrices
+
+    Status variables:
+        - load_forecast, pv_forecast: the load and PV forecast matrices in kW
+        - power_limits_by_state: the known power limits of every announcement state in kW
+        - announce_steps: the (sorted) announcement steps of the events of every transformer
+
+    Methods:
+        - get_power_limits: returns the known power limits of the next horizon steps
+        - get_load_pv_forecast: returns the load and PV forecasts of the next horizon steps
+        - get_state/set_state: save and restore the realised steps (see EV2Gym.snapshot)
+    '''
+
+    def __init__(self,
+                 transformers,
+                 simulation_length,
+                 max_horizon=None,  # defaults to the simulation length
+                 ):
+
+        self.transformers = transformers
+        self.n_transformers = len(transformers)
+        self.simulation_length = simulation_length
+        self.max_horizon = simulation_length if max_horizon is None else max_horizon
+        width = simulation_length + self.max_horizon
+
+        self.load_forecast = np.zeros((self.n_transformers, width))
+        self.pv_forecast = np.zeros((self.n_transformers, width))
+        self.inflexible_load = np.zeros((self.n_transformers, simulation_length))
+        self.solar_power = np.zeros((self.n_transformers, simulation_length))
+
+        for i, tr in enumerate(transformers):
+            self.load_forecast[i, :simulation_length] = \
+                tr.inflexible_load_forecast[:simulation_length]
+            self.pv_forecast[i, :simulation_length] = \
+                tr.pv_generation_forecast[:simulation_length]
+            self.inflexible_load[i] = tr.inflexible_load[:simulation_length]
+            self.solar_power[i] = tr.solar_power[:simulation_length]
+
+        n_states = 1 + max([len(tr.dr_events) for tr in transformers], default=0)
+        self.power_limits_by_state = np.zeros((self.n_transformers, n_states, width))
+        # transformers with fewer events are padded with events that are never announced
+        self.announce_steps = np.full((self.n_transformers, n_states - 1),
+                                      np.iinfo(np.int64).max, dtype=np.int64)
+
+        for i, tr in enumerate(transformers):
+            power_limit = max(tr.max_power)
+            limits = power_limit * np.ones(width)
+            self.power_limits_by_state[i, :] = limits
+
+            announce = [event['event_start_step'] - tr.steps_ahead
+                        for event in tr.dr_events]
+            order = np.argsort(announce, kind='stable')
+            self.announce_steps[i, :len(order)] = np.asarray(announce,
+                                                             dtype=np.int64)[order]
+
+            # state k knows the first k announced events, overlapping events are applied in
+            # event order so that the latest event wins as in get_power_limits
+            known = np.zeros(len(tr.dr_events), dtype=bool)
+            for k, event_index in enumerate(order):
+                known[event_index] = True
+                limits = power_limit * np.ones(width)
+                for event, is_known in zip(tr.dr_events, known):
+                    if not is_known:
+                        continue
+                    start = max(event['event_start_step'], 0)
+                    end = min(event['event_end_step'], width)
+                    if end > start:
+                        limits[start:end] = power_limit - \
+                            power_limit * event['capacity_percentage'] / 100
+                self.power_limits_by_state[i, k + 1:] = limits
+
+        self._rows = np.arange(self.n_transformers)
+        self.realised_step = -1
+
+    def _state(self, step):
+        '''Returns the announcement state of every transformer at step'''
+        return (self.announce_steps <= step).sum(axis=1)
+
+    def _realise(self, step) -> None:
+        '''Writes the realised loads and PV of step to the forecast matrices'''
+        if step != self.realised_step and 0 <= step < self.simulation_length:
+            self.load_forecast[:, step] = self.inflexible_load[:, step]
+            self.pv_forecast[:, step] = self.solar_power[:, step]
+            self.realised_step = step
+
+    def get_state(self) -> int:
+        '''Returns the last realised step'''
+        return self.realised_step
+
+    def set_state(self, realised_step) -> None:
+        '''Restores the forecasts of the steps realised after realised_step'''
+        if self.realised_step > realised_step:
+            start = max(realised_step + 1, 0)
+            end = self.realised_step + 1
+            for i, tr in enumerate(self.transformers):
+                self.load_forecast[i, start:end] = tr.inflexible_load_forecast[start:end]
+                self.pv_forecast[i, start:end] = tr.pv_generation_forecast[start:end]
+        self.realised_step = realised_step
+
+    def get_power_limits(self, step, horizon, tr_index=None) -> np.ndarray:
+        '''
+        Returns the power limits known at step for the next horizon steps,
+        with shape (n_transformers, horizon), or (horizon,) for transformer tr_index
+        '''
+        if step + horizon > self.power_limits_by_state.shape[2]:
+            if tr_index is not None:
+                return self.transformers[tr_index].get_power_limits(step, horizon)
+            return np.array([tr.get_power_limits(step, horizon)
+                             for tr in self.transformers]).reshape(self.n_transformers, horizon)
+
+        state = self._state(step)
+        if tr_index is not None:
+            return self.power_limits_by_state[tr_index, state[tr_index], step:step+horizon]
+        return self.power_limits_by_state[self._rows, state, step:step+horizon]
+
+    def get_load_pv_forecast(self, step, horizon, tr_index=None):
+        '''
+        Returns views of the load and PV forecasts of the next horizon steps,
+        with shape (n_transformers, horizon), or (horizon,) for transformer tr_index
+        '''
+        self._realise(step)
+
+        if step + horizon > self.load_forecast.shape[1]:
+            loads = np.zeros((self.n_transformers, horizon))
+            pv = np.zeros((self.n_transformers, horizon))
+            window = self.load_forecast[:, step:step+horizon]
+            loads[:, :window.shape[1]] = window
+            pv[:, :window.shape[1]] = self.pv_forecast[:, step:step+horizon]
+        else:
+            loads = self.load_forecast[:, step:step+horizon]
+            pv = self.pv_forecast[:, step:step+horizon]
+
+        if tr_index is not None:
+            return loads[tr_index], pv[tr_index]
+        return loads, pv
@@ -1,66 +1,84 @@
 # This file contains support functions for the EV City environment.
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 import math
 import datetime
 from typing import List, Dict
 
-from ev2gym.models.ev import EV
+from ev2gym.models.ev import EVSession, battery_degradation_batch
 
 
 def get_statistics(env) -> Dict:
-    total_ev_served = np.array(
-        [cs.total_evs_served for cs in env.charging_stations]).sum()
-    total_profits = np.array(
-        [cs.total_profits for cs in env.charging_stations]).sum()
-    total_energy_charged = np.array(
-        [cs.total_energy_charged for cs in env.charging_stations]).sum()
-    total_energy_discharged = np.array(
-        [cs.total_energy_discharged for cs in env.charging_stations]).sum()
-    average_user_satisfaction = np.array(
-        [cs.get_avg_user_satisfaction() for cs in env.charging_stations
-         if cs.total_evs_served > 0]).mean()
+    '''
+    Returns the final statistics of the simulation, computed with vectorized reductions
+    (the running KPIs of an episode are available in env.kpis)
+    '''
+    cs_totals = np.array([(cs.total_evs_served,
+                           cs.total_profits,
+                           cs.total_energy_charged,
+                           cs.total_energy_discharged,
+                           cs.total_user_satisfaction)
+                          for cs in env.charging_stations], dtype=float).reshape(-1, 5)
+    cs_evs_served = cs_totals[:, 0]
+    total_ev_served = cs_evs_served.sum().astype(int)
+    total_profits = cs_totals[:, 1].sum()
+    total_energy_charged = cs_totals[:, 2].sum()
+    total_energy_discharged = cs_totals[:, 3].sum()
+    served = cs_evs_served > 0
+    average_user_satisfaction = np.mean(cs_totals[served, 4] /
+                                        cs_evs_served[served])
 
     # get transformer overload from env.tr_overload
     total_transformer_overload = np.array(env.tr_overload).sum()
 
-    tracking_error = 0
-    energy_tracking_error = 0
-    power_tracker_violation = 0
-    for t in range(env.simulation_length):
-        # tracking_error += (min(env.power_setpoints[t], env.charge_power_potential[t]) -
-        #                    env.current_power_usage[t])**2
-        # energy_tracking_error += abs(min(env.power_setpoints[t], env.charge_power_potential[t]) -
-        #                              env.current_power_usage[t])
-
-        tracking_error += (env.power_setpoints[t] -
-                           env.current_power_usage[t])**2
-        energy_tracking_error += abs(env.power_setpoints[t] -
-                                     env.current_power_usage[t])
-
-        if env.current_power_usage[t] > env.power_setpoints[t]:
-            power_tracker_violation += env.current_power_usage[t] - \
-                env.power_setpoints[t]
-
-    energy_tracking_error *= env.timescale / 60
+    error = env.power_setpoints[:env.simulation_length] - \
+        env.current_power_usage[:env.simulation_length]
+    tracking_error = np.sum(error**2)
+    energy_tracking_error = np.sum(np.abs(error)) * env.timescale / 60
+    power_tracker_violation = -np.sum(error[error < 0])
 
     # calculate total batery degradation
-    battery_degradation = np.array(
-        [np.array(ev.get_battery_degradation()).reshape(-1) for ev in env.EVs])
-    if len(battery_degradation) == 0:
-        battery_degradation = np.zeros((1, 2))
-    battery_degradation_calendar = battery_degradation[:, 0].sum()
-    battery_degradation_cycling = battery_degradation[:, 1].sum()
-    battery_degradation = battery_degradation.sum()
-
-    total_steps_min_emergency_battery_capacity_violation = 0
-    energy_user_satisfaction = np.zeros((len(env.EVs)))
-    for i, ev in enumerate(env.EVs):
-        e_actual = ev.current_capacity
-        e_max = ev.max_energy_AFAP
-        energy_user_satisfaction[i] = (e_actual / e_max) * 100
-        total_steps_min_emergency_battery_capacity_violation += ev.min_emergency_battery_capacity_metric
+    evs = env.EVs
+    if len(evs) > 0:
+        ev_values = np.array([(ev.time_of_arrival,
+                               ev.time_of_departure,
+                               ev.timescale,
+                               ev.current_capacity,
+                               ev.battery_capacity,
+                               ev.soc_sum,
+                               ev.soc_steps,
+                               ev.active_soc_steps,
+                               ev.active_soc_mean,
+                               ev.active_soc_abs_deviation,
+                               ev.abs_total_energy_exchanged,
+                               ev.max_energy_AFAP,
+                               ev.min_emergency_battery_capacity_metric)
+                              for ev in evs], dtype=float)
+        current_capacity = ev_values[:, 3]
+        d_cal, d_cyc = battery_degradation_batch(time_of_arrival=ev_values[:, 0],
+                                                 time_of_departure=ev_values[:, 1],
+                                                 timescale=ev_values[:, 2],
+                                                 final_soc=current_capacity /
+                                                 ev_values[:, 4],
+                                                 soc_sum=ev_values[:, 5],
+                                                 soc_steps=ev_values[:, 6],
+                                                 active_soc_steps=ev_values[:, 7],
+                                                 active_soc_mean=ev_values[:, 8],
+                                                 active_soc_abs_deviation=ev_values[:, 9],
+                                                 abs_total_energy_exchanged=ev_values[:, 10])
+        energy_user_satisfaction = current_capacity / ev_values[:, 11] * 100
+        total_steps_min_emergency_battery_capacity_violation = int(
+            ev_values[:, 12].sum())
+    else:
+        d_cal = d_cyc = np.zeros(1)
+        energy_user_satisfaction = np.zeros(0)
+        total_steps_min_emergency_battery_capacity_violation = 0
+
+    battery_degradation_calendar = d_cal.sum()
+    battery_degradation_cycling = d_cyc.sum()
+    battery_degradation = battery_degradation_calendar + battery_degradation_cycling
 
     stats = {'total_ev_served': total_ev_served,
              'total_profits': total_profits,
@@ -152,9 +170,9 @@ def spawn_single_EV(env,
                     minute,
                     step,
                     min_time_of_stay_steps
-                    ) -> EV:
+                    ) -> EVSession:
     '''
-    This function spawns a single EV and returns it
+    This function spawns a single EV and returns its EVSession record
     '''
 
     # required energy independent of time of arrival
@@ -170,9 +188,8 @@ def spawn_single_EV(env,
     # required energy dependent on time of arrival
     arrival_time = f'{hour:02d}:{minute:02d}'
 
-    required_energy_mean = env.df_req_energy[
-        (env.df_req_energy['Arrival Time'] == arrival_time)
-    ][scenario].values[0]
+    required_energy_mean = env.df_req_energy[scenario][
+        env.df_req_energy['Arrival Time'] == arrival_time][0]
 
     required_energy = np.random.normal(
         required_energy_mean, 0.5*required_energy_mean)  # kWh
@@ -181,9 +198,8 @@ def spawn_single_EV(env,
         required_energy = np.random.randint(5, 10)
 
     if env.heterogeneous_specs:
-        sampled_ev = np.random.choice(
-            list(env.ev_specs.keys()), p=env.normalized_ev_registrations)
-        battery_capacity = env.ev_specs[sampled_ev]["battery_capacity"]
+        sampled_ev = env.ev_catalog.sample()
+        battery_capacity = env.ev_catalog.battery_capacity[sampled_ev]
     else:
         battery_capacity = env.config["ev"]["battery_capacity"]
 
@@ -199,9 +215,8 @@ def spawn_single_EV(env,
         initial_battery_capacity = env.config["ev"]['min_battery_capacity']
 
     # time of stay dependent on time of arrival
-    time_of_stay_mean = env.df_time_of_stay_vs_arrival[(
-        env.df_time_of_stay_vs_arrival['Arrival Time'] == arrival_time)
-    ][scenario].values[0]
+    time_of_stay_mean = env.df_time_of_stay_vs_arrival[scenario][
+        env.df_time_of_stay_vs_arrival['Arrival Time'] == arrival_time][0]
 
     time_of_stay = np.random.normal(
         time_of_stay_mean, 0.2*time_of_stay_mean)  # hours
@@ -238,26 +253,10 @@ def spawn_single_EV(env,
 
     if env.heterogeneous_specs:
 
-        # get charge efficiency from env.ev_specs dict
-        # if there is key charge_efficiency_v
-        if "3ph_ch_efficiency" in env.ev_specs[sampled_ev]:
-            charge_efficiency_v = env.ev_specs[sampled_ev]["3ph_ch_efficiency"]
-            current_levels = env.ev_specs[sampled_ev]["ch_current"]
-            assert len(charge_efficiency_v) == len(current_levels)
-            assert all([0 <= x <= 100 for x in charge_efficiency_v])
-
-            # make a dict with charge leves kay and charge efficiency value
-            charge_efficiency = dict(zip(current_levels, charge_efficiency_v))
-
-            for i in range(0, 101):
-                if i not in charge_efficiency or charge_efficiency[i] == 0:
-                    nonzero_keys = [
-                        k for k, v in charge_efficiency.items() if v != 0]
-                    if nonzero_keys:
-                        closest = min(nonzero_keys, key=lambda x: abs(x - i))
-                        charge_efficiency[i] = charge_efficiency[closest]
-
-            discharge_efficiency = charge_efficiency.copy()
+        if env.ev_catalog.has_efficiency_curve[sampled_ev]:
+            # the efficiency curve of the model is shared by all its EVs
+            charge_efficiency = env.ev_catalog.efficiency[sampled_ev]
+            discharge_efficiency = charge_efficiency
 
         else:
             charge_efficiency = np.round(1 -
@@ -265,52 +264,53 @@ def spawn_single_EV(env,
             discharge_efficiency = np.round(1 -
                                             (np.random.rand()+0.00001)/20, 3)  # [0.95-1]
 
-        return EV(id=port,
-                  location=cs_id,
-                  battery_capacity_at_arrival=initial_battery_capacity,
-                  max_ac_charge_power=env.ev_specs[sampled_ev]["max_ac_charge_power"],
-                  max_dc_charge_power=env.ev_specs[sampled_ev]["max_dc_charge_power"],
-                  max_discharge_power=-
-                  env.ev_specs[sampled_ev]["max_dc_discharge_power"],
-                  min_emergency_battery_capacity=min_emergency_battery_capacity,
-                  charge_efficiency=charge_efficiency,
-                  discharge_efficiency=discharge_efficiency,
-
-                  transition_soc=np.round(0.9 -
-                                          (np.random.rand()+0.00001)/5, 3),  # [0.7-0.9]
-                  transition_soc_multiplier=transition_soc_multiplier,
-                  battery_capacity=battery_capacity,
-                  desired_capacity=env.config["ev"]['desired_capacity'] *
-                  battery_capacity,
-                  time_of_arrival=step+1,
-                  time_of_departure=int(
-                      time_of_stay + step + 3),
-                  ev_phases=3,
-                  timescale=env.timescale,
-                  )
+        return EVSession(id=port,
+                         location=cs_id,
+                         battery_capacity_at_arrival=initial_battery_capacity,
+                         max_ac_charge_power=env.ev_catalog.max_ac_charge_power[sampled_ev],
+                         max_dc_charge_power=env.ev_catalog.max_dc_charge_power[sampled_ev],
+                         max_discharge_power=-
+                         env.ev_catalog.max_dc_discharge_power[sampled_ev],
+                         ev_model=sampled_ev,
+                         min_emergency_battery_capacity=min_emergency_battery_capacity,
+                         charge_efficiency=charge_efficiency,
+                         discharge_efficiency=discharge_efficiency,
+
+                         transition_soc=np.round(0.9 -
+                                                 (np.random.rand()+0.00001)/5, 3),  # [0.7-0.9]
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         battery_capacity=battery_capacity,
+                         desired_capacity=env.config["ev"]['desired_capacity'] *
+                         battery_capacity,
+                         time_of_arrival=step+1,
+                         time_of_departure=int(
+                             time_of_stay + step + 3),
+                         ev_phases=3,
+                         timescale=env.timescale,
+                         )
     else:
-        return EV(id=port,
-                  location=cs_id,
-                  battery_capacity_at_arrival=initial_battery_capacity,
-                  battery_capacity=battery_capacity,
-                  desired_capacity=env.config["ev"]['desired_capacity'] *
-                  battery_capacity,
-                  min_emergency_battery_capacity=min_emergency_battery_capacity,
-                  max_ac_charge_power=env.config["ev"]['max_ac_charge_power'],
-                  min_ac_charge_power=env.config["ev"]['min_ac_charge_power'],
-                  max_dc_charge_power=env.config["ev"]['max_dc_charge_power'],
-                  max_discharge_power=env.config["ev"]['max_discharge_power'],
-                  min_discharge_power=env.config["ev"]['min_discharge_power'],
-                  time_of_arrival=step+1,
-                  time_of_departure=int(
-                      time_of_stay + step + 3),
-                  ev_phases=env.config["ev"]['ev_phases'],
-                  transition_soc=env.config["ev"]['transition_soc'],
-                  transition_soc_multiplier=transition_soc_multiplier,
-                  charge_efficiency=env.config["ev"]['charge_efficiency'],
-                  discharge_efficiency=env.config["ev"]['discharge_efficiency'],
-                  timescale=env.timescale,
-                  )
+        return EVSession(id=port,
+                         location=cs_id,
+                         battery_capacity_at_arrival=initial_battery_capacity,
+                         battery_capacity=battery_capacity,
+                         desired_capacity=env.config["ev"]['desired_capacity'] *
+                         battery_capacity,
+                         min_emergency_battery_capacity=min_emergency_battery_capacity,
+                         max_ac_charge_power=env.config["ev"]['max_ac_charge_power'],
+                         min_ac_charge_power=env.config["ev"]['min_ac_charge_power'],
+                         max_dc_charge_power=env.config["ev"]['max_dc_charge_power'],
+                         max_discharge_power=env.config["ev"]['max_discharge_power'],
+                         min_discharge_power=env.config["ev"]['min_discharge_power'],
+                         time_of_arrival=step+1,
+                         time_of_departure=int(
+                             time_of_stay + step + 3),
+                         ev_phases=env.config["ev"]['ev_phases'],
+                         transition_soc=env.config["ev"]['transition_soc'],
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         charge_efficiency=env.config["ev"]['charge_efficiency'],
+                         discharge_efficiency=env.config["ev"]['discharge_efficiency'],
+                         timescale=env.timescale,
+                         )
 
 
 def spawn_single_EV_GF(env,
@@ -321,9 +321,9 @@ def spawn_single_EV_GF(env,
                        minute,
                        step,
                        min_time_of_stay_steps
-                       ) -> EV:
+                       ) -> EVSession:
     '''
-    This function spawns a single EV and returns it
+    This function spawns a single EV and returns its EVSession record
     '''
 
     # round minute to 30 or 0
@@ -356,9 +356,8 @@ def spawn_single_EV_GF(env,
         required_energy = np.random.randint(5, 10)
 
     if env.heterogeneous_specs:
-        sampled_ev = np.random.choice(
-            list(env.ev_specs.keys()), p=env.normalized_ev_registrations)
-        battery_capacity = env.ev_specs[sampled_ev]["battery_capacity"]
+        sampled_ev = env.ev_catalog.sample()
+        battery_capacity = env.ev_catalog.battery_capacity[sampled_ev]
     else:
         battery_capacity = env.config["ev"]["battery_capacity"]
 
@@ -395,57 +394,341 @@ def spawn_single_EV_GF(env,
         transition_soc_multiplier = 1
 
     if env.heterogeneous_specs:
-        return EV(id=port,
-                  location=cs_id,
-                  battery_capacity_at_arrival=initial_battery_capacity,
-                  max_ac_charge_power=env.ev_specs[sampled_ev]["max_ac_charge_power"],
-                  max_dc_charge_power=env.ev_specs[sampled_ev]["max_dc_charge_power"],
-                  max_discharge_power=-
-                  env.ev_specs[sampled_ev]["max_dc_discharge_power"],
-                  discharge_efficiency=np.round(1 -
-                                                (np.random.rand()+0.00001)/20, 3),  # [0.95-1]
-                  transition_soc=np.round(0.9 -
-                                          (np.random.rand()+0.00001)/5, 3),  # [0.7-0.9]
-                  transition_soc_multiplier=transition_soc_multiplier,
-                  battery_capacity=battery_capacity,
-                  desired_capacity=env.config["ev"]['desired_capacity'] *
-                  battery_capacity,
-                  time_of_arrival=step+1,
-                  time_of_departure=int(
-                      time_of_stay + step + 3),
-                  ev_phases=3,
-                  timescale=env.timescale,
-                  )
+        return EVSession(id=port,
+                         location=cs_id,
+                         battery_capacity_at_arrival=initial_battery_capacity,
+                         max_ac_charge_power=env.ev_catalog.max_ac_charge_power[sampled_ev],
+                         max_dc_charge_power=env.ev_catalog.max_dc_charge_power[sampled_ev],
+                         max_discharge_power=-
+                         env.ev_catalog.max_dc_discharge_power[sampled_ev],
+                         ev_model=sampled_ev,
+                         discharge_efficiency=np.round(1 -
+                                                       (np.random.rand()+0.00001)/20, 3),  # [0.95-1]
+                         transition_soc=np.round(0.9 -
+                                                 (np.random.rand()+0.00001)/5, 3),  # [0.7-0.9]
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         battery_capacity=battery_capacity,
+                         desired_capacity=env.config["ev"]['desired_capacity'] *
+                         battery_capacity,
+                         time_of_arrival=step+1,
+                         time_of_departure=int(
+                             time_of_stay + step + 3),
+                         ev_phases=3,
+                         timescale=env.timescale,
+                         )
     else:
-        return EV(id=port,
-                  location=cs_id,
-                  battery_capacity_at_arrival=initial_battery_capacity,
-                  battery_capacity=battery_capacity,
-                  desired_capacity=env.config["ev"]['desired_capacity'] *
-                  battery_capacity,
-                  max_ac_charge_power=env.config["ev"]['max_ac_charge_power'],
-                  min_ac_charge_power=env.config["ev"]['min_ac_charge_power'],
-                  max_dc_charge_power=env.config["ev"]['max_dc_charge_power'],
-                  max_discharge_power=env.config["ev"]['max_discharge_power'],
-                  min_discharge_power=env.config["ev"]['min_discharge_power'],
-                  time_of_arrival=step+1,
-                  time_of_departure=int(
-                      time_of_stay + step + 3),
-                  ev_phases=env.config["ev"]['ev_phases'],
-                  transition_soc=env.config["ev"]['transition_soc'],
-                  transition_soc_multiplier=transition_soc_multiplier,
-                  charge_efficiency=env.config["ev"]['charge_efficiency'],
-                  discharge_efficiency=env.config["ev"]['discharge_efficiency'],
-                  timescale=env.timescale,
-                  )
-
-
-def EV_spawner(env) -> List[EV]:
+        return EVSession(id=port,
+                         location=cs_id,
+                         battery_capacity_at_arrival=initial_battery_capacity,
+                         battery_capacity=battery_capacity,
+                         desired_capacity=env.config["ev"]['desired_capacity'] *
+                         battery_capacity,
+                         max_ac_charge_power=env.config["ev"]['max_ac_charge_power'],
+                         min_ac_charge_power=env.config["ev"]['min_ac_charge_power'],
+                         max_dc_charge_power=env.config["ev"]['max_dc_charge_power'],
+                         max_discharge_power=env.config["ev"]['max_discharge_power'],
+                         min_discharge_power=env.config["ev"]['min_discharge_power'],
+                         time_of_arrival=step+1,
+                         time_of_departure=int(
+                             time_of_stay + step + 3),
+                         ev_phases=env.config["ev"]['ev_phases'],
+                         transition_soc=env.config["ev"]['transition_soc'],
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         charge_efficiency=env.config["ev"]['charge_efficiency'],
+                         discharge_efficiency=env.config["ev"]['discharge_efficiency'],
+                         timescale=env.timescale,
+                         )
+
+
+def EV_spawner(env) -> List[EVSession]:
     '''
     This function spawns all the EVs of the current simulation and returns the list of EVs
+    sorted by time of arrival.
+
+    It is the vectorized version of EV_spawner_sequential: the arrivals of all ports and steps
+    are sampled at once from the per-step arrival rates, and the EVs are spawned in rounds
+    (the next arrival of every free port per round), drawing the energy demand and time of stay
+    of all the EVs of a round in one batch. The EVs follow the same distributions as in
+    EV_spawner_sequential, but the random numbers are drawn in a different order.
+
+    Returns:
+        EVs: list of the EVSession records of the EVs
+    '''
+
+    simulation_length = env.simulation_length
+    arrival_probabilities = np.random.rand(env.number_of_ports,
+                                           simulation_length)
+
+    scenario = env.scenario
+    user_spawn_multiplier = env.config["spawn_multiplier"]
+
+    # Define minimum time of stay duration so that an EV can fully charge
+    min_time_of_stay = env.config['ev']["min_time_of_stay"]
+    min_time_of_stay_steps = min_time_of_stay // env.timescale
+
+    if env.simulation_length-min_time_of_stay_steps-1 < 0:
+        raise ValueError(
+            "Simulation length is too short for the minimum time of stay! Increase the simulation length or decrease the minimum time of stay.")
+
+    steps = np.arange(2, simulation_length-min_time_of_stay_steps-1)
+    if len(steps) == 0:
+        return []
+
+    # the arrival rate of step t is the one of the timeline step t-2
+    timeline = env.timeline
+    weekday = timeline.weekday[steps - 2]
+    hour = timeline.hour[steps - 2]
+    minute = timeline.minute[steps - 2]
+    # the spawn rate is in 15 minute intervals (in the csv file)
+    slot = timeline.slot[steps - 2]
+
+    if scenario == "workplace":
+        # no arrivals in weekends and outside working hours
+        valid_steps = (weekday < 5) & (hour >= 6) & (hour <= 18)
+        tau = np.where(valid_steps,
+                       env.df_arrival_week[scenario][slot],
+                       0)
+    else:
+        valid_steps = np.ones(len(steps), dtype=bool)
+        tau = np.where(weekday < 5,
+                       env.df_arrival_week[scenario][slot],
+                       env.df_arrival_weekend[scenario][slot])
+    multiplier = 1
+
+    arrivals = np.zeros((env.number_of_ports, simulation_length + 1),
+                        dtype=bool)
+    arrivals[:, steps] = valid_steps & \
+        (arrival_probabilities[:, steps]*100 < tau * multiplier * (env.timescale/60) * user_spawn_multiplier)
+
+    # next_arrival[port, t] is the first step >= t with an arrival at port (simulation_length if none)
+    next_arrival = np.where(arrivals,
+                            np.arange(simulation_length + 1),
+                            simulation_length)
+    next_arrival = np.minimum.accumulate(next_arrival[:, ::-1], axis=1)[:, ::-1]
+
+    port_cs = np.concatenate([[cs.id] * cs.n_ports
+                              for cs in env.charging_stations]).astype(int)
+    port_number = np.concatenate([np.arange(cs.n_ports)
+                                  for cs in env.charging_stations])
+
+    sessions = []
+    # first step at which every port can receive an EV
+    next_free = np.full(env.number_of_ports, 2)
+    ports = np.arange(env.number_of_ports)
+
+    while len(ports) > 0:
+        arrival_steps = next_arrival[ports,
+                                     np.minimum(next_free[ports], simulation_length)]
+        ports = ports[arrival_steps < simulation_length]
+        arrival_steps = arrival_steps[arrival_steps < simulation_length]
+        if len(ports) == 0:
+            break
+
+        batch = sample_EV_sessions(env,
+                                   scenario=scenario,
+                                   hour=hour[arrival_steps - 2],
+                                   minute=minute[arrival_steps - 2],
+                                   step=arrival_steps,
+                                   min_time_of_stay_steps=min_time_of_stay_steps)
+        batch['location'] = port_cs[ports]
+        batch['port'] = port_number[ports]
+        sessions.append(batch)
+
+        # the port must be empty in the two steps before the next arrival
+        next_free[ports] = np.where(batch['spawned'],
+                                    np.maximum(
+                                        batch['time_of_departure'] + 2, arrival_steps + 1),
+                                    arrival_steps + 1)
+
+    if len(sessions) == 0:
+        return []
+
+    sessions = {key: np.concatenate([batch[key] for batch in sessions])
+                for key in sessions[0]}
+
+    spawned = np.flatnonzero(sessions['spawned'])
+    # sort by time of arrival and port, as the EVs are spawned in this order
+    order = spawned[np.lexsort((sessions['port'][spawned],
+                                sessions['location'][spawned],
+                                sessions['time_of_arrival'][spawned]))]
+
+    return [make_EV(env, sessions, i) for i in order]
+
+
+def sample_EV_sessions(env,
+                       scenario,
+                       hour,
+                       minute,
+                       step,
+                       min_time_of_stay_steps
+                       ) -> Dict:
+    '''
+    This function samples a batch of EV sessions arriving at the given steps.
+    It is the batch version of spawn_single_EV.
+
+    Returns:
+        sessions: a dict of arrays with the parameters of every session, spawned is False for the
+        sessions that would leave after the end of the simulation
+    '''
+    n = len(step)
+    ev_config = env.config["ev"]
+
+    # round minute to 30 or 0, the required energy and time of stay depend on the half-hour of arrival
+    half_hour = hour*2 + (minute >= 30)
+
+    required_energy_mean = _half_hour_table(env.df_req_energy,
+                                            scenario)[half_hour]
+    required_energy = np.random.normal(
+        required_energy_mean, 0.5*required_energy_mean)  # kWh
+
+    low_energy = required_energy < 5
+    required_energy[low_energy] = np.random.randint(5, 10,
+                                                    size=low_energy.sum())
+
+    if env.heterogeneous_specs:
+        sampled_ev = env.ev_catalog.sample(n)
+        battery_capacity = env.ev_catalog.battery_capacity[sampled_ev]
+    else:
+        sampled_ev = np.zeros(n, dtype=int)
+        battery_capacity = np.full(n, ev_config["battery_capacity"],
+                                   dtype=float)
+
+    initial_battery_capacity = battery_capacity - required_energy
+    low_capacity = battery_capacity < required_energy
+    initial_battery_capacity[low_capacity] = np.random.randint(
+        1, battery_capacity[low_capacity])
+
+    above_desired = initial_battery_capacity > ev_config['desired_capacity']
+    initial_battery_capacity[above_desired] = np.random.randint(
+        1, battery_capacity[above_desired])
+
+    below_min = (initial_battery_capacity < ev_config['min_battery_capacity']) & \
+        (battery_capacity > 2*ev_config['min_battery_capacity'])
+    initial_battery_capacity[below_min] = ev_config['min_battery_capacity']
+
+    # time of stay dependent on time of arrival
+    time_of_stay_mean = _half_hour_table(env.df_time_of_stay_vs_arrival,
+                                         scenario)[half_hour]
+    time_of_stay = np.random.normal(
+        time_of_stay_mean, 0.2*time_of_stay_mean)  # hours
+
+    # turn from hours to steps
+    time_of_stay = time_of_stay * 60 / env.timescale + 1
+    time_of_stay = np.maximum(time_of_stay, min_time_of_stay_steps)
+
+    spawned = np.ones(n, dtype=bool)
+    if env.empty_ports_at_end_of_simulation:
+        spawned = time_of_stay + step + 4 < env.simulation_length
+
+    min_emergency_battery_capacity = np.where(
+        ev_config["min_emergency_battery_capacity"] > battery_capacity,
+        0.7*battery_capacity,
+        ev_config["min_emergency_battery_capacity"])
+
+    sessions = {'spawned': spawned,
+                'sampled_ev': sampled_ev,
+                'battery_capacity': battery_capacity,
+                'battery_capacity_at_arrival': initial_battery_capacity,
+                'min_emergency_battery_capacity': min_emergency_battery_capacity,
+                'time_of_arrival': step + 1,
+                'time_of_departure': (time_of_stay + step + 3).astype(int),
+                }
+
+    if env.heterogeneous_specs:
+        sessions['charge_efficiency'] = np.round(1 -
+                                                 (np.random.rand(n)+0.00001)/20, 3)  # [0.95-1]
+        sessions['discharge_efficiency'] = np.round(1 -
+                                                    (np.random.rand(n)+0.00001)/20, 3)  # [0.95-1]
+        sessions['transition_soc'] = np.round(0.9 -
+                                              (np.random.rand(n)+0.00001)/5, 3)  # [0.7-0.9]
+
+    return sessions
+
+
+def _half_hour_table(columns, scenario) -> np.ndarray:
+    '''Returns the scenario column of a table with an "Arrival Time" (HH:MM) column, indexed by half-hour of the day'''
+    table = np.zeros(48)
+    half_hour = np.array([int(t[:2])*2 + int(t[3:5])//30 for t in columns['Arrival Time']])
+    table[half_hour] = columns[scenario]
+    return table
+
+
+def make_EV(env, sessions, i) -> EVSession:
+    '''
+    This function creates the EVSession record of session i of a batch of sessions sampled with sample_EV_sessions
+    '''
+    ev_config = env.config["ev"]
+    battery_capacity = sessions['battery_capacity'][i]
+
+    if "transition_soc_multiplier" in ev_config:
+        transition_soc_multiplier = ev_config["transition_soc_multiplier"]
+    else:
+        transition_soc_multiplier = 1
+
+    if env.heterogeneous_specs:
+        catalog = env.ev_catalog
+        model = sessions['sampled_ev'][i]
+
+        if catalog.has_efficiency_curve[model]:
+            # the efficiency curve of the model is shared by all its EVs
+            charge_efficiency = catalog.efficiency[model]
+            discharge_efficiency = charge_efficiency
+        else:
+            charge_efficiency = sessions['charge_efficiency'][i]
+            discharge_efficiency = sessions['discharge_efficiency'][i]
+
+        return EVSession(id=sessions['port'][i],
+                         location=sessions['location'][i],
+                         battery_capacity_at_arrival=sessions['battery_capacity_at_arrival'][i],
+                         max_ac_charge_power=catalog.max_ac_charge_power[model],
+                         max_dc_charge_power=catalog.max_dc_charge_power[model],
+                         max_discharge_power=-catalog.max_dc_discharge_power[model],
+                         ev_model=model,
+                         min_emergency_battery_capacity=sessions['min_emergency_battery_capacity'][i],
+                         charge_efficiency=charge_efficiency,
+                         discharge_efficiency=discharge_efficiency,
+                         transition_soc=sessions['transition_soc'][i],
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         battery_capacity=battery_capacity,
+                         desired_capacity=ev_config['desired_capacity'] *
+                         battery_capacity,
+                         time_of_arrival=sessions['time_of_arrival'][i],
+                         time_of_departure=sessions['time_of_departure'][i],
+                         ev_phases=3,
+                         timescale=env.timescale,
+                         )
+    else:
+        return EVSession(id=sessions['port'][i],
+                         location=sessions['location'][i],
+                         battery_capacity_at_arrival=sessions['battery_capacity_at_arrival'][i],
+                         battery_capacity=battery_capacity,
+                         desired_capacity=ev_config['desired_capacity'] *
+                         battery_capacity,
+                         min_emergency_battery_capacity=sessions['min_emergency_battery_capacity'][i],
+                         max_ac_charge_power=ev_config['max_ac_charge_power'],
+                         min_ac_charge_power=ev_config['min_ac_charge_power'],
+                         max_dc_charge_power=ev_config['max_dc_charge_power'],
+                         max_discharge_power=ev_config['max_discharge_power'],
+                         min_discharge_power=ev_config['min_discharge_power'],
+                         time_of_arrival=sessions['time_of_arrival'][i],
+                         time_of_departure=sessions['time_of_departure'][i],
+                         ev_phases=ev_config['ev_phases'],
+                         transition_soc=ev_config['transition_soc'],
+                         transition_soc_multiplier=transition_soc_multiplier,
+                         charge_efficiency=ev_config['charge_efficiency'],
+                         discharge_efficiency=ev_config['discharge_efficiency'],
+                         timescale=env.timescale,
+                         )
+
+
+def EV_spawner_sequential(env) -> List[EVSession]:
+    '''
+    This function spawns all the EVs of the current simulation and returns the list of EVs,
+    looping over every step and port. It reproduces the random streams of the previous versions
+    of EV2Gym, select it with "sequential_ev_spawner: True" in the config file.
 
     Returns:
-        EVs: list of EVs
+        EVs: list of the EVSession records of the EVs
     '''
 
     ev_list = []
@@ -457,7 +740,11 @@ def EV_spawner(env) -> List[EV]:
 
     scenario = env.scenario
     user_spawn_multiplier = env.config["spawn_multiplier"]
-    time = env.sim_date
+    # the calendar of step t is the one of the timeline step t-2
+    weekdays = env.timeline.weekday.tolist()
+    hours = env.timeline.hour.tolist()
+    minutes = env.timeline.minute.tolist()
+    slots = env.timeline.slot.tolist()
 
     # Define minimum time of stay duration so that an EV can fully charge
     min_time_of_stay = env.config['ev']["min_time_of_stay"]
@@ -468,25 +755,23 @@ def EV_spawner(env) -> List[EV]:
             "Simulation length is too short for the minimum time of stay! Increase the simulation length or decrease the minimum time of stay.")
 
     for t in range(2, env.simulation_length-min_time_of_stay_steps-1):
-        day = time.weekday()
-        hour = time.hour
-        minute = time.minute
-        # Divide by 15 because the spawn rate is in 15 minute intervals (in the csv file)
-        i = hour*4 + minute//15
+        day = weekdays[t-2]
+        hour = hours[t-2]
+        minute = minutes[t-2]
+        # the spawn rate is in 15 minute intervals (in the csv file)
+        i = slots[t-2]
 
         if day < 5:
             if scenario == "workplace" and (hour < 6 or hour > 18):
-                time = time + datetime.timedelta(minutes=env.timescale)
                 continue
             else:
-                tau = env.df_arrival_week[scenario].iloc[i]
+                tau = env.df_arrival_week[scenario][i]
                 multiplier = 1  # 10
         else:
             if scenario == "workplace":
-                time = time + datetime.timedelta(minutes=env.timescale)
                 continue
             else:
-                tau = env.df_arrival_weekend[scenario].iloc[i]
+                tau = env.df_arrival_weekend[scenario][i]
 
             if day == 5:
                 multiplier = 1  # 8
@@ -517,18 +802,16 @@ def EV_spawner(env) -> List[EV]:
                             occupancy_list[counter, t +
                                            1:ev.time_of_departure] = 1
                 counter += 1
-        # step the time
-        time = time + datetime.timedelta(minutes=env.timescale)
 
     return ev_list
 
 
-def EV_spawner_GF(env) -> List[EV]:
+def EV_spawner_GF(env) -> List[EVSession]:
     '''
     This function spawns all the EVs of the current simulation and returns the list of EVs
 
     Returns:
-        EVs: list of EVs
+        EVs: list of the EVSession records of the EVs
     '''
 
     ev_list = []
@@ -539,7 +822,10 @@ def EV_spawner_GF(env) -> List[EV]:
                                            env.simulation_length)
 
     user_spawn_multiplier = env.config["spawn_multiplier"]
-    time = env.sim_date
+    # the calendar of step t is the one of the timeline step t-2
+    weekdays = env.timeline.weekday.tolist()
+    hours = env.timeline.hour.tolist()
+    minutes = env.timeline.minute.tolist()
 
     # Define minimum time of stay duration so that an EV can fully charge
     min_time_of_stay = env.config['ev']["min_time_of_stay"]
@@ -550,9 +836,9 @@ def EV_spawner_GF(env) -> List[EV]:
             "Simulation length is too short for the minimum time of stay! Increase the simulation length or decrease the minimum time of stay.")
 
     for t in range(2, env.simulation_length-min_time_of_stay_steps-1):
-        day = time.weekday()
-        hour = time.hour
-        minute = time.minute
+        day = weekdays[t-2]
+        hour = hours[t-2]
+        minute = minutes[t-2]
         # Divide by 10 because the spawn rate is in 10 minute intervals
         i = hour*6 + minute//10
 
@@ -584,8 +870,6 @@ def EV_spawner_GF(env) -> List[EV]:
                             occupancy_list[counter, t +
                                            1:ev.time_of_departure] = 1
                 counter += 1
-        # step the time
-        time = time + datetime.timedelta(minutes=env.timescale)
 
     return ev_list
 
@@ -616,30 +900,51 @@ def smooth_vector(v) -> np.ndarray:
 
 
 def median_smoothing(v, window_size) -> np.ndarray:
+    '''
+    Median filter of v (along the last axis, so a batch of vectors can be smoothed at once).
+    The windows are truncated at the edges of v. The full windows are computed at once
+    over a strided view of v, only the truncated windows at the edges are computed one by one.
+    '''
+    v = np.asarray(v)
     smoothed_v = np.zeros_like(v)
     half_window = window_size // 2
+    n = v.shape[-1]
+    window_length = 2 * half_window + 1
+
+    if n >= window_length:
+        smoothed_v[..., half_window:n - half_window] = np.median(
+            sliding_window_view(v, window_length, axis=-1), axis=-1)
+        edges = list(range(half_window)) + list(range(n - half_window, n))
+    else:
+        edges = range(n)
 
-    for i in range(len(v)):
+    for i in edges:
         start = max(0, i - half_window)
-        end = min(len(v), i + half_window + 1)
-        smoothed_v[i] = np.median(v[start:end])
+        end = min(n, i + half_window + 1)
+        smoothed_v[..., i] = np.median(v[..., start:end], axis=-1)
 
     return smoothed_v
 
 
-def generate_power_setpoints(env) -> np.ndarray:
+def generate_power_setpoints(env, n_scenarios=None) -> np.ndarray:
     '''
     This function generates the power setpoints for the entire simulation using
     the list of EVs and the charging stations from the environment.
 
     It considers the ev SoC and teh steps required to fully charge the EVs.
+    The required energy of every EV is spread randomly over its time of stay using the prices
+    as weights, and then shifted to respect the power limits of the EV and the charging station.
+    All the EV sessions (and scenarios) are processed at once as the rows of a matrix.
 
+    Inputs:
+        - n_scenarios: the number of setpoint scenarios to generate, if None a single scenario is generated
     Returns:
-        power_setpoints: np.ndarray
+        power_setpoints: np.ndarray of shape (simulation_length,), or (n_scenarios, simulation_length)
 
     '''
+    simulation_length = env.simulation_length
+    n_batch = 1 if n_scenarios is None else n_scenarios
 
-    power_setpoints = np.zeros(env.simulation_length)
     # get normalized prices
     prices = abs(env.charge_prices[0])
     prices = prices / np.max(prices)
@@ -650,61 +955,63 @@ def generate_power_setpoints(env) -> np.ndarray:
     min_cs_power = env.charging_stations[0].get_min_charge_power()
     max_cs_power = env.charging_stations[0].get_max_power()
 
-    total_evs_spawned = 0
-    for t in range(env.simulation_length):
-        counter = total_evs_spawned
-        for _, ev in enumerate(env.EVs_profiles[counter:]):
-            if ev.time_of_arrival == t + 1:
-                total_evs_spawned += 1
-
-                required_energy = ev.battery_capacity - ev.battery_capacity_at_arrival
-                required_energy = required_energy * required_energy_multiplier / 100
-                min_power_limit = max(ev.min_ac_charge_power, min_cs_power)
-                max_power_limit = min(ev.max_ac_charge_power, max_cs_power)
-
-                # Spread randomly the required energy over the time of stay using the prices as weights
-                shifted_load = np.random.normal(loc=1 - prices[t+2:ev.time_of_departure],
-                                                scale=min(
-                                                    prices[t+2:ev.time_of_departure]),
-                                                size=ev.time_of_departure - t - 2)
-                # make shifted load positive
-                shifted_load = np.abs(shifted_load)
-                shifted_load = shifted_load / np.sum(shifted_load)
-                shifted_load = shifted_load * required_energy * 60 / env.timescale
-
-                # find power lower than min_power_limit and higher than max_power_limit
-                step = 0
-                while np.min(shifted_load[shifted_load != 0]) < min_power_limit or \
-                        np.max(shifted_load) > max_power_limit:
-
-                    if step > 10:
-                        break
-
-                    # print(f"Shifted load: {shifted_load}")
-                    for i in range(len(shifted_load)):
-                        if shifted_load[i] < min_power_limit and shifted_load[i] > 0:
-                            load_to_shift = shifted_load[i]
-                            shifted_load[i] = 0
-
-                            if i == len(shifted_load) - 1:
-                                shifted_load[0] += load_to_shift
-                            else:
-                                shifted_load[i+1] += load_to_shift
-
-                        elif shifted_load[i] > max_power_limit:
-                            load_to_shift = shifted_load[i] - max_power_limit
-                            shifted_load[i] = max_power_limit
-
-                            if i == len(shifted_load) - 1:
-                                shifted_load[0] += load_to_shift
-                            else:
-                                shifted_load[i+1] += load_to_shift
-                    step += 1
-
-                power_setpoints[t+2:ev.time_of_departure] += shifted_load
-
-            elif ev.time_of_arrival > t + 1:
-                break
+    # the load of an EV arriving at step t+1 is spread from t+2 to its time of departure
+    evs = [ev for ev in env.EVs_profiles
+           if ev.time_of_arrival >= 1 and
+           ev.time_of_arrival + 1 < min(ev.time_of_departure, simulation_length)]
+
+    power_setpoints = np.zeros((n_batch, simulation_length))
+
+    if len(evs) > 0:
+        start = np.array([ev.time_of_arrival + 1 for ev in evs])
+        end = np.minimum([ev.time_of_departure for ev in evs],
+                         simulation_length)
+        length = end - start
+
+        required_energy = np.array([ev.battery_capacity - ev.battery_capacity_at_arrival
+                                    for ev in evs])
+        required_energy = required_energy * required_energy_multiplier / 100
+        min_power_limit = np.maximum([ev.min_ac_charge_power for ev in evs],
+                                     min_cs_power)
+        max_power_limit = np.minimum([ev.max_ac_charge_power for ev in evs],
+                                     max_cs_power)
+
+        # the stay of every EV as a row of a (n_evs, max_length) matrix
+        columns = np.arange(max(length.max(), 1))
+        valid = columns < length[:, None]
+        steps = start[:, None] + columns
+        segment = np.repeat(np.arange(len(evs)), length)
+        segment_start = np.concatenate([[0], np.cumsum(length)[:-1]])
+
+        stay_prices = prices[steps[valid]]
+        price_scale = np.minimum.reduceat(stay_prices, segment_start)
+
+        # Spread randomly the required energy over the time of stay using the prices as weights
+        shifted_load = 1 - stay_prices + price_scale[segment] * \
+            np.random.standard_normal((n_batch, len(stay_prices)))
+        # make shifted load positive
+        shifted_load = np.abs(shifted_load)
+        shifted_load = shifted_load / \
+            np.add.reduceat(shifted_load, segment_start, axis=1)[:, segment]
+        shifted_load = shifted_load * \
+            required_energy[segment] * 60 / env.timescale
+
+        load = np.zeros((n_batch, len(evs), len(columns)))
+        load[:, valid] = shifted_load
+        load = load.reshape(n_batch * len(evs), len(columns))
+
+        shift_power_limits(load,
+                           np.tile(length, n_batch),
+                           np.tile(min_power_limit, n_batch),
+                           np.tile(max_power_limit, n_batch))
+
+        # add the load of the EVs to the setpoints in order of arrival
+        load = load.reshape(n_batch, len(evs), len(columns))[:, valid]
+        scenario_offset = np.arange(n_batch)[:, None] * simulation_length
+        power_setpoints = np.bincount((scenario_offset + steps[valid]).ravel(),
+                                      weights=load.ravel(),
+                                      minlength=n_batch * simulation_length
+                                      ).reshape(n_batch, simulation_length)
 
     # return smooth_vector(power_setpoints)
 
@@ -720,12 +1027,60 @@ def generate_power_setpoints(env) -> np.ndarray:
     multiplier = int(15 / env.timescale)
     if multiplier < 1:
         multiplier = 1
-    return median_smoothing(power_setpoints, 5 * multiplier)
+    power_setpoints = median_smoothing(power_setpoints, 5 * multiplier)
+
+    if n_scenarios is None:
+        return power_setpoints[0]
+    return power_setpoints
+
+
+def shift_power_limits(load, length, min_power_limit, max_power_limit, max_passes=11) -> None:
+    '''
+    Shifts in place the load of every row of load (the first length[row] columns) to respect the power limits of the row:
+    in every pass, from the first to the last column, a load lower than min_power_limit is moved to the next column
+    and the load higher than max_power_limit is moved to the next column (the last column moves its load to the first one).
+    Rows are processed until they respect the limits or after max_passes passes, the columns of all rows at once.
+    '''
+    active = np.ones(len(load), dtype=bool)
+
+    for _ in range(max_passes):
+        nonzero_min = np.where(load != 0, load, np.inf).min(axis=1)
+        active &= (nonzero_min < min_power_limit) | \
+            (load.max(axis=1) > max_power_limit)
+
+        rows = np.flatnonzero(active)
+        if len(rows) == 0:
+            break
+
+        # columns first, so that every column of the active rows is contiguous
+        row_length = length[rows]
+        n_columns = row_length.max()
+        row_load = load[rows, :n_columns].T.copy()
+        low = min_power_limit[rows]
+        high = max_power_limit[rows]
+        # the load beyond the length of a row is always zero, so it is never shifted
+        last_column = np.arange(n_columns)[:, None] == row_length - 1
+        ends_row = last_column.any(axis=1)
+
+        for i in range(n_columns):
+            value = row_load[i]
+            below_min = (value < low) & (value > 0)
+            new_value = np.where(below_min, 0, np.minimum(value, high))
+            load_to_shift = value - new_value
+            row_load[i] = new_value
+
+            if i + 1 < n_columns:
+                row_load[i + 1] += load_to_shift * ~last_column[i]
+            if ends_row[i]:
+                row_load[0] += load_to_shift * last_column[i]
+
+        load[rows, :n_columns] = row_load.T
 
 
 def calculate_charge_power_potential(env) -> float:
     '''
     This function calculates the total charge power potential of all currently parked EVs for the current time step     
+    (EV2Gym keeps it up to date incrementally with ChargePowerPotential, see utilities/charge_power_potential.py)
     '''
 
     power_potential = 0
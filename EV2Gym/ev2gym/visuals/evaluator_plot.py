@@ -335,7 +335,7 @@ def plot_comparable_EV_SoC(results_path, save_path=None, algorithm_names=None):
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_energy_level[env.cs_port_offset[cs.id] + port, :]
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
@@ -423,7 +423,7 @@ def plot_comparable_EV_SoC_single(results_path, save_path=None, algorithm_names=
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_energy_level[env.cs_port_offset[cs.id] + port, :]
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
@@ -524,7 +524,7 @@ def plot_comparable_CS_Power(results_path, save_path=None, algorithm_names=None)
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_current[port, cs.id, :]
+                df[port] = env.port_current[env.cs_port_offset[cs.id] + port, :]
             
             #multiply df[port] by the voltage to get the power
             df = df * cs.voltage * math.sqrt(cs.phases) / 1000
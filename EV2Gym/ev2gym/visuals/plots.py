@@ -9,8 +9,10 @@ import datetime
 def visualize_step(env):
     '''Renders the current state of the environment in the terminal'''
 
-    print(f"\n Step: {env.current_step}" +
-          f" | {str(env.sim_date.weekday())} {env.sim_date.hour:2d}:{env.sim_date.minute:2d}:{env.sim_date.second:2d} |" +
+    timeline = env.timeline
+    step = env.current_step
+    print(f"\n Step: {step}" +
+          f" | {timeline.weekday[step]} {timeline.hour[step]:02d}:{timeline.minute[step]:02d} |" +
           f" \tEVs +{env.current_ev_arrived} / -{env.current_ev_departed}" +
           f" | Total: {env.current_evs_parked} / {env.number_of_ports}")
 
@@ -50,12 +52,8 @@ def ev_city_plot(env):
     '''
     print("Plotting simulation data at ./results/" + env.sim_name + "/")
 
-    date_range = pd.date_range(start=env.sim_starting_date,
-                               end=env.sim_starting_date +
-                               (env.simulation_length - 1) *
-                               datetime.timedelta(
-                                   minutes=env.timescale),
-                               freq=f'{env.timescale}min')
+    date_range = pd.DatetimeIndex(
+        env.timeline.datetimes()[:env.simulation_length])
     date_range_print = pd.date_range(start=env.sim_starting_date,
                                      end=env.sim_date,
                                      periods=10)
@@ -81,7 +79,7 @@ def ev_city_plot(env):
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_energy_level[env.cs_port_offset[cs.id] + port, :]
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
@@ -254,8 +252,8 @@ def ev_city_plot(env):
             df_signal = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_current[port, cs.id, :]
-                df_signal[port] = env.port_current_signal[port, cs.id, :]
+                df[port] = env.port_current[env.cs_port_offset[cs.id] + port, :]
+                df_signal[port] = env.port_current_signal[env.cs_port_offset[cs.id] + port, :]
                 # create 2 dfs, one for positive power and one for negative
             df_pos = df.copy()
             df_pos[df_pos < 0] = 0
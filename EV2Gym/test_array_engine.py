@@ -0,0 +1,75 @@
+'''
+Checks that the array engine steps the charging network like the EV and EV_Charger objects
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev import EV
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.vector_env import VectorEV2Gym
+from ev2gym.rl_agent.reward import profit_maximization, SquaredTrackingErrorReward
+from ev2gym.rl_agent.state import V2G_profit_max_loads, PublicPST
+
+CONFIGS = [('ev2gym/example_config_files/V2GProfitPlusLoads.yaml', V2G_profit_max_loads, profit_maximization),
+           ('ev2gym/example_config_files/PublicPST.yaml', PublicPST, SquaredTrackingErrorReward)]
+
+
+def run_episode(env) -> tuple:
+    '''Runs an episode with random actions, returns the observations, rewards and statistics'''
+    observation, _ = env.reset(seed=11)
+    rng = np.random.default_rng(3)
+    observations, rewards = [observation], []
+    done = False
+    while not done:
+        observation, reward, done, _, stats = env.step(
+            rng.uniform(env.action_space.low, env.action_space.high))
+        observations.append(observation)
+        rewards.append(reward)
+    return np.array(observations), np.array(rewards), stats
+
+
+@pytest.mark.parametrize('config_file, state_function, reward_function', CONFIGS)
+def test_array_engine_matches_objects(config_file, state_function, reward_function):
+    envs = [EV2Gym(config_file=config_file, seed=7, state_function=state_function,
+                   reward_function=reward_function, use_array_engine=use_array_engine)
+            for use_array_engine in (False, True)]
+    (observations, rewards, stats), (engine_observations, engine_rewards, engine_stats) = \
+        [run_episode(env) for env in envs]
+    assert stats['total_ev_served'] > 0
+
+    np.testing.assert_allclose(engine_observations, observations, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(engine_rewards, rewards, rtol=1e-9, atol=1e-9)
+    for name, value in stats.items():
+        if np.ndim(value) == 0 and value is not None:
+            assert engine_stats[name] == pytest.approx(value, rel=1e-9, abs=1e-9), name
+
+    objects, engine = envs
+    np.testing.assert_allclose(engine.cs_power, objects.cs_power, rtol=1e-9, atol=1e-9)
+    for name in ('port_current', 'port_current_signal', 'port_energy_level'):
+        np.testing.assert_array_equal(getattr(engine, name), getattr(objects, name))
+
+
+def test_batched_engine_connects_evs_through_the_environment_engines():
+    vector_env = VectorEV2Gym(num_envs=3, config_file=CONFIGS[0][0], seed=0)
+    vector_env.reset(seed=0)
+    batched = vector_env.engine
+    engine = vector_env.envs[1].engine
+    batched.reset()
+
+    cs_id = batched.cs_slices[1].start + 2
+    assert batched.locate_cs(cs_id) == (1, 2)
+
+    ev = EV(id=1, location=2, battery_capacity_at_arrival=20, time_of_arrival=0,
+            time_of_departure=30, desired_capacity=50)
+    batched.connect_ev(ev, cs_id, 1)
+
+    port = engine.cs_port_offset[2] + 1
+    assert engine.evs[port] is ev
+    assert engine.occupied[port] and batched.occupied[batched.cs_port_offset[cs_id] + 1]
+    assert batched.current_capacity[batched.cs_port_offset[cs_id] + 1] == 20
+    assert batched.occupied.sum() == 1
+
+    batched.reset()
+    assert not batched.occupied.any()
+    assert engine.evs[port] is None
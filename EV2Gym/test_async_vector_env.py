@@ -0,0 +1,50 @@
+'''
+Checks that AsyncVectorEV2Gym steps its sub-environments like independent EV2Gym environments
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.async_vector_env import AsyncVectorEV2Gym
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.rl_agent.reward import profit_maximization
+from ev2gym.rl_agent.state import V2G_profit_max_loads
+
+ENV_KWARGS = dict(config_file='ev2gym/example_config_files/V2GProfitPlusLoads.yaml',
+                  state_function=V2G_profit_max_loads,
+                  reward_function=profit_maximization)
+NUM_ENVS = 5
+
+
+def test_async_vector_env_matches_single_envs():
+    vector_env = AsyncVectorEV2Gym(num_envs=NUM_ENVS, seed=3, envs_per_worker=2, **ENV_KWARGS)
+    try:
+        observations, _ = vector_env.reset(seed=100)
+
+        envs = [EV2Gym(seed=3 + i, **ENV_KWARGS) for i in range(NUM_ENVS)]
+        for i, env in enumerate(envs):
+            np.testing.assert_array_equal(observations[i], env.reset(seed=100 + i)[0])
+
+        rng = np.random.default_rng(0)
+        for _ in range(envs[0].simulation_length):
+            actions = rng.uniform(-1, 1, (NUM_ENVS, vector_env.single_action_space.shape[0]))
+            observations, rewards, terminations, truncations, infos = vector_env.step(actions)
+
+            for i, env in enumerate(envs):
+                observation, reward, terminated, truncated, info = env.step(actions[i])
+                np.testing.assert_allclose(observations[i], observation, rtol=1e-9, atol=1e-9)
+                np.testing.assert_array_equal(infos['action_mask'][i], info['action_mask'])
+                assert rewards[i] == pytest.approx(reward, abs=1e-9)
+                assert terminations[i] == terminated and truncations[i] == truncated
+
+        assert terminations.all()
+        assert vector_env.get_attr('current_step') == tuple(env.current_step for env in envs)
+
+        # the finished episodes are reset at the next step and their actions are ignored
+        _, rewards, terminations, _, _ = vector_env.step(
+            np.ones((NUM_ENVS, vector_env.single_action_space.shape[0])))
+        assert not terminations.any()
+        assert (rewards == 0).all()
+        assert vector_env.get_attr('current_step') == (0,) * NUM_ENVS
+    finally:
+        vector_env.close()
@@ -0,0 +1,114 @@
+'''
+Checks that the batch charge/discharge kernel of ev.py matches the EV battery model step by step
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev import EV, charge_batch, discharge_batch, step_batch
+from ev2gym.models.array_engine import efficiency_curve
+
+TIMESCALE = 15
+EFFICIENCY_CURVE = np.concatenate([np.full(10, 85.), np.linspace(85, 95, 91)])
+
+
+def make_evs(n, seed=0) -> list:
+    '''EVs with random battery parameters and scalar, array and dict efficiencies'''
+    rng = np.random.default_rng(seed)
+    evs = []
+    for i in range(n):
+        capacity = rng.uniform(20, 100)
+        efficiency = [EFFICIENCY_CURVE,
+                      rng.uniform(0.9, 1),
+                      {level: 90 + level % 7 for level in range(101)}][i % 3]
+        evs.append(EV(id=0,
+                      location=0,
+                      battery_capacity_at_arrival=rng.uniform(0.1, 1)*capacity,
+                      time_of_arrival=0,
+                      time_of_departure=10,
+                      battery_capacity=capacity,
+                      min_battery_capacity=rng.uniform(0, 15),
+                      max_ac_charge_power=rng.uniform(3, 22),
+                      max_discharge_power=-rng.uniform(3, 22),
+                      min_ac_charge_power=0,
+                      min_discharge_power=0,
+                      transition_soc=[1, rng.uniform(0.6, 0.95)][i % 2],
+                      transition_soc_multiplier=rng.uniform(0.5, 2),
+                      charge_efficiency=efficiency,
+                      discharge_efficiency=efficiency,
+                      timescale=TIMESCALE))
+    return evs
+
+
+def column(evs, name) -> np.ndarray:
+    return np.array([getattr(ev, name) for ev in evs], dtype=float)
+
+
+def curves(evs, name) -> np.ndarray:
+    return np.array([efficiency_curve(getattr(ev, name)) for ev in evs])
+
+
+def test_charge_batch():
+    evs = make_evs(300)
+    rng = np.random.default_rng(1)
+    amps = rng.uniform(0.5, 32, len(evs))
+    phases = rng.choice([1, 3], len(evs))
+
+    capacity, energy, current = charge_batch(amps, np.full(len(evs), 230.), phases,
+                                             column(evs, 'current_capacity'),
+                                             column(evs, 'battery_capacity'),
+                                             column(evs, 'max_ac_charge_power'),
+                                             column(evs, 'transition_soc'),
+                                             column(evs, 'transition_soc_multiplier'),
+                                             curves(evs, 'charge_efficiency'),
+                                             TIMESCALE)
+
+    for i, ev in enumerate(evs):
+        assert current[i] == pytest.approx(ev._charge(amps[i], 230., phases[i]), abs=1e-9)
+        assert capacity[i] == pytest.approx(ev.current_capacity, abs=1e-9)
+        assert energy[i] == pytest.approx(ev.current_energy, abs=1e-9)
+
+
+def test_discharge_batch():
+    evs = make_evs(300)
+    rng = np.random.default_rng(2)
+    amps = -rng.uniform(0.5, 32, len(evs))
+    phases = rng.choice([1, 3], len(evs))
+
+    capacity, energy, current = discharge_batch(amps, np.full(len(evs), 230.), phases,
+                                                column(evs, 'current_capacity'),
+                                                column(evs, 'min_battery_capacity'),
+                                                column(evs, 'max_discharge_power'),
+                                                curves(evs, 'discharge_efficiency'),
+                                                TIMESCALE)
+
+    for i, ev in enumerate(evs):
+        assert current[i] == pytest.approx(ev._discharge(amps[i], 230., phases[i]), abs=1e-9)
+        assert capacity[i] == pytest.approx(ev.current_capacity, abs=1e-9)
+        assert energy[i] == pytest.approx(ev.current_energy, abs=1e-9)
+
+
+def test_step_batch():
+    evs = make_evs(600)
+    rng = np.random.default_rng(3)
+    amps = rng.uniform(-32, 32, len(evs))
+    amps[::17] = 0
+    phases = rng.choice([1, 3], len(evs))
+
+    capacity, energy, current = step_batch(amps, np.full(len(evs), 230.), phases,
+                                           column(evs, 'current_capacity'),
+                                           column(evs, 'battery_capacity'),
+                                           column(evs, 'min_battery_capacity'),
+                                           column(evs, 'max_ac_charge_power'),
+                                           column(evs, 'max_discharge_power'),
+                                           column(evs, 'transition_soc'),
+                                           column(evs, 'transition_soc_multiplier'),
+                                           curves(evs, 'charge_efficiency'),
+                                           curves(evs, 'discharge_efficiency'),
+                                           TIMESCALE)
+
+    for i, ev in enumerate(evs):
+        ev_energy, ev_current = ev.step(amps[i], 230., phases[i])
+        assert capacity[i] == ev.current_capacity
+        assert energy[i] == pytest.approx(ev_energy, abs=1e-9)
+        assert current[i] == pytest.approx(ev_current, abs=1e-9)
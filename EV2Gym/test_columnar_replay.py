@@ -0,0 +1,97 @@
+'''
+Checks that columnar replay files load with the same fields and replay the same episode as pickled ones
+'''
+
+import zipfile
+
+import numpy as np
+import pytest
+
+from ev2gym.models import replay as replay_module
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.replay import (REPLAY_ARRAYS, SESSION_PORT_ARRAYS, ColumnarReplay,
+                                  load_replay)
+
+CONFIG_FILE = 'ev2gym/example_config_files/V2GProfitPlusLoads.yaml'
+# the charging station fields compared after loading
+CHARGER_FIELDS = ('id', 'connected_transformer', 'max_charge_current', 'min_discharge_current',
+                  'voltage', 'n_ports', 'charger_type', 'phases', 'timescale')
+
+
+def run_episode(env) -> dict:
+    env.reset(seed=4)
+    done = False
+    while not done:
+        _, _, done, _, stats = env.step(np.ones(env.number_of_ports)*0.5)
+    return stats
+
+
+def save_replay(tmp_path, replay_format) -> str:
+    env = EV2Gym(config_file=CONFIG_FILE, seed=3, save_replay=True,
+                 replay_format=replay_format, replay_save_path=f'{tmp_path}/{replay_format}/')
+    run_episode(env)
+    return str(next((tmp_path / replay_format).glob('replay_*')))
+
+
+def session_fields(sessions) -> list:
+    return [[np.asarray(value, dtype=float) if value is not None else None for value in session]
+            for session in sessions]
+
+
+def assert_same_replay(replay, reference):
+    for name in REPLAY_ARRAYS + SESSION_PORT_ARRAYS:
+        np.testing.assert_array_equal(getattr(replay, name), getattr(reference, name),
+                                      err_msg=name)
+    for name in ('sim_length', 'n_cs', 'n_transformers', 'timescale', 'scenario',
+                 'max_n_ports', 'sim_date'):
+        assert getattr(replay, name) == getattr(reference, name), name
+
+    for session, reference_session in zip(session_fields(replay.sessions),
+                                          session_fields(reference.sessions)):
+        for value, reference_value in zip(session, reference_session):
+            np.testing.assert_array_equal(value, reference_value)
+
+    for tr, reference_tr in zip(replay.transformers, reference.transformers):
+        for name in ('id', 'voltage', 'max_current', 'min_current', 'max_power', 'min_power',
+                     'inflexible_load', 'solar_power', 'cs_ids', 'steps_ahead', 'dr_events'):
+            np.testing.assert_array_equal(getattr(tr, name), getattr(reference_tr, name),
+                                          err_msg=name)
+    for cs, reference_cs in zip(replay.charging_stations, reference.charging_stations):
+        for name in CHARGER_FIELDS:
+            assert getattr(cs, name) == getattr(reference_cs, name), name
+
+
+@pytest.mark.parametrize('replay_format', ['columnar', 'columnar_compressed'])
+def test_columnar_replay_round_trip(tmp_path, replay_format):
+    pickle_path = save_replay(tmp_path, 'pickle')
+    path = save_replay(tmp_path, replay_format)
+
+    # the per-port arrays are rebuilt from the sessions, not stored
+    with zipfile.ZipFile(path) as zf:
+        assert not set(f'{name}.npy' for name in SESSION_PORT_ARRAYS) & set(zf.namelist())
+
+    replay = load_replay(path)
+    assert isinstance(replay, ColumnarReplay)
+    if replay_format == 'columnar':
+        assert isinstance(replay.power_setpoints, np.memmap)
+    assert_same_replay(replay, load_replay(pickle_path))
+
+    stats = run_episode(EV2Gym(config_file=CONFIG_FILE, load_from_replay_path=path))
+    pickle_stats = run_episode(EV2Gym(config_file=CONFIG_FILE,
+                                      load_from_replay_path=pickle_path))
+    for name in ('total_profits', 'total_ev_served', 'total_energy_charged', 'tracking_error'):
+        assert stats[name] == pickle_stats[name], name
+
+
+def test_version_2_replays_still_load(tmp_path, monkeypatch):
+    reference = load_replay(save_replay(tmp_path, 'pickle'))
+
+    # version 2 replays stored the per-port arrays instead of rebuilding them from the sessions
+    monkeypatch.setattr(replay_module, 'REPLAY_ARRAYS', REPLAY_ARRAYS + SESSION_PORT_ARRAYS)
+    monkeypatch.setattr(replay_module, 'REPLAY_FORMAT_VERSION', 2)
+    path = reference.save(str(tmp_path / 'replay_v2.npz'))
+    monkeypatch.undo()
+
+    replay = load_replay(path)
+    assert isinstance(replay.u, np.memmap)
+    assert_same_replay(replay, reference)
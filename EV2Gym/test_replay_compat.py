@@ -0,0 +1,60 @@
+'''
+Checks that replay files pickled before EV and EV_Charger used __slots__ still load
+'''
+
+import copyreg
+import pickle
+
+import numpy as np
+
+from ev2gym.models.ev import EV
+from ev2gym.models.ev_charger import EV_Charger
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.replay import load_replay
+
+CONFIG_FILE = 'ev2gym/example_config_files/V2GProfitMax.yaml'
+
+
+class LegacyPickler(pickle.Pickler):
+    '''Pickles EVs and EV chargers like the classes without __slots__ did (dict state)'''
+
+    def reducer_override(self, obj):
+        if isinstance(obj, (EV, EV_Charger)):
+            state = {name: getattr(obj, name) for name in type(obj).__slots__
+                     if hasattr(obj, name)}
+            # the session fields added with the EVSession records
+            state.pop('ev_model', None)
+            return copyreg.__newobj__, (type(obj),), state
+        return NotImplemented
+
+
+def run_episode(env) -> dict:
+    env.reset(seed=0)
+    np.random.seed(0)
+    done = False
+    while not done:
+        _, _, done, _, stats = env.step(np.random.rand(env.number_of_ports)*2 - 1)
+    return stats
+
+
+def test_legacy_pickled_replay(tmp_path):
+    env = EV2Gym(config_file=CONFIG_FILE, seed=0, save_replay=True,
+                 replay_format='pickle', replay_save_path=f'{tmp_path}/')
+    run_episode(env)
+    replay_path = str(next(tmp_path.glob('replay_*.pkl')))
+    replay = load_replay(replay_path)
+
+    legacy_path = tmp_path / 'replay_legacy.pkl'
+    with open(legacy_path, 'wb') as f:
+        LegacyPickler(f).dump(replay)
+
+    legacy = load_replay(legacy_path)
+    assert [(s.id, s.location, s.time_of_arrival, s.time_of_departure) for s in legacy.sessions] == \
+        [(s.id, s.location, s.time_of_arrival, s.time_of_departure) for s in replay.sessions]
+
+    stats = run_episode(EV2Gym(config_file=CONFIG_FILE,
+                               load_from_replay_path=replay_path))
+    legacy_stats = run_episode(EV2Gym(config_file=CONFIG_FILE,
+                                      load_from_replay_path=str(legacy_path)))
+    assert legacy_stats['total_profits'] == stats['total_profits']
+    assert legacy_stats['total_energy_charged'] == stats['total_energy_charged']
@@ -0,0 +1,81 @@
+'''
+Checks that the RolloutEngine traces match stepping a restored environment branch by branch
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.rollout_engine import RolloutEngine
+from ev2gym.rl_agent import cost, reward
+
+CONFIGS = ['ev2gym/example_config_files/V2GProfitPlusLoads.yaml',
+           'ev2gym/example_config_files/PublicPST.yaml']
+N_BRANCHES = 5
+HORIZON = 25
+
+
+def unbatched_reward(env, total_costs, user_satisfaction_list, invalid_action_punishment):
+    '''A reward function without a batched version, called once per branch and step'''
+    step = env.current_step - 1
+    return -(min(env.power_setpoints[step], env.charge_power_potential[step]) -
+             env.current_power_usage[step])**2 - \
+        sum(tr.get_how_overloaded() for tr in env.transformers) - \
+        len(user_satisfaction_list) + total_costs - invalid_action_punishment
+
+
+REWARD_FUNCTIONS = [reward.SquaredTrackingErrorReward,
+                    reward.ProfitMax_TrPenalty_UserIncentives,
+                    reward.profit_maximization,
+                    unbatched_reward]
+
+
+@pytest.mark.parametrize('reward_function', REWARD_FUNCTIONS)
+@pytest.mark.parametrize('use_array_engine', [False, True])
+@pytest.mark.parametrize('config_file', CONFIGS)
+def test_rollout_matches_restored_env(config_file, use_array_engine, reward_function):
+    env = EV2Gym(config_file=config_file, seed=7, use_array_engine=use_array_engine,
+                 reward_function=reward_function,
+                 cost_function=cost.transformer_overload_usrpenalty_cost)
+    env.reset(seed=11)
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        env.step(rng.uniform(env.action_space.low, env.action_space.high))
+
+    actions = rng.uniform(env.action_space.low, env.action_space.high,
+                          (N_BRANCHES, HORIZON, env.number_of_ports))
+    actions[0] = 0
+    snapshot = env.snapshot()
+    start = env.current_step
+    power_usage = env.current_power_usage.copy()
+
+    traces = RolloutEngine(env, N_BRANCHES).rollout(actions)
+
+    # the rollout does not modify the environment
+    assert env.current_step == start
+    np.testing.assert_array_equal(env.current_power_usage, power_usage)
+
+    for k in range(N_BRANCHES):
+        env.restore(snapshot)
+        rewards, costs, tr_power = [], [], []
+        for h in range(HORIZON):
+            _, step_reward, _, _, info = env.step(actions[k, h])
+            rewards.append(step_reward)
+            costs.append(info['cost'])
+            tr_power.append([tr.current_power for tr in env.transformers])
+
+        np.testing.assert_allclose(traces['reward'][k], rewards, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(traces['cost'][k], costs, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(traces['power_usage'][k],
+                                   env.current_power_usage[start:start + HORIZON],
+                                   rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(traces['charge_power_potential'][k],
+                                   env.charge_power_potential[start + 1:start + HORIZON + 1],
+                                   rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(traces['tr_power'][k], np.array(tr_power).T,
+                                   rtol=1e-9, atol=1e-9)
+
+        soc = np.array([ev.get_soc() if ev is not None else 0
+                        for cs in env.charging_stations for ev in cs.evs_connected])
+        np.testing.assert_allclose(np.where(traces['occupied'][k], traces['soc'][k], 0), soc,
+                                   rtol=1e-9, atol=1e-9)
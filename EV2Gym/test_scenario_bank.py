@@ -0,0 +1,58 @@
+'''
+Checks that the episodes of a scenario bank are the episodes the environment generates at reset
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.rl_agent.reward import profit_maximization
+from ev2gym.rl_agent.state import V2G_profit_max_loads, PublicPST
+from ev2gym.utilities.scenario_bank import generate_scenario_bank, open_scenario_bank
+
+N_SCENARIOS = 4
+
+
+def run_episode(env, **reset_kwargs) -> tuple:
+    '''Runs an episode with random actions, returns the observations, rewards and statistics'''
+    observation, _ = env.reset(**reset_kwargs)
+    rng = np.random.default_rng(0)
+    observations, rewards = [observation], []
+    done = False
+    while not done:
+        observation, reward, done, _, stats = env.step(
+            rng.uniform(env.action_space.low, env.action_space.high))
+        observations.append(observation)
+        rewards.append(reward)
+    return np.array(observations), np.array(rewards), stats
+
+
+@pytest.mark.parametrize('config, state_function, use_array_engine',
+                         [('V2GProfitPlusLoads', V2G_profit_max_loads, False),
+                          ('PublicPST', PublicPST, True)])
+def test_bank_episode_matches_generated_episode(tmp_path, config, state_function, use_array_engine):
+    config_file = f'ev2gym/example_config_files/{config}.yaml'
+    env_kwargs = dict(state_function=state_function,
+                      reward_function=profit_maximization,
+                      use_array_engine=use_array_engine)
+    path = generate_scenario_bank(config_file, str(tmp_path / 'bank'), N_SCENARIOS,
+                                  seed=100, workers=0, chunk_size=3, verbose=False)
+    bank = open_scenario_bank(path)
+    assert len(bank) == N_SCENARIOS
+
+    bank_env = EV2Gym(config_file=config_file, seed=0, scenario_bank=path, **env_kwargs)
+    for index in range(N_SCENARIOS):
+        seed = int(bank.seeds[index])
+        observations, rewards, stats = run_episode(bank_env, seed=seed,
+                                                   options={'scenario': index})
+        assert bank_env.scenario_index == index
+
+        generated_env = EV2Gym(config_file=config_file, seed=seed, **env_kwargs)
+        generated_observations, generated_rewards, generated_stats = \
+            run_episode(generated_env, seed=seed)
+
+        np.testing.assert_array_equal(observations, generated_observations)
+        np.testing.assert_array_equal(rewards, generated_rewards)
+        for name, value in generated_stats.items():
+            if np.ndim(value) == 0 and value is not None:
+                np.testing.assert_array_equal(stats[name], value, err_msg=name)
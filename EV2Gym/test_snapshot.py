@@ -0,0 +1,88 @@
+'''
+Checks that restoring an env.snapshot() replays the rest of the episode identically
+'''
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev2gym_env import EV2Gym
+
+CONFIGS = ['ev2gym/example_config_files/V2GProfitPlusLoads.yaml',
+           'ev2gym/example_config_files/PublicPST.yaml']
+# the statistics arrays of the environment compared after the episode
+ENV_ARRAYS = ('cs_power', 'cs_current', 'tr_power', 'tr_overload', 'port_current',
+              'port_current_signal', 'port_energy_level', 'current_power_usage',
+              'charge_power_potential')
+
+
+def finish_episode(env, seed) -> dict:
+    '''Steps the environment with random actions until the episode is done'''
+    rng = np.random.default_rng(seed)
+    observations, rewards = [], []
+    done = False
+    while not done:
+        observation, reward, done, _, _ = env.step(
+            rng.uniform(env.action_space.low, env.action_space.high))
+        observations.append(np.array(observation))
+        rewards.append(reward)
+
+    trajectory = {'observations': np.array(observations),
+                  'rewards': np.array(rewards),
+                  'evs': np.array([(ev.current_capacity, ev.charging_cycles) for ev in env.EVs])}
+    for name in ENV_ARRAYS:
+        trajectory[name] = np.array(getattr(env, name))
+    for name, value in env.stats.items():
+        if np.ndim(value) == 0 and value is not None:
+            trajectory[f'stats.{name}'] = value
+    for name, value in env.kpis.items():
+        trajectory[f'kpis.{name}'] = value
+    return trajectory
+
+
+def assert_same_trajectory(trajectory, other):
+    assert trajectory.keys() == other.keys()
+    for name, value in trajectory.items():
+        np.testing.assert_array_equal(other[name], value, err_msg=name)
+
+
+@pytest.mark.parametrize('use_array_engine', [False, True])
+@pytest.mark.parametrize('config_file', CONFIGS)
+def test_restore_replays_the_episode(config_file, use_array_engine):
+    env = EV2Gym(config_file=config_file, seed=7, use_array_engine=use_array_engine)
+    env.reset(seed=11)
+    rng = np.random.default_rng(3)
+    for _ in range(40):
+        env.step(rng.uniform(env.action_space.low, env.action_space.high))
+
+    snapshot = env.snapshot()
+    trajectory = finish_episode(env, seed=5)
+
+    # a diverging branch must not leak into the restored state
+    env.restore(snapshot)
+    finish_episode(env, seed=9)
+
+    env.restore(snapshot)
+    assert_same_trajectory(trajectory, finish_episode(env, seed=5))
+
+
+def test_restore_at_reset_matches_a_fresh_env():
+    env = EV2Gym(config_file=CONFIGS[0], seed=7)
+    env.reset(seed=11)
+    snapshot = env.snapshot()
+    trajectory = finish_episode(env, seed=1)
+
+    env.restore(snapshot)
+    assert_same_trajectory(trajectory, finish_episode(env, seed=1))
+
+    fresh = EV2Gym(config_file=CONFIGS[0], seed=7)
+    fresh.reset(seed=11)
+    assert_same_trajectory(trajectory, finish_episode(fresh, seed=1))
+
+
+def test_restore_rejects_snapshots_of_other_episodes():
+    env = EV2Gym(config_file=CONFIGS[0], seed=7)
+    env.reset(seed=11)
+    snapshot = env.snapshot()
+    env.reset(seed=12)
+    with pytest.raises(ValueError):
+        env.restore(snapshot)
@@ -0,0 +1,57 @@
+'''
+Checks that streaming the telemetry to disk records the same episodes as keeping it in memory
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.utilities.telemetry_recorder import open_telemetry
+
+N_EPISODES = 2
+
+
+def run_episodes(config_file, use_array_engine, **env_kwargs) -> tuple:
+    '''Runs N_EPISODES episodes with random actions, returns the environment and the telemetry, statistics and KPIs of every episode'''
+    env = EV2Gym(config_file=config_file, seed=7, use_array_engine=use_array_engine,
+                 **env_kwargs)
+    episodes = []
+    for episode in range(N_EPISODES):
+        env.reset(seed=11 + episode)
+        rng = np.random.default_rng(3 + episode)
+        done = False
+        while not done:
+            _, _, done, _, stats = env.step(
+                rng.uniform(env.action_space.low, env.action_space.high))
+        telemetry = {name: np.array(getattr(env, name)) for name in env.telemetry_arrays}
+        episodes.append((telemetry, stats, env.kpis))
+    return env, episodes
+
+
+@pytest.mark.parametrize('use_array_engine', [False, True])
+@pytest.mark.parametrize('config', ['V2GProfitPlusLoads', 'PublicPST'])
+def test_streamed_telemetry_matches_in_memory(tmp_path, config, use_array_engine):
+    config_file = f'ev2gym/example_config_files/{config}.yaml'
+    _, in_memory = run_episodes(config_file, use_array_engine)
+    # a chunk size that does not divide the simulation length
+    env, streamed = run_episodes(config_file, use_array_engine,
+                                 telemetry_path=str(tmp_path), telemetry_chunk_size=7)
+
+    for episode, ((telemetry, stats, kpis), (streamed_telemetry, streamed_stats, streamed_kpis)) in \
+            enumerate(zip(in_memory, streamed)):
+        assert telemetry.keys() == streamed_telemetry.keys()
+        for name, array in telemetry.items():
+            np.testing.assert_array_equal(streamed_telemetry[name], array, err_msg=name)
+        for name, value in stats.items():
+            if np.ndim(value) == 0 and value is not None:
+                np.testing.assert_array_equal(streamed_stats[name], value, err_msg=name)
+        for name, value in kpis.items():
+            np.testing.assert_array_equal(streamed_kpis[name], value, err_msg=name)
+
+        recorded = open_telemetry(os.path.join(tmp_path, env.sim_name, f'episode_{episode:05d}'))
+        assert recorded.keys() == telemetry.keys()
+        for name, array in telemetry.items():
+            assert recorded[name].dtype == array.dtype
+            np.testing.assert_array_equal(recorded[name], array, err_msg=name)